@@ -1,15 +1,16 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from flask_migrate import Migrate
 from .config import Config
+from .utils.cache import response_cache
+from .utils.metrics import metrics
+from .utils.frappe_proxy import frappe_proxy
+from .utils import routing
 
-db = SQLAlchemy()
-migrate = Migrate()
+db = routing.RoutingSQLAlchemy()
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
     
     # Configure CORS with multiple origins
     CORS(app, 
@@ -19,18 +20,43 @@ def create_app():
                  "https://lib.amobitsx7.tech"
              ]
          }},
-         allow_headers=["Content-Type"],
-         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+         allow_headers=["Content-Type", "Last-Event-ID", routing.PRIMARY_HEADER],
+         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+         # The read-your-writes cookie set by routing.init_app
+         supports_credentials=True
     )
     
     db.init_app(app)
-    migrate.init_app(app, db)
+    routing.init_app(app, db)
+    if app.config['ENABLE_MIGRATIONS']:
+        # Alembic is only needed by the `flask db` commands; production workers skip importing it
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    response_cache.init_app(app)
+    metrics.init_app(app)
+    from .utils.admission import admission
+    admission.init_app(app)
+    frappe_proxy.init_app(app)
+
+    from .utils.jobs import runner
+    runner.init_app(app)
+    from .utils.events import change_feed
+    change_feed.init_app(app)
+    from .utils.recommendations import recommender
+    recommender.init_app(app)
     
-    from .views import books, members, transactions, api_integration
+    from .views import books, members, transactions, api_integration, jobs, events, reports, recommendations
     
     app.register_blueprint(books.bp)
     app.register_blueprint(members.bp)
     app.register_blueprint(transactions.bp)
     app.register_blueprint(api_integration.bp)
+    app.register_blueprint(jobs.bp)
+    app.register_blueprint(events.bp)
+    app.register_blueprint(reports.bp)
+    app.register_blueprint(recommendations.bp)
+    
+    from . import commands
+    commands.init_app(app)
     
     return app
\ No newline at end of file
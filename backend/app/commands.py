@@ -0,0 +1,150 @@
+import sys
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from .utils.analytics import backfill
+from .utils.archive import run_archive
+from .utils.recommendations import build as build_recommendations
+from .utils.bulk import IMPORTS, EXPORT_COLUMNS, detect_format, export_rows, import_records, read_records
+from .utils.db_utils import init_db
+from .utils.dedup import scan_catalog
+from .utils.events import prune_events
+from .utils.fees import refresh_projections
+from .utils.jobs import JOB_TYPES, enqueue, runner
+from .utils.ledger import reconcile
+
+fees_cli = AppGroup('fees', help='Fee accrual maintenance.')
+ledger_cli = AppGroup('ledger', help='Debt ledger maintenance.')
+bulk_cli = AppGroup('bulk', help='Bulk CSV/NDJSON import and export.')
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+analytics_cli = AppGroup('analytics', help='Circulation rollups behind /api/reports.')
+recommendations_cli = AppGroup('recommendations', help='"Borrowed together" matrix behind /api/recommendations.')
+archive_cli = AppGroup('archive', help='Move long-returned loans out of the transaction table.')
+duplicates_cli = AppGroup('duplicates', help='Near-duplicate titles behind /api/books/duplicates.')
+events_cli = AppGroup('events', help='Change events behind /api/events.')
+
+@fees_cli.command('refresh')
+def refresh_fees():
+    """Recompute every member's projected fees from open loans (run daily)"""
+    members = refresh_projections()
+    click.echo(f'Refreshed fee projections for {members} members')
+
+@ledger_cli.command('reconcile')
+@click.option('--fix', is_flag=True, help='Reset mismatched balances to the ledger total.')
+def reconcile_ledger(fix):
+    """Verify member balances against the sum of their ledger entries"""
+    checked, mismatches = reconcile(fix=fix)
+    for member_id, balance, ledger in mismatches:
+        click.echo(f'member {member_id}: balance {balance} paise, ledger {ledger} paise')
+    click.echo(f'Checked {checked} members, {len(mismatches)} mismatched' + (' (fixed)' if fix and mismatches else ''))
+    if mismatches and not fix:
+        raise SystemExit(1)
+
+@bulk_cli.command('import')
+@click.argument('table', type=click.Choice(sorted(IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--on-duplicate', type=click.Choice(['skip', 'update']), default='skip',
+              help='What to do with rows whose ISBN/email already exists.')
+@click.option('--near-duplicates', type=click.Choice(['flag', 'merge', 'off']), default=None,
+              help='What to do with new books whose title nearly matches another (default: NEAR_DUPLICATE_ACTION).')
+def bulk_import(table, path, on_duplicate, near_duplicates):
+    """Load a .csv, .ndjson or gzipped (.gz) file into books or members"""
+    # Use FLASK_DEBUG=0 for large files: in debug mode Flask-SQLAlchemy keeps
+    # every statement and its parameters until the command exits
+    fmt, gzipped = detect_format(path)
+    with open(path, 'rb') as f:
+        summary = import_records(table, read_records(f, fmt, gzipped), on_duplicate,
+                                 near_duplicates=near_duplicates)
+    for error in summary['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Inserted {summary['inserted']}, updated {summary['updated']}, "
+               f"skipped {summary['skipped']}, invalid {summary['invalid']}"
+               + (f", merged {summary['merged']}, flagged {summary['flagged']}" if 'merged' in summary else ''))
+
+@bulk_cli.command('export')
+@click.argument('table', type=click.Choice(sorted(EXPORT_COLUMNS)))
+@click.argument('path')
+def bulk_export(table, path):
+    """Write a table to a .csv, .ndjson or gzipped (.gz) file, or NDJSON to stdout with -"""
+    fmt, gzipped = ('ndjson', False) if path == '-' else detect_format(path)
+    out = sys.stdout.buffer if path == '-' else open(path, 'wb')
+    try:
+        for chunk in export_rows(table, fmt, gzipped):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+@analytics_cli.command('backfill')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First day left to the live rollups (default: today, UTC).')
+def analytics_backfill(until):
+    """Rebuild the daily rollups for past days from the transaction history"""
+    progress = backfill(until.date() if until else None)
+    click.echo(f"Rolled up {progress['transactions']} transactions before {progress['until']}")
+
+@recommendations_cli.command('build')
+@click.option('--full', is_flag=True, help='Rebuild from every loan instead of adding the new ones.')
+def recommendations_build(full):
+    """Fold new loans into the co-borrow matrix and publish a new version"""
+    progress = build_recommendations(current_app.config['RECOMMENDATIONS_DIR'], full=full)
+    click.echo(f"Read loans {progress['from_transaction_id']}..{progress['to_transaction_id']} "
+               f"of {progress['members']} members; {progress.get('pairs', 'no new')} pairs")
+
+@archive_cli.command('run')
+@click.option('--days', type=int, default=None, help='Archive loans returned more than this many days ago.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches.')
+def archive_run(days, max_batches):
+    """Move returned loans past the horizon to transaction_archive, batch by batch"""
+    progress = run_archive(days, max_batches)
+    click.echo(f"Archived {progress['archived']} loans returned before {progress['cutoff']} "
+               f"in {progress['batches']} batches")
+
+@duplicates_cli.command('scan')
+@click.option('--threshold', type=float, default=None, help='Title similarity (0-1) that counts as a duplicate.')
+@click.option('--processes', type=int, default=None, help='Worker processes (default: DEDUP_PROCESSES).')
+def duplicates_scan(threshold, processes):
+    """Compare every book with every other and record the near-duplicate pairs"""
+    progress = scan_catalog(threshold, processes)
+    click.echo(f"Checked {progress['candidates']} candidate pairs among {progress['books']} books; "
+               f"{progress['duplicates']} duplicates, {progress['recorded']} new")
+
+@events_cli.command('prune')
+@click.option('--retention', type=int, default=None, help='Keep events this many seconds (default: CHANGE_FEED_RETENTION).')
+def events_prune(retention):
+    """Delete change events too old for any client to resume from"""
+    click.echo(f'Pruned {prune_events(retention)} change events')
+
+@jobs_cli.command('worker')
+def jobs_worker():
+    """Run queued jobs in the foreground until interrupted"""
+    click.echo(f'Running jobs with {runner.max_workers} threads, Ctrl+C to stop')
+    runner.run_forever()
+
+@jobs_cli.command('enqueue')
+@click.argument('job_type', type=click.Choice(sorted(JOB_TYPES)))
+@click.option('--param', '-p', multiple=True, metavar='NAME=VALUE', help='Job parameter; may be repeated.')
+def jobs_enqueue(job_type, param):
+    """Queue a job for the web workers or `flask jobs worker` to pick up"""
+    params = dict(item.split('=', 1) for item in param if '=' in item)
+    job = enqueue(job_type, params)
+    click.echo(f'Queued {job_type} job {job.id}')
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create all tables directly (development only; use `flask db upgrade` otherwise)"""
+    init_db()
+    click.echo('Initialized the database')
+
+def init_app(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(fees_cli)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(bulk_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(recommendations_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(duplicates_cli)
+    app.cli.add_command(events_cli)
@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy.ext.hybrid import hybrid_property
 from . import db
 
 class Book(db.Model):
@@ -10,17 +11,188 @@ class Book(db.Model):
     stock = db.Column(db.Integer, default=0)
     transactions = db.relationship('Transaction', backref='book', lazy=True)
 
+class BookDuplicate(db.Model):
+    """A newer book that looks like the same work as an older one under another ISBN.
+
+    Written by imports and the catalog scan for a librarian to review.
+    Dismissed pairs are kept so later scans do not flag them again.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, nullable=False)
+    duplicate_of_id = db.Column(db.Integer, nullable=False, index=True)
+    # Jaccard similarity of the normalized titles
+    similarity = db.Column(db.Float, nullable=False)
+    # 'import' or 'scan'
+    source = db.Column(db.String(20), nullable=False)
+    # open -> dismissed
+    status = db.Column(db.String(20), nullable=False, default='open')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('book_id', 'duplicate_of_id', name='uq_book_duplicate_pair'),
+        db.Index('ix_book_duplicate_status_id', 'status', 'id'),
+    )
+
 class Member(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    outstanding_debt = db.Column(db.Float, default=0.0)
+    # Running total of the member's ledger entries, in paise
+    debt_paise = db.Column(db.BigInteger, nullable=False, default=0)
     transactions = db.relationship('Transaction', backref='member', lazy=True)
 
+    @hybrid_property
+    def outstanding_debt(self):
+        return (self.debt_paise or 0) / 100
+
+    @outstanding_debt.setter
+    def outstanding_debt(self, value):
+        self.debt_paise = round(value * 100)
+
+    @outstanding_debt.expression
+    def outstanding_debt(cls):
+        return (cls.debt_paise / 100.0).label('outstanding_debt')
+
+class MemberFeeProjection(db.Model):
+    """Fees accrued on a member's open loans as of refreshed_at, not yet charged"""
+    member_id = db.Column(db.Integer, db.ForeignKey('member.id'), primary_key=True)
+    open_loans = db.Column(db.Integer, nullable=False, default=0)
+    accrued_fee = db.Column(db.Float, nullable=False, default=0.0)
+    refreshed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     book_id = db.Column(db.Integer, db.ForeignKey('book.id'), nullable=False)
     member_id = db.Column(db.Integer, db.ForeignKey('member.id'), nullable=False)
     issue_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     return_date = db.Column(db.DateTime)
-    rent_fee = db.Column(db.Float, default=0.0) 
\ No newline at end of file
+    rent_fee = db.Column(db.Float, default=0.0)
+
+    __table_args__ = (
+        # Serves the open-loan listing: return_date IS NULL, ordered/filtered by issue_date
+        db.Index('ix_transaction_return_date_issue_date', 'return_date', 'issue_date'),
+        # Foreign-key lookups, which also answer "open loans of this member/book"; with
+        # issue_date it also covers the fee engine's per-member aggregate of open loans
+        db.Index('ix_transaction_member_id_return_date_issue_date', 'member_id', 'return_date', 'issue_date'),
+        db.Index('ix_transaction_book_id_return_date', 'book_id', 'return_date'),
+        # Never hand out an id again once its row has moved to transaction_archive
+        {'sqlite_autoincrement': True},
+    )
+
+class TransactionArchive(db.Model):
+    """Returned loans moved out of the transaction table once older than ARCHIVE_AFTER_DAYS.
+
+    Rows keep their transaction id. book_id and member_id are deliberately
+    not foreign keys, like the ledger, so the history outlives deleted books.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    book_id = db.Column(db.Integer, nullable=False)
+    member_id = db.Column(db.Integer, nullable=False)
+    issue_date = db.Column(db.DateTime, nullable=False)
+    return_date = db.Column(db.DateTime, nullable=False)
+    rent_fee = db.Column(db.Float, default=0.0)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Loan history pages of a member or a book, in id order
+        db.Index('ix_transaction_archive_member_id_id', 'member_id', 'id'),
+        db.Index('ix_transaction_archive_book_id_id', 'book_id', 'id'),
+    )
+
+class CirculationDaily(db.Model):
+    """Library-wide loans, returns and fees per day. Loans count on their issue day,
+    returns and fees on their return day, so only today's row still changes"""
+    day = db.Column(db.Date, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    fees_paise = db.Column(db.BigInteger, nullable=False, default=0)
+
+class BookCirculationDaily(db.Model):
+    """Per-book daily rollup; book_id is not a foreign key so history outlives deleted books"""
+    day = db.Column(db.Date, primary_key=True)
+    book_id = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    fees_paise = db.Column(db.BigInteger, nullable=False, default=0)
+
+class MemberCirculationDaily(db.Model):
+    """Per-member daily rollup; member_id is not a foreign key so history outlives deleted members"""
+    day = db.Column(db.Date, primary_key=True)
+    member_id = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    fees_paise = db.Column(db.BigInteger, nullable=False, default=0)
+
+class CirculationDailyStaging(db.Model):
+    """CirculationDaily rows being rebuilt by the analytics backfill, swapped in once complete"""
+    day = db.Column(db.Date, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    fees_paise = db.Column(db.BigInteger, nullable=False, default=0)
+
+class BookCirculationDailyStaging(db.Model):
+    """BookCirculationDaily rows being rebuilt by the analytics backfill"""
+    day = db.Column(db.Date, primary_key=True)
+    book_id = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    fees_paise = db.Column(db.BigInteger, nullable=False, default=0)
+
+class MemberCirculationDailyStaging(db.Model):
+    """MemberCirculationDaily rows being rebuilt by the analytics backfill"""
+    day = db.Column(db.Date, primary_key=True)
+    member_id = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    fees_paise = db.Column(db.BigInteger, nullable=False, default=0)
+
+class LedgerEntry(db.Model):
+    """Append-only record of every change to a member's debt, in paise.
+
+    Fees are positive, payments and waivers negative. member_id and
+    transaction_id are deliberately not foreign keys so the history
+    outlives deleted members and archived loans.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    member_id = db.Column(db.Integer, nullable=False)
+    transaction_id = db.Column(db.Integer)
+    kind = db.Column(db.String(20), nullable=False)
+    amount_paise = db.Column(db.BigInteger, nullable=False)
+    note = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_ledger_entry_member_id_id', 'member_id', 'id'),
+    )
+
+class Job(db.Model):
+    """Background job. The table is the queue, so queued work survives restarts"""
+    id = db.Column(db.String(32), primary_key=True)
+    type = db.Column(db.String(50), nullable=False)
+    # queued -> running -> finished | failed; failed attempts with retries left go back to queued
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    params = db.Column(db.Text, nullable=False, default='{}')
+    progress = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Serves the runner's poll for due jobs and the running-per-type count
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+class ChangeEvent(db.Model):
+    """Inventory change, written in the same transaction as the change itself and streamed by the SSE feed"""
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(30), nullable=False)
+    # JSON payload
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
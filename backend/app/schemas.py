@@ -1,23 +1,53 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate, EXCLUDE
+
+# Input validation only; responses are built from column tuples in utils/serialization.py.
+# Schema instances are created once at import so field validators are built a single time.
 
 class BookSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
     id = fields.Int(dump_only=True)
-    title = fields.Str(required=True)
-    author = fields.Str(required=True)
-    isbn = fields.Str(required=True)
-    publisher = fields.Str()
-    stock = fields.Int(required=True)
+    title = fields.Str(required=True, validate=validate.Length(min=1, max=200))
+    author = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    isbn = fields.Str(required=True, validate=validate.Length(min=1, max=13))
+    publisher = fields.Str(allow_none=True, validate=validate.Length(max=100))
+    stock = fields.Int(load_default=0, validate=validate.Range(min=0))
 
 class MemberSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
     id = fields.Int(dump_only=True)
-    name = fields.Str(required=True)
-    email = fields.Str(required=True)
+    name = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    email = fields.Email(required=True, validate=validate.Length(max=120))
     outstanding_debt = fields.Float(dump_only=True)
 
 class TransactionSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
     id = fields.Int(dump_only=True)
     book_id = fields.Int(required=True)
     member_id = fields.Int(required=True)
     issue_date = fields.DateTime(dump_only=True)
     return_date = fields.DateTime(dump_only=True)
-    rent_fee = fields.Float(dump_only=True) 
\ No newline at end of file
+    rent_fee = fields.Float(dump_only=True)
+
+book_schema = BookSchema()
+book_update_schema = BookSchema(partial=True)
+member_schema = MemberSchema()
+member_update_schema = MemberSchema(partial=True)
+issue_schema = TransactionSchema()
+issue_batch_schema = TransactionSchema(many=True)
+
+def error_message(err):
+    """Flatten a marshmallow ValidationError into the single string the clients display"""
+    parts = []
+    for field, messages in err.messages.items():
+        if isinstance(messages, dict):
+            # many=True: errors are keyed by item index
+            parts += [f'item {field}: {name}: {" ".join(msgs)}' for name, msgs in messages.items()]
+        else:
+            parts.append(f'{field}: {" ".join(messages)}')
+    return '; '.join(parts)
@@ -0,0 +1,201 @@
+import math
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from flask import current_app, g, request
+from .serialization import jsonify
+
+logger = logging.getLogger(__name__)
+
+READ, WRITE, HEAVY = 'read', 'write', 'heavy'
+
+# X-Request-Start samples further off than this are clock skew or garbage, and
+# are dropped; others count for at most QUEUE_DELAY_CLAMP times the budget
+QUEUE_DELAY_IMPLAUSIBLE = 60.0
+QUEUE_DELAY_CLAMP = 4
+
+# Refill and take one token atomically. The caller passes its clock, so fakes and
+# old servers without effect replication behave the same; buckets expire once full
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+def parse_limits(spec):
+    """{'read': (rate, burst), ...} from 'read=20/60,write=5/20' (tokens per second/burst)"""
+    limits = {}
+    for part in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = part.partition('=')
+        rate, _, burst = value.partition('/')
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+class MemoryBucketStore:
+    """Token buckets in this process; the least recently used are dropped past max_keys"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Take one token; returns 0 when granted, else seconds until one is available"""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+class RedisBucketStore:
+    """Token buckets shared by every worker, updated by a Lua script.
+
+    Takes any client with redis-py's register_script, so a local fake
+    (fakeredis) can stand in for a server.
+    """
+
+    def __init__(self, client):
+        self._take = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, burst, now):
+        return float(self._take(keys=[key], args=[rate, burst, now]))
+
+class AdmissionControl:
+    """Rate limits, concurrency caps and load shedding in front of the API blueprints.
+
+    Every request falls in an endpoint class: 'read' (GET) and 'write' by
+    default, or whatever the view declares with limit_class(). Each client
+    has a token bucket per class. 'heavy' views also share
+    ADMISSION_HEAVY_CONCURRENCY slots per process. While requests wait
+    longer than ADMISSION_QUEUE_BUDGET_MS in front of the app, heavy ones
+    are refused outright, so the reads behind them keep moving. Client
+    addresses and queue times come from proxy headers only when
+    TRUSTED_PROXY_HOPS says there are proxies to set them.
+    """
+
+    def __init__(self):
+        self.store = MemoryBucketStore()
+        self.stats = Counter()
+        self.queue_delay = 0.0
+        self._slots = None
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['RATE_LIMIT_ENABLED']
+        self.limits = parse_limits(config['RATE_LIMITS'])
+        self.proxy_hops = config['TRUSTED_PROXY_HOPS']
+        self.heavy_wait = config['ADMISSION_HEAVY_WAIT']
+        self.queue_budget = config['ADMISSION_QUEUE_BUDGET_MS'] / 1000
+        self._slots = threading.BoundedSemaphore(config['ADMISSION_HEAVY_CONCURRENCY'])
+        if config['RATE_LIMIT_STORE'] == 'redis':
+            import redis
+            self.store = RedisBucketStore(redis.Redis.from_url(config['RATE_LIMIT_REDIS_URL']))
+        else:
+            self.store = MemoryBucketStore(config['RATE_LIMIT_MAX_KEYS'])
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def limit_class(self, name, methods=None):
+        """Put a view (or some of its methods) in endpoint class `name`; None exempts it"""
+        def decorator(view):
+            classes = getattr(view, 'admission_classes', {})
+            for method in methods or (None,):
+                classes[method] = name
+            view.admission_classes = classes
+            return view
+        return decorator
+
+    def _class_of(self):
+        view = current_app.view_functions.get(request.endpoint)
+        classes = getattr(view, 'admission_classes', {})
+        default = READ if request.method in ('GET', 'HEAD') else WRITE
+        return classes.get(request.method, classes.get(None, default))
+
+    def _client(self):
+        # Behind N proxies that append to X-Forwarded-For, the client is the Nth address from the right
+        route = request.access_route
+        if self.proxy_hops and len(route) >= self.proxy_hops:
+            return route[-self.proxy_hops]
+        return request.remote_addr
+
+    def _observe_queue_delay(self):
+        """Seconds this request waited before reaching the app, from the proxy's X-Request-Start"""
+        if not self.proxy_hops:
+            # Without a proxy in front, the header is whatever the client made up
+            return 0.0
+        header = request.headers.get('X-Request-Start', '').strip()
+        try:
+            start = float(header[2:] if header.startswith('t=') else header)
+        except ValueError:
+            return 0.0
+        # nginx sends seconds ($msec); other proxies send milliseconds or microseconds
+        while start > 1e11:
+            start /= 1000
+        delay = time.time() - start
+        if not 0 <= delay <= QUEUE_DELAY_IMPLAUSIBLE:
+            return 0.0
+        delay = min(delay, QUEUE_DELAY_CLAMP * self.queue_budget)
+        self.queue_delay = 0.8 * self.queue_delay + 0.2 * delay
+        return delay
+
+    def _reject(self, klass, outcome, status, retry_after, message):
+        self.stats[(klass, outcome)] += 1
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def _before_request(self):
+        if not self.enabled or request.blueprint is None or request.method == 'OPTIONS':
+            return None
+        klass = self._class_of()
+        if klass is None:
+            return None
+        delay = max(self._observe_queue_delay(), self.queue_delay)
+        if klass == HEAVY and delay > self.queue_budget:
+            return self._reject(klass, 'shed', 503, delay, 'Server is busy, try again shortly')
+
+        limit = self.limits.get(klass)
+        if limit is not None:
+            try:
+                wait = self.store.take(f'ratelimit:{klass}:{self._client()}', *limit, time.time())
+            except Exception:
+                # A broken store must not take the API down with it
+                logger.exception('Rate limit store failed; admitting request')
+                wait = 0
+            if wait:
+                return self._reject(klass, 'rate_limited', 429, wait, 'Too many requests, slow down')
+
+        if klass == HEAVY:
+            if not self._slots.acquire(timeout=self.heavy_wait):
+                return self._reject(klass, 'busy', 503, self.heavy_wait, 'Server is busy, try again shortly')
+            g.admission_slot = True
+        self.stats[(klass, 'admitted')] += 1
+        return None
+
+    def _teardown_request(self, exc):
+        # Streamed responses (exports) keep their slot until the stream is closed
+        if g.pop('admission_slot', None):
+            self._slots.release()
+
+admission = AdmissionControl()
+limit_class = admission.limit_class
@@ -0,0 +1,181 @@
+from collections import defaultdict
+from datetime import datetime, time
+from sqlalchemy import bindparam, func, or_, select
+from sqlalchemy.exc import IntegrityError
+from ..models import (
+    Book, BookCirculationDaily, BookCirculationDailyStaging, CirculationDaily, CirculationDailyStaging,
+    Member, MemberCirculationDaily, MemberCirculationDailyStaging, db
+)
+from .archive import iter_loans
+from .cache import invalidate
+from .ledger import to_paise, to_rupees
+
+# Each rollup table with the column it is broken down by, if any
+ROLLUPS = ((CirculationDaily, None), (BookCirculationDaily, 'book_id'), (MemberCirculationDaily, 'member_id'))
+# Where the backfill rebuilds each rollup table before swapping the rows in
+STAGING = {CirculationDaily: CirculationDailyStaging, BookCirculationDaily: BookCirculationDailyStaging,
+           MemberCirculationDaily: MemberCirculationDailyStaging}
+# Distinct (day, key) rows the backfill accumulates before adding them to the tables
+BACKFILL_FLUSH_ROWS = 20000
+
+def _add(model, key, deltas):
+    """Add {(day, key_id): [loans, returns, fees_paise]} onto a rollup table.
+
+    One executemany UPDATE adds onto existing rows; rows that did not exist
+    yet are inserted. If another request created some of them first, the
+    rows are retried one at a time, each falling back to the UPDATE.
+    """
+    table = model.__table__
+    where = [table.c.day == bindparam('r_day')]
+    if key:
+        where.append(table.c[key] == bindparam('r_key'))
+    update = table.update().where(*where).values(
+        loans=table.c.loans + bindparam('r_loans'),
+        returns=table.c.returns + bindparam('r_returns'),
+        fees_paise=table.c.fees_paise + bindparam('r_fees')
+    )
+    params = []
+    for (day, key_id), (loans, returns, fees_paise) in deltas.items():
+        param = {'r_day': day, 'r_loans': loans, 'r_returns': returns, 'r_fees': fees_paise}
+        if key:
+            param['r_key'] = key_id
+        params.append(param)
+
+    updated = db.session.execute(update, params).rowcount
+    if db.engine.dialect.supports_sane_multi_rowcount and updated == len(params):
+        return
+
+    columns = [table.c.day] + ([table.c[key]] if key else [])
+    query = db.session.query(*columns).filter(table.c.day.in_({param['r_day'] for param in params}))
+    if key:
+        query = query.filter(table.c[key].in_({param['r_key'] for param in params}))
+    existing = {(row[0], row[1] if key else None) for row in query}
+    missing = [param for param in params if (param['r_day'], param.get('r_key')) not in existing]
+    if not missing:
+        return
+    rows = []
+    for param in missing:
+        row = {'day': param['r_day'], 'loans': param['r_loans'], 'returns': param['r_returns'],
+               'fees_paise': param['r_fees']}
+        if key:
+            row[key] = param['r_key']
+        rows.append(row)
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert(), rows)
+    except IntegrityError:
+        for row, param in zip(rows, missing):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert(), row)
+            except IntegrityError:
+                db.session.execute(update, param)
+
+class Rollup:
+    """Circulation counts gathered in memory, then added to all rollup tables at once"""
+
+    def __init__(self, staging=False):
+        self.staging = staging
+        self.deltas = {model: defaultdict(lambda: [0, 0, 0]) for model, _ in ROLLUPS}
+
+    def __len__(self):
+        return sum(len(deltas) for deltas in self.deltas.values())
+
+    def add(self, day, book_id, member_id, loans=0, returns=0, fees_paise=0):
+        for (model, _), key_id in zip(ROLLUPS, (None, book_id, member_id)):
+            delta = self.deltas[model][(day, key_id)]
+            delta[0] += loans
+            delta[1] += returns
+            delta[2] += fees_paise
+
+    def flush(self):
+        for model, key in ROLLUPS:
+            if self.deltas[model]:
+                _add(STAGING[model] if self.staging else model, key, self.deltas[model])
+                self.deltas[model].clear()
+
+def rollup_issues(loans):
+    """Count (book_id, member_id, issue_date) loans into the rollups, in the caller's transaction"""
+    rollup = Rollup()
+    for book_id, member_id, issue_date in loans:
+        rollup.add(issue_date.date(), book_id, member_id, loans=1)
+    rollup.flush()
+
+def rollup_returns(returns):
+    """Count (book_id, member_id, return_date, rent_fee) returns and their fees into the rollups"""
+    rollup = Rollup()
+    for book_id, member_id, return_date, rent_fee in returns:
+        rollup.add(return_date.date(), book_id, member_id, returns=1, fees_paise=to_paise(rent_fee or 0))
+    rollup.flush()
+
+def backfill(until=None, progress=None):
+    """Rebuild the rollups for the days before `until` (default today, UTC) from history.
+
+    Loans, hot and archived, are read once, in id order and keyset batches,
+    and their counts are added to the staging tables every
+    BACKFILL_FLUSH_ROWS rows, so memory stays flat. The rebuilt rows replace
+    the old ones in a single transaction at the end, so reports never see a
+    partial rebuild. Rows from `until` on are only ever written by the issue
+    and return paths, so this can run while the library is open.
+    """
+    until = until or datetime.utcnow().date()
+    cutoff = datetime.combine(until, time.min)
+    progress = progress if progress is not None else {}
+    progress.update({'until': until.isoformat(), 'transactions': 0})
+
+    for staging in STAGING.values():
+        staging.query.delete(synchronize_session=False)
+    db.session.commit()
+
+    rollup = Rollup(staging=True)
+    for loan in iter_loans(lambda model: (or_(model.issue_date < cutoff, model.return_date < cutoff),)):
+        if loan.issue_date < cutoff:
+            rollup.add(loan.issue_date.date(), loan.book_id, loan.member_id, loans=1)
+        if loan.return_date is not None and loan.return_date < cutoff:
+            rollup.add(loan.return_date.date(), loan.book_id, loan.member_id,
+                       returns=1, fees_paise=to_paise(loan.rent_fee or 0))
+        progress['transactions'] += 1
+        if len(rollup) >= BACKFILL_FLUSH_ROWS:
+            rollup.flush()
+            db.session.commit()
+    rollup.flush()
+    db.session.commit()
+
+    for model, staging in STAGING.items():
+        columns = [column.name for column in model.__table__.columns]
+        model.query.filter(model.day < until).delete(synchronize_session=False)
+        db.session.execute(model.__table__.insert().from_select(
+            columns, select(*(staging.__table__.c[name] for name in columns))))
+        staging.query.delete(synchronize_session=False)
+    db.session.commit()
+    invalidate('transactions')
+    return progress
+
+def daily_totals(start, end):
+    rows = CirculationDaily.query.filter(CirculationDaily.day.between(start, end)).order_by(CirculationDaily.day)
+    return [{'day': row.day.isoformat(), 'loans': row.loans, 'returns': row.returns,
+             'fees': to_rupees(row.fees_paise)} for row in rows]
+
+def _top(model, key, start, end, limit):
+    key_column = getattr(model, key)
+    loans = func.sum(model.loans).label('loans')
+    return db.session.query(key_column, loans, func.sum(model.fees_paise).label('fees_paise')) \
+        .filter(model.day.between(start, end)) \
+        .group_by(key_column).order_by(loans.desc(), key_column).limit(limit).all()
+
+def top_books(start, end, limit):
+    rows = _top(BookCirculationDaily, 'book_id', start, end, limit)
+    titles = dict(db.session.query(Book.id, Book.title).filter(Book.id.in_([row.book_id for row in rows])))
+    return [{'book_id': row.book_id, 'title': titles.get(row.book_id), 'loans': int(row.loans),
+             'fees': to_rupees(int(row.fees_paise))} for row in rows]
+
+def member_activity(start, end, limit):
+    active = db.session.query(func.count(func.distinct(MemberCirculationDaily.member_id))) \
+        .filter(MemberCirculationDaily.day.between(start, end)).scalar()
+    rows = _top(MemberCirculationDaily, 'member_id', start, end, limit)
+    names = dict(db.session.query(Member.id, Member.name).filter(Member.id.in_([row.member_id for row in rows])))
+    return {
+        'active_members': active,
+        'top_members': [{'member_id': row.member_id, 'name': names.get(row.member_id), 'loans': int(row.loans),
+                         'fees': to_rupees(int(row.fees_paise))} for row in rows]
+    }
@@ -1,34 +1,168 @@
+import threading
 import requests
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, List, Iterable, Optional
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
 from ..models import Book, db
+from .events import publish_many
+from .search_index import index_book
+from .cache import invalidate
+from .dedup import add_copies, record_duplicates, split_duplicates
+from .serialization import BOOK_COLUMNS, book_to_dict
 
-def import_books_from_frappe(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+# Tries per chunk when a concurrent import inserts one of its ISBNs first
+CHUNK_ATTEMPTS = 3
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """Shared HTTP session with a connection pool and retry/backoff for Frappe"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                config = current_app.config
+                retry = Retry(
+                    total=config['FRAPPE_MAX_RETRIES'],
+                    backoff_factor=config['FRAPPE_BACKOFF_FACTOR'],
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=('GET',)
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=config['FRAPPE_CONCURRENCY'],
+                    max_retries=retry
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+def fetch_page(session: requests.Session, url: str, params: Dict[str, Any], timeout: float) -> List[Dict[str, Any]]:
+    """Fetch one page of books from the Frappe API"""
+    response = session.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json().get('message', [])
+
+def fetch_pages(params: Dict[str, Any], pages: int = 1) -> Iterable[List[Dict[str, Any]]]:
+    """Yield pages of books, fetching up to FRAPPE_CONCURRENCY pages at a time.
+
+    Pages are requested in waves starting at params['page'] (default 1) and
+    fetching stops at the first empty page or after `pages` pages.
+    """
+    config = current_app.config
+    url = config['FRAPPE_API_URL']
+    timeout = config['FRAPPE_TIMEOUT']
+    concurrency = max(1, config['FRAPPE_CONCURRENCY'])
+    session = get_session()
+    params = dict(params or {})
+    first_page = int(params.pop('page', 1))
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, pages)) as executor:
+        for wave_start in range(first_page, first_page + pages, concurrency):
+            wave = range(wave_start, min(wave_start + concurrency, first_page + pages))
+            results = executor.map(lambda page: fetch_page(session, url, dict(params, page=page), timeout), wave)
+            for books_data in results:
+                if not books_data:
+                    return
+                yield books_data
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _save_chunk(chunk: List[Dict[str, Any]], near_duplicates: Optional[str]) -> Dict[str, int]:
+    """Insert one chunk's new books and commit; returns its counts"""
+    counts = {'imported': 0, 'skipped': 0, 'merged': 0, 'flagged': 0}
+    rows = {}
+    for book_data in chunk:
+        isbn = book_data.get('isbn')
+        if not isbn or isbn in rows:
+            counts['skipped'] += 1
+            continue
+        rows[isbn] = {
+            'title': book_data['title'],
+            'author': book_data['authors'],
+            'isbn': isbn,
+            'publisher': book_data.get('publisher'),
+            'stock': 1  # Default stock value
+        }
+
+    existing = {isbn for (isbn,) in db.session.query(Book.isbn).filter(Book.isbn.in_(list(rows)))}
+    new_rows = [row for isbn, row in rows.items() if isbn not in existing]
+    counts['skipped'] += len(rows) - len(new_rows)
+    kept, copies, pairs = split_duplicates(new_rows, near_duplicates)
+    counts['merged'] = len(new_rows) - len(kept)
+    new_rows = kept
+    if not new_rows and not copies:
+        return counts
+
+    add_copies(copies)
+    books = []
+    if new_rows:
+        db.session.bulk_insert_mappings(Book, new_rows)
+        books = db.session.query(*BOOK_COLUMNS).filter(Book.isbn.in_([row['isbn'] for row in new_rows])).all()
+        publish_many('book.created', [book_to_dict(book) for book in books])
+        # A flagged row duplicates a catalog book (an id) or an earlier row of this chunk
+        ids = {book.isbn: book.id for book in books}
+        counts['flagged'] = record_duplicates([(ids[row['isbn']], other if isinstance(other, int) else ids[other['isbn']],
+                                                similarity) for row, other, similarity in pairs])
+    db.session.commit()
+    counts['imported'] = len(new_rows)
+    for book in books:
+        index_book(book)
+    invalidate('books')
+    return counts
+
+def save_books(books_data: List[Dict[str, Any]], chunk_size: Optional[int] = None,
+               near_duplicates: Optional[str] = None) -> Dict[str, int]:
+    """Insert books whose ISBN is not in the catalog yet.
+
+    Each chunk costs one `isbn IN (...)` lookup and one bulk insert. Books
+    whose title and author nearly match another are flagged or merged per
+    `near_duplicates` (default NEAR_DUPLICATE_ACTION). When another import
+    inserts one of the chunk's ISBNs first, the chunk is rolled back and
+    redone in a new transaction, which then sees that book and skips it.
+    """
+    chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+    totals = {'imported': 0, 'skipped': 0, 'merged': 0, 'flagged': 0}
+
+    for chunk in _chunks(books_data, chunk_size):
+        for attempt in range(1, CHUNK_ATTEMPTS + 1):
+            try:
+                counts = _save_chunk(chunk, near_duplicates)
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == CHUNK_ATTEMPTS:
+                    raise
+        for key, count in counts.items():
+            totals[key] += count
+
+    return totals
+
+def run_import(params: Dict[str, Any], pages: int = 1, progress: Optional[Dict[str, Any]] = None,
+               near_duplicates: Optional[str] = None) -> Dict[str, Any]:
+    """Fetch pages from Frappe and save them, updating `progress` as it goes"""
+    progress = progress if progress is not None else {}
+    progress.update({'pages_fetched': 0, 'fetched': 0, 'imported': 0, 'skipped': 0, 'merged': 0, 'flagged': 0})
+    for books_data in fetch_pages(params, pages):
+        result = save_books(books_data, near_duplicates=near_duplicates)
+        progress['pages_fetched'] += 1
+        progress['fetched'] += len(books_data)
+        for key in ('imported', 'skipped', 'merged', 'flagged'):
+            progress[key] += result[key]
+    return progress
+
+def import_books_from_frappe(params: Dict[str, Any], pages: int = 1) -> Dict[str, Any]:
     """Helper function to call Frappe API and import books"""
-    url = 'https://frappe.io/api/method/frappe-library'
-    
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        books_data = response.json().get('message', [])
-        
-        imported_books = []
-        for book_data in books_data:
-            # Check if book already exists
-            existing_book = Book.query.filter_by(isbn=book_data['isbn']).first()
-            if not existing_book:
-                book = Book(
-                    title=book_data['title'],
-                    author=book_data['authors'],
-                    isbn=book_data['isbn'],
-                    publisher=book_data['publisher'],
-                    stock=1  # Default stock value
-                )
-                db.session.add(book)
-                imported_books.append(book)
-        
-        if imported_books:
-            db.session.commit()
-            
-        return imported_books
+        return run_import(params, pages)
     except requests.RequestException as e:
-        raise Exception(f"Failed to fetch books from Frappe API: {str(e)}") 
\ No newline at end of file
+        db.session.rollback()
+        raise Exception(f"Failed to fetch books from Frappe API: {str(e)}")
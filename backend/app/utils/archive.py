@@ -0,0 +1,99 @@
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import DateTime, func, literal, select, union_all
+from ..models import Transaction, TransactionArchive, db
+from .cache import invalidate
+
+LOAN_COLUMNS = ('id', 'book_id', 'member_id', 'issue_date', 'return_date', 'rent_fee')
+
+def both_tables(build):
+    """UNION ALL, as a subquery, of build(model, archived) over the hot and the archive table.
+
+    Put filters, ORDER BY and LIMIT inside `build` so each branch runs on its
+    own table's indexes; databases do not reliably push a predicate on the
+    union down into its branches.
+    """
+    return union_all(*(select(build(model, archived).subquery())
+                       for model, archived in ((Transaction, False), (TransactionArchive, True)))).subquery('loans')
+
+def iter_loans(where, batch_size=5000):
+    """Yield every loan, hot or archived, matching where(model) in id order.
+
+    Each keyset batch is one statement over both tables, so a loan being
+    archived at the same time is seen exactly once.
+    """
+    after = 0
+    while True:
+        loans = both_tables(lambda model, _: select(*(getattr(model, name) for name in LOAN_COLUMNS))
+                            .where(model.id > after, *where(model)).order_by(model.id).limit(batch_size))
+        rows = db.session.execute(select(loans).order_by(loans.c.id).limit(batch_size)).all()
+        if not rows:
+            return
+        yield from rows
+        after = rows[-1].id
+
+def history_page(after, limit, member_id=None, book_id=None):
+    """One keyset page of loans, open, returned or archived, optionally for one member or book"""
+    def build(model, archived):
+        query = select(*(getattr(model, name) for name in LOAN_COLUMNS), literal(archived).label('archived')) \
+            .where(model.id > after)
+        if member_id is not None:
+            query = query.where(model.member_id == member_id)
+        if book_id is not None:
+            query = query.where(model.book_id == book_id)
+        return query.order_by(model.id).limit(limit)
+    loans = both_tables(build)
+    return db.session.execute(select(loans).order_by(loans.c.id).limit(limit)).all()
+
+def archive_batch(cutoff, batch_size):
+    """Move up to batch_size loans returned before cutoff into the archive; returns how many moved.
+
+    Candidates are found with a plain read of the return_date index. They
+    are then locked by primary key only: a locking range scan there would
+    also lock the gap where new open loans (return_date NULL) are inserted.
+    The newest loan always stays, and nothing else deletes loans: MySQL 5.7
+    after a restart hands out max(id) + 1 as the next id, which could repeat
+    an archived one. (SQLite is created with AUTOINCREMENT, which never does.)
+    """
+    newest = db.session.query(func.max(Transaction.id)).scalar()
+    ids = [transaction_id for (transaction_id,) in db.session.query(Transaction.id)
+           .filter(Transaction.return_date < cutoff, Transaction.id < newest)
+           .order_by(Transaction.return_date).limit(batch_size)] if newest else []
+    if not ids:
+        return 0
+    ids = [transaction_id for (transaction_id,) in db.session.query(Transaction.id)
+           .filter(Transaction.id.in_(ids)).with_for_update()]
+    if ids:
+        columns = [getattr(Transaction, name) for name in LOAN_COLUMNS]
+        db.session.execute(TransactionArchive.__table__.insert().from_select(
+            list(LOAN_COLUMNS) + ['archived_at'],
+            select(*columns, literal(datetime.utcnow(), DateTime())).where(Transaction.id.in_(ids))
+        ))
+        db.session.execute(Transaction.__table__.delete().where(Transaction.id.in_(ids)))
+    db.session.commit()
+    return len(ids)
+
+def run_archive(days=None, max_batches=None, progress=None):
+    """Archive loans returned more than `days` ago, one short transaction per batch.
+
+    Batches are ARCHIVE_BATCH_SIZE loans with ARCHIVE_PAUSE_SECONDS between
+    them, so issue/return traffic never waits long behind the archiver.
+    """
+    config = current_app.config
+    days = config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    progress = progress if progress is not None else {}
+    progress.update({'cutoff': cutoff.isoformat(), 'archived': 0, 'batches': 0})
+    try:
+        while max_batches is None or progress['batches'] < max_batches:
+            moved = archive_batch(cutoff, config['ARCHIVE_BATCH_SIZE'])
+            if not moved:
+                break
+            progress['archived'] += moved
+            progress['batches'] += 1
+            time.sleep(config['ARCHIVE_PAUSE_SECONDS'])
+    finally:
+        if progress['archived']:
+            invalidate('transactions')
+    return progress
@@ -0,0 +1,282 @@
+import io
+import csv
+import json
+import gzip
+import zlib
+import datetime
+from itertools import islice
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import IntegrityError
+from ..models import Book, Member, Transaction, TransactionArchive, db
+from .cache import invalidate
+from .dedup import add_copies, record_duplicates, split_duplicates
+from .events import publish
+from .search_index import index_book, search_index
+from .serialization import dumps
+from .validation import validate_isbn
+
+FORMATS = ('csv', 'ndjson')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+MAX_REPORTED_ERRORS = 100
+
+EXPORT_COLUMNS = {
+    'books': (Book.id, Book.title, Book.author, Book.isbn, Book.publisher, Book.stock),
+    'members': (Member.id, Member.name, Member.email, Member.outstanding_debt),
+    'transactions': (Transaction.id, Transaction.book_id, Transaction.member_id,
+                     Transaction.issue_date, Transaction.return_date, Transaction.rent_fee),
+    'transactions_archive': (TransactionArchive.id, TransactionArchive.book_id, TransactionArchive.member_id,
+                             TransactionArchive.issue_date, TransactionArchive.return_date,
+                             TransactionArchive.rent_fee, TransactionArchive.archived_at),
+}
+
+def detect_format(filename):
+    """Return (format, gzipped) from a name like books.csv or books.ndjson.gz"""
+    name = filename.lower()
+    gzipped = name.endswith('.gz')
+    if gzipped:
+        name = name[:-3]
+    for fmt in FORMATS:
+        if name.endswith('.' + fmt):
+            return fmt, gzipped
+    if name.endswith('.jsonl'):
+        return 'ndjson', gzipped
+    raise ValueError(f'Cannot tell the format of {filename}; use .csv or .ndjson')
+
+def _check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+def read_records(stream, fmt, gzipped=False):
+    """Yield (line number, dict) from a binary CSV or NDJSON stream, one record at a time"""
+    _check_format(fmt)
+    if gzipped:
+        stream = gzip.GzipFile(fileobj=stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_no, line in enumerate(text, 1):
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = e
+            if not isinstance(record, (dict, Exception)):
+                record = ValueError('expected a JSON object')
+            yield line_no, record
+
+def _text(record, field, max_length, required=True):
+    value = record.get(field)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise ValueError(f'{field} is required')
+        return None
+    if len(value) > max_length:
+        raise ValueError(f'{field} is longer than {max_length} characters')
+    return value
+
+def _book_row(record):
+    isbn = _text(record, 'isbn', 17).replace('-', '')
+    if not validate_isbn(isbn):
+        raise ValueError(f'invalid ISBN {isbn}')
+    stock = record.get('stock')
+    try:
+        stock = int(stock) if stock not in (None, '') else 0
+    except ValueError:
+        raise ValueError(f'stock must be a whole number, not {stock!r}')
+    if stock < 0:
+        raise ValueError('stock must not be negative')
+    return {
+        'title': _text(record, 'title', 200),
+        'author': _text(record, 'author', 100),
+        'isbn': isbn,
+        'publisher': _text(record, 'publisher', 100, required=False),
+        'stock': stock
+    }
+
+def _member_row(record):
+    email = _text(record, 'email', 120)
+    if '@' not in email:
+        raise ValueError(f'invalid email {email}')
+    return {'name': _text(record, 'name', 100), 'email': email, 'debt_paise': 0}
+
+# Per table: model, natural key, row builder and the columns an upsert overwrites
+IMPORTS = {
+    'books': (Book, 'isbn', _book_row, ('title', 'author', 'publisher', 'stock')),
+    'members': (Member, 'email', _member_row, ('name',)),
+}
+
+def _insert_rows(model, key, rows):
+    """Insert rows under a savepoint; return the keys that another import inserted first"""
+    try:
+        with db.session.begin_nested():
+            db.session.execute(model.__table__.insert(), rows)
+        return set()
+    except IntegrityError:
+        # A concurrent import inserted some of the same keys; insert the others one by one
+        taken = set()
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(model.__table__.insert(), row)
+            except IntegrityError:
+                taken.add(row[key])
+        return taken
+
+def import_records(table, records, on_duplicate='skip', chunk_size=None, near_duplicates=None):
+    """Insert or upsert (line number, dict) records in chunks and return a summary.
+
+    Each chunk costs one `key IN (...)` lookup, one multi-row INSERT and, with
+    on_duplicate='update', one executemany UPDATE, then commits. Invalid
+    records are skipped and reported with their line number, and keys that
+    another import inserts meanwhile count as existing. New books that
+    nearly match another title are flagged or merged per `near_duplicates`.
+    """
+    if on_duplicate not in ('skip', 'update'):
+        raise ValueError("on_duplicate must be 'skip' or 'update'")
+    model, key, build_row, updatable = IMPORTS[table]
+    key_column = getattr(model, key)
+    chunk_size = chunk_size or current_app.config['BULK_CHUNK_SIZE']
+    update = model.__table__.update() \
+        .where(key_column == bindparam('b_key')) \
+        .values({column: bindparam(f'b_{column}') for column in updatable})
+    summary = {'inserted': 0, 'updated': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    if model is Book:
+        summary.update({'merged': 0, 'flagged': 0})
+
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        rows = {}
+        for line_no, record in chunk:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                row = build_row(record)
+            except (ValueError, TypeError, AttributeError) as e:
+                summary['invalid'] += 1
+                if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                    summary['errors'].append({'line': line_no, 'error': str(e)})
+                continue
+            if row[key] in rows:
+                summary['skipped'] += 1
+                continue
+            rows[row[key]] = row
+
+        existing = {value for (value,) in db.session.query(key_column).filter(key_column.in_(list(rows)))}
+        new_rows = [row for value, row in rows.items() if value not in existing]
+        pairs = []
+        if model is Book:
+            kept, copies, pairs = split_duplicates(new_rows, near_duplicates)
+            summary['merged'] += len(new_rows) - len(kept)
+            new_rows = kept
+            add_copies(copies)
+        if new_rows:
+            # Rows that lost the race are handled like ones that existed all along
+            taken = _insert_rows(model, key, new_rows)
+            summary['inserted'] += len(new_rows) - len(taken)
+            existing |= taken
+        if pairs:
+            isbns = {row['isbn'] for row, other, _ in pairs} | {other['isbn'] for _, other, _ in pairs
+                                                                 if isinstance(other, dict)}
+            ids = dict(db.session.query(Book.isbn, Book.id).filter(Book.isbn.in_(isbns)))
+            summary['flagged'] += record_duplicates([
+                (ids[row['isbn']], other if isinstance(other, int) else ids[other['isbn']], similarity)
+                for row, other, similarity in pairs
+            ])
+        if existing and on_duplicate == 'update':
+            db.session.execute(update, [
+                dict({f'b_{column}': rows[value][column] for column in updatable}, b_key=value) for value in existing
+            ])
+            summary['updated'] += len(existing)
+        else:
+            summary['skipped'] += len(existing)
+        db.session.commit()
+
+        if model is Book and search_index.loaded:
+            touched = [value for value in rows if value not in existing or on_duplicate == 'update']
+            for book in db.session.query(Book.id, Book.title, Book.author, Book.publisher) \
+                    .filter(Book.isbn.in_(touched)):
+                index_book(book)
+
+    if summary['inserted'] or summary['updated']:
+        # Too many rows to stream one by one; clients reload the list instead
+        publish(f'{table}.imported', {'inserted': summary['inserted'], 'updated': summary['updated']})
+        db.session.commit()
+    invalidate(table)
+    return summary
+
+def _plain(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+def _csv_chunks(names, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for rows in partitions:
+        writer.writerows([_plain(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty table
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _ndjson_chunks(names, partitions):
+    for rows in partitions:
+        yield b''.join(dumps(dict(zip(names, row))) + b'\n' for row in rows)
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_rows(table, fmt, gzipped=False, batch_size=None):
+    """Yield a whole table as CSV or NDJSON bytes, optionally gzipped.
+
+    Rows come from a single server-side cursor (stream_results) read in
+    partitions, so memory stays flat however large the table is.
+    """
+    _check_format(fmt)
+    columns = EXPORT_COLUMNS[table]
+    names = [column.key for column in columns]
+    batch_size = batch_size or current_app.config['BULK_CHUNK_SIZE']
+    result = db.session.execute(
+        select(*columns).order_by(columns[0]),
+        execution_options={'stream_results': True, 'yield_per': batch_size}
+    )
+    chunks = (_csv_chunks if fmt == 'csv' else _ndjson_chunks)(names, result.partitions(batch_size))
+    return _gzip_chunks(chunks) if gzipped else chunks
+
+def import_request(table):
+    """Import the current request body, a CSV or NDJSON upload that may be gzip-encoded"""
+    fmt = request.args.get('format') or {v: k for k, v in MIMETYPES.items()}.get(request.mimetype)
+    if fmt is None:
+        raise ValueError('Send text/csv or application/x-ndjson, or pass ?format=csv|ndjson')
+    gzipped = request.content_encoding == 'gzip'
+    on_duplicate = request.args.get('on_duplicate', 'skip')
+    return import_records(table, read_records(request.stream, fmt, gzipped), on_duplicate,
+                          near_duplicates=request.args.get('near_duplicates'))
+
+def export_response(table):
+    """Stream a table as a download; ?format=csv|ndjson (default ndjson) and ?gzip=1"""
+    fmt = request.args.get('format', 'ndjson')
+    _check_format(fmt)
+    gzipped = request.args.get('gzip') in ('1', 'true')
+    filename = f'{table}.{fmt}' + ('.gz' if gzipped else '')
+    return Response(
+        stream_with_context(export_rows(table, fmt, gzipped)),
+        mimetype='application/gzip' if gzipped else MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
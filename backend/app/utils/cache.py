@@ -0,0 +1,161 @@
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import Counter, OrderedDict
+from flask import Response, current_app, jsonify, make_response, request
+from .routing import read_from_primary
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL.
+
+    Implements the small subset of the Redis client API the response cache
+    needs (get/set/incr/delete), so a Redis client can be swapped in.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ex=None):
+        expires = time.monotonic() + ex if ex else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (0, None))
+            value = int(value) + 1
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            return value
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def __len__(self):
+        return len(self._data)
+
+class ResponseCache:
+    """Read-through cache of serialized GET responses.
+
+    Each namespace ('books', 'members', ...) carries a version number that
+    is part of every cache key and ETag. Write paths bump the version of the
+    namespaces they touch, which invalidates every cached response for them
+    at once without having to enumerate keys.
+
+    Misses are always read from the primary: a lagging replica's answer
+    stored under the versions a write just bumped would be served to every
+    client, the writer included, until the TTL runs out.
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or LRUCache()
+        self.ttl = ttl
+        self.counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self.ttl = config['CACHE_TTL']
+        if config['CACHE_BACKEND'] == 'redis':
+            import redis
+            self.backend = redis.Redis.from_url(config['CACHE_REDIS_URL'])
+        else:
+            self.backend = LRUCache(config['CACHE_MAX_ENTRIES'])
+        app.add_url_rule('/api/cache/stats', 'cache_stats', self.stats_view)
+
+    def version(self, namespace):
+        key = f'version:{namespace}'
+        value = self.backend.get(key)
+        if value is None:
+            # Seed from the clock so ETags never repeat across restarts or evictions
+            value = time.time_ns()
+            self.backend.set(key, value)
+        return int(value)
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            key = f'version:{namespace}'
+            if self.backend.get(key) is None:
+                self.backend.set(key, time.time_ns())
+            else:
+                self.backend.incr(key)
+
+    def _count(self, result):
+        with self._counts_lock:
+            self.counts[result] += 1
+
+    def stats(self):
+        with self._counts_lock:
+            return {result: self.counts[result] for result in ('hits', 'misses', 'not_modified')}
+
+    def stats_view(self):
+        return jsonify(self.stats())
+
+    def cached(self, *namespaces, unless=None, vary=None):
+        """Cache successful GET responses of a view under the given namespaces.
+
+        Requests for which unless() returns true bypass the cache, for
+        responses that depend on more than the stored data (e.g. the clock).
+        When given, vary() returns text added to the cache key, for responses
+        that depend on something coarse such as the current date.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET' or not current_app.config['CACHE_ENABLED'] \
+                        or (unless is not None and unless()):
+                    return view(*args, **kwargs)
+
+                versions = ':'.join(str(self.version(namespace)) for namespace in namespaces)
+                key = f'response:{request.full_path}:{versions}'
+                if vary is not None:
+                    key = f'{key}:{vary()}'
+                etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+
+                if etag in request.if_none_match:
+                    self._count('not_modified')
+                    response = Response(status=304)
+                    response.set_etag(etag)
+                    return response
+
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._count('hits')
+                    mimetype, _, body = entry.partition(b'\n')
+                    response = Response(body, mimetype=mimetype.decode())
+                    response.set_etag(etag)
+                    return response
+
+                self._count('misses')
+                read_from_primary()
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    if not response.is_streamed:
+                        self.backend.set(key, response.mimetype.encode() + b'\n' + response.get_data(), ex=self.ttl)
+                    response.set_etag(etag)
+                return response
+            return wrapper
+        return decorator
+
+response_cache = ResponseCache()
+cached = response_cache.cached
+invalidate = response_cache.invalidate
@@ -0,0 +1,418 @@
+import os
+import re
+import zlib
+import logging
+import threading
+import unicodedata
+import multiprocessing
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from ..models import Book, BookDuplicate, db
+from .events import publish_many
+from .pagination import iter_keyset
+from .serialization import BOOK_COLUMNS, book_to_dict
+
+logger = logging.getLogger(__name__)
+
+# 16 bands of 8 MinHash rows: a pair at 0.8 similarity shares a band with ~95% probability,
+# one at 0.5 with ~6%
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE = 3
+# Books added since the last merge are kept in a small sorted run of their own
+MERGE_EVERY = 20000
+# A bucket this full holds a generic title ("Poems", "Selected Works"); it is not compared pairwise
+MAX_BUCKET = 100
+# Books per slab of the (features x NUM_PERM) hash matrix
+SLAB_BOOKS = 512
+SCAN_CHUNK = 5000
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+ORDINAL_RE = re.compile(r'^\d+(st|nd|rd|th)$')
+STOPWORDS = frozenset('a an the and of'.split())
+# Words that tell editions of one work apart
+EDITION_WORDS = frozenset(
+    'edition ed revised updated expanded anniversary illustrated unabridged abridged '
+    'paperback hardcover hardback reprint'.split()
+)
+
+# Fixed seeds: signatures must agree across processes and restarts
+_rng = np.random.RandomState(7919)
+_A = _rng.randint(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+_PRIME = np.uint64((1 << 61) - 1)
+_BAND_MIX = _rng.randint(1, 1 << 63, ROWS, dtype=np.uint64) | np.uint64(1)
+
+Features = namedtuple('Features', 'shingles authors numbers')
+
+def _tokens(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return TOKEN_RE.findall(''.join(c for c in text if not unicodedata.combining(c)).lower())
+
+def features(title, author):
+    """Character shingles of the normalized title, plus author words and title numbers.
+
+    Case, accents, punctuation, articles and edition words ("2nd revised
+    edition") are dropped; author word order is ignored.
+    """
+    words = [word for word in _tokens(title)
+             if word not in STOPWORDS and word not in EDITION_WORDS and not ORDINAL_RE.match(word)]
+    text = f" {' '.join(words)} "
+    shingles = frozenset(text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)) if words else frozenset()
+    return Features(shingles, frozenset(word for word in _tokens(author) if len(word) > 1),
+                    frozenset(word for word in words if word.isdigit()))
+
+def similarity(a, b):
+    """Jaccard similarity of two titles' shingles; 0 when their numbers or known authors disagree.
+
+    Authors agree when every name word of one appears in the other, so
+    "Tolkien" matches "J.R.R. Tolkien" but "Priya Reddy" not "Priya Khan".
+    """
+    if a.numbers != b.numbers:
+        return 0.0
+    if a.authors and b.authors and len(a.authors & b.authors) < min(len(a.authors), len(b.authors)):
+        return 0.0
+    union = len(a.shingles | b.shingles)
+    return len(a.shingles & b.shingles) / union if union else 0.0
+
+def band_keys(feature_list):
+    """(n, BANDS) uint64 LSH keys, one row per Features; all zero for a title with nothing to hash"""
+    counts = np.zeros(len(feature_list), np.int64)
+    hashes = []
+    for i, f in enumerate(feature_list):
+        if f.shingles:
+            items = [zlib.crc32(s.encode()) for s in f.shingles] + [zlib.crc32(f'a:{a}'.encode()) for a in f.authors]
+            counts[i] = len(items)
+            hashes.extend(items)
+    keys = np.zeros((len(feature_list), BANDS), np.uint64)
+    hashed = np.flatnonzero(counts)
+    if not len(hashed):
+        return keys
+    values = np.array(hashes, np.uint64)
+    starts = np.concatenate([[0], np.cumsum(counts[hashed])])
+    signatures = np.empty((len(hashed), NUM_PERM), np.uint64)
+    for s in range(0, len(hashed), SLAB_BOOKS):
+        e = min(s + SLAB_BOOKS, len(hashed))
+        lo, hi = starts[s], starts[e]
+        # a, x < 2**32, so a * x + b stays below 2**64
+        permuted = (values[lo:hi, None] * _A + _B) % _PRIME
+        signatures[s:e] = np.minimum.reduceat(permuted, starts[s:e] - lo, axis=0)
+    # Unsigned arithmetic wraps, which is all a band hash needs
+    keys[hashed] = (signatures.reshape(-1, BANDS, ROWS) * _BAND_MIX).sum(axis=2)
+    return keys
+
+class DuplicateIndex:
+    """LSH buckets over title+author MinHash signatures, for near-duplicate lookups.
+
+    Every book has one key per band. Keys sit in per-band sorted numpy
+    arrays searched with searchsorted, plus a sorted run of recent
+    additions that is folded in every MERGE_EVERY books. Callers check
+    candidates against the current rows, so an edited or deleted book
+    costs at most a wasted candidate until the next merge drops it.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = np.zeros((BANDS, 0), np.uint64)
+        self._ids = np.zeros((BANDS, 0), np.int64)
+        self._recent = {}
+        self._recent_run = None
+        self._stale = set()
+        self.max_id = 0
+        self.loaded = False
+
+    def __len__(self):
+        return self._keys.shape[1] + len(self._recent)
+
+    def add(self, book_ids, keys):
+        with self._lock:
+            for book_id, row in zip(book_ids, keys):
+                self._stale.add(book_id)
+                if row.any():
+                    self._recent[book_id] = row
+                else:
+                    self._recent.pop(book_id, None)
+                self.max_id = max(self.max_id, book_id)
+            self._recent_run = None
+            if len(self._recent) >= MERGE_EVERY:
+                self._merge()
+
+    def remove(self, book_id):
+        with self._lock:
+            self._stale.add(book_id)
+            if self._recent.pop(book_id, None) is not None:
+                self._recent_run = None
+
+    def _merge(self):
+        stale = np.fromiter(self._stale, np.int64, len(self._stale))
+        ids = np.fromiter(self._recent, np.int64, len(self._recent))
+        keys = np.array(list(self._recent.values()), np.uint64).reshape(-1, BANDS)
+        merged_keys, merged_ids = [], []
+        for band in range(BANDS):
+            # Each band is sorted on its own, so its ids are in their own order
+            keep = ~np.isin(self._ids[band], stale)
+            band_keys = np.concatenate([self._keys[band][keep], keys[:, band]])
+            band_ids = np.concatenate([self._ids[band][keep], ids])
+            order = np.argsort(band_keys, kind='stable')
+            merged_keys.append(band_keys[order])
+            merged_ids.append(band_ids[order])
+        self._keys, self._ids = np.array(merged_keys), np.array(merged_ids)
+        self._recent, self._recent_run, self._stale = {}, None, set()
+
+    def _runs(self):
+        if self._recent_run is None:
+            ids = np.fromiter(self._recent, np.int64, len(self._recent))
+            keys = np.array(list(self._recent.values()), np.uint64).reshape(-1, BANDS).T
+            order = np.argsort(keys, axis=1, kind='stable')
+            self._recent_run = (np.take_along_axis(keys, order, axis=1), ids[order])
+        return ((self._keys, self._ids), self._recent_run)
+
+    def candidates(self, keys):
+        """For each row of band keys, the set of book ids sharing at least one band with it"""
+        found = [set() for _ in range(len(keys))]
+        with self._lock:
+            for run_keys, run_ids in self._runs():
+                for band in range(BANDS):
+                    queries = keys[:, band]
+                    lo = np.searchsorted(run_keys[band], queries, 'left')
+                    hi = np.searchsorted(run_keys[band], queries, 'right')
+                    for i in np.flatnonzero((hi > lo) & (hi - lo <= MAX_BUCKET) & (queries != 0)):
+                        found[i].update(run_ids[band, lo[i]:hi[i]].tolist())
+        return found
+
+    def catch_up(self):
+        """Index books added since the last look, by this process or any other"""
+        query = db.session.query(Book.id, Book.title, Book.author).filter(Book.id > self.max_id)
+        batch = []
+        for row in iter_keyset(query, Book.id, batch_size=SCAN_CHUNK):
+            batch.append(row)
+            if len(batch) == SCAN_CHUNK:
+                self._add_rows(batch)
+                batch = []
+        self._add_rows(batch)
+
+    def _add_rows(self, rows):
+        if rows:
+            self.add([row.id for row in rows], band_keys([features(row.title, row.author) for row in rows]))
+
+duplicate_index = DuplicateIndex()
+
+def get_duplicate_index():
+    """Return the process-wide index, brought up to date with the book table"""
+    with duplicate_index._lock:
+        duplicate_index.catch_up()
+        duplicate_index.loaded = True
+    return duplicate_index
+
+def index_duplicate(book):
+    """Refresh a book after its title or author changed"""
+    if duplicate_index.loaded:
+        duplicate_index.add([book.id], band_keys([features(book.title, book.author)]))
+
+def unindex_duplicate(book_id):
+    if duplicate_index.loaded:
+        duplicate_index.remove(book_id)
+
+def _closest(f, others):
+    """(ref, similarity) of the most similar (ref, Features); the first wins a tie, so the oldest book"""
+    best, score = None, 0.0
+    for ref, other in others:
+        value = similarity(f, other)
+        if value > score:
+            best, score = ref, value
+    return best, score
+
+def match_rows(rows, threshold):
+    """Near duplicates of new {'title', 'author'} rows, in the catalog or earlier in rows.
+
+    Returns one entry per row: None, ('book', book_id, similarity) or
+    ('row', index of an earlier row, similarity). Catalog matches win.
+    """
+    index = get_duplicate_index()
+    row_features = [features(row['title'], row['author']) for row in rows]
+    keys = band_keys(row_features)
+    candidates = index.candidates(keys)
+    wanted = sorted(set().union(*candidates)) if candidates else []
+    current = {}
+    for start in range(0, len(wanted), SCAN_CHUNK):
+        chunk = wanted[start:start + SCAN_CHUNK]
+        current.update((book_id, features(title, author)) for book_id, title, author in
+                       db.session.query(Book.id, Book.title, Book.author).filter(Book.id.in_(chunk)))
+
+    matches = []
+    earlier = defaultdict(list)
+    for i, (f, found) in enumerate(zip(row_features, candidates)):
+        best, score = _closest(f, ((book_id, current[book_id]) for book_id in sorted(found) if book_id in current))
+        match = ('book', best, score) if score >= threshold else None
+        if match is None:
+            seen = {j for band in range(BANDS) if keys[i, band] for j in earlier[(band, keys[i, band])]}
+            best, score = _closest(f, ((j, row_features[j]) for j in sorted(seen)))
+            if score >= threshold:
+                match = ('row', best, score)
+        for band in range(BANDS):
+            if keys[i, band]:
+                earlier[(band, keys[i, band])].append(i)
+        matches.append(match)
+    return matches
+
+def split_duplicates(rows, action=None, threshold=None):
+    """Apply the near-duplicate policy to new book rows before they are inserted.
+
+    'flag' inserts every row and returns the pairs to record, 'merge' folds
+    each duplicate's stock into the book (or earlier row) it duplicates,
+    'off' does nothing. Returns (rows to insert, {book_id: copies to add},
+    [(row, book_id or row it duplicates, similarity)]).
+    """
+    config = current_app.config
+    action = action or config['NEAR_DUPLICATE_ACTION']
+    if action not in ('flag', 'merge', 'off'):
+        raise ValueError("near_duplicates must be 'flag', 'merge' or 'off'")
+    if action == 'off' or not rows:
+        return rows, {}, []
+    threshold = threshold or config['NEAR_DUPLICATE_THRESHOLD']
+    matches = match_rows(rows, threshold)
+    if action == 'flag':
+        return rows, {}, [(rows[i], match[1] if match[0] == 'book' else rows[match[1]], match[2])
+                          for i, match in enumerate(matches) if match]
+
+    # Follow row-to-row matches to the row or book that absorbs them
+    targets = []
+    for match in matches:
+        if match and match[0] == 'row':
+            match = targets[match[1]] or ('row', match[1], match[2])
+        targets.append(match)
+    keep, copies = [], defaultdict(int)
+    for row, target in zip(rows, targets):
+        if target is None:
+            keep.append(row)
+        elif target[0] == 'book':
+            copies[target[1]] += row['stock'] or 0
+        else:
+            rows[target[1]]['stock'] = (rows[target[1]]['stock'] or 0) + (row['stock'] or 0)
+    return keep, dict(copies), []
+
+def add_copies(copies):
+    """Add merged duplicates' stock onto existing books, in the caller's transaction"""
+    if not copies:
+        return
+    table = Book.__table__
+    db.session.execute(
+        table.update().where(table.c.id == bindparam('b_id')).values(stock=table.c.stock + bindparam('b_copies')),
+        [{'b_id': book_id, 'b_copies': count} for book_id, count in copies.items()]
+    )
+    books = db.session.query(*BOOK_COLUMNS).filter(Book.id.in_(list(copies))).all()
+    publish_many('book.updated', [book_to_dict(book) for book in books])
+
+def record_duplicates(pairs, source='import'):
+    """Save (book_id, duplicate_of_id, similarity) pairs not recorded before; returns how many were new"""
+    pairs = {(max(a, b), min(a, b)): sim for a, b, sim in pairs if a != b}
+    if not pairs:
+        return 0
+    existing = set()
+    newer = sorted({book_id for book_id, _ in pairs})
+    for start in range(0, len(newer), SCAN_CHUNK):
+        existing.update(db.session.query(BookDuplicate.book_id, BookDuplicate.duplicate_of_id)
+                        .filter(BookDuplicate.book_id.in_(newer[start:start + SCAN_CHUNK])))
+    rows = [{'book_id': book_id, 'duplicate_of_id': other, 'similarity': round(sim, 4), 'source': source,
+             'status': 'open'} for (book_id, other), sim in sorted(pairs.items()) if (book_id, other) not in existing]
+    if not rows:
+        return 0
+    try:
+        with db.session.begin_nested():
+            db.session.execute(BookDuplicate.__table__.insert(), rows)
+        return len(rows)
+    except IntegrityError:
+        # A concurrent import recorded some of the same pairs; keep the others
+        added = 0
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(BookDuplicate.__table__.insert(), row)
+                added += 1
+            except IntegrityError:
+                pass
+        return added
+
+# Catalog scan. The workers run in separate processes and only use the pure functions above.
+
+def _scan_keys(rows):
+    return band_keys([features(title, author) for title, author in rows])
+
+def _scan_verify(pairs):
+    seen = {}
+    def cached(book):
+        if book not in seen:
+            seen[book] = features(*book)
+        return seen[book]
+    return [similarity(cached(a), cached(b)) for a, b in pairs]
+
+def _bucket_pairs(keys):
+    """Sorted i * n + j codes of the row pairs (i < j) sharing a band key, and how many buckets
+    were skipped for holding more than MAX_BUCKET rows"""
+    n = len(keys)
+    codes, skipped = [], 0
+    for band in range(BANDS):
+        column = keys[:, band]
+        order = np.argsort(column, kind='stable')
+        ordered = column[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        live = ordered[starts] != 0
+        skipped += int(np.count_nonzero(live & (sizes > MAX_BUCKET)))
+        # Buckets of one size at a time, as a (buckets, size) matrix of row numbers
+        for size in np.unique(sizes[live & (sizes >= 2) & (sizes <= MAX_BUCKET)]):
+            first = starts[live & (sizes == size)]
+            members = np.sort(order[first[:, None] + np.arange(size)], axis=1)
+            a, b = np.triu_indices(size, 1)
+            codes.append((members[:, a] * n + members[:, b]).ravel())
+    return (np.unique(np.concatenate(codes)) if codes else np.zeros(0, np.int64)), skipped
+
+def scan_catalog(threshold=None, processes=None, progress=None):
+    """Find near-duplicate pairs across the whole catalog and record the new ones.
+
+    Signatures and the pairwise checks are spread over `processes` worker
+    processes (DEDUP_PROCESSES, 0 for every core); the LSH banding that
+    turns signatures into candidate pairs runs in numpy here.
+    """
+    config = current_app.config
+    threshold = threshold or config['NEAR_DUPLICATE_THRESHOLD']
+    processes = processes or config['DEDUP_PROCESSES'] or os.cpu_count() or 1
+    progress = progress if progress is not None else {}
+    progress.update({'books': 0, 'candidates': 0, 'duplicates': 0, 'recorded': 0})
+
+    ids, books = [], []
+    for row in iter_keyset(db.session.query(Book.id, Book.title, Book.author), Book.id, batch_size=SCAN_CHUNK):
+        ids.append(row.id)
+        books.append((row.title, row.author))
+    progress['books'] = len(ids)
+    db.session.close()
+    if len(ids) < 2:
+        return progress
+
+    chunks = [books[start:start + SCAN_CHUNK] for start in range(0, len(books), SCAN_CHUNK)]
+    if processes > 1:
+        # spawn, not fork: this may run on a job thread of a multi-threaded web worker
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        run = executor.map
+    else:
+        executor, run = None, map
+    try:
+        keys = np.concatenate(list(run(_scan_keys, chunks)))
+        pairs, progress['skipped_buckets'] = _bucket_pairs(keys)
+        progress['candidates'] = len(pairs)
+        batches = [divmod(pairs[start:start + SCAN_CHUNK], len(ids)) for start in range(0, len(pairs), SCAN_CHUNK)]
+        scores = run(_scan_verify, ([(books[i], books[j]) for i, j in zip(*batch)] for batch in batches))
+        found = [(ids[i], ids[j], score) for (first, second), batch_scores in zip(batches, scores)
+                 for i, j, score in zip(first.tolist(), second.tolist(), batch_scores) if score >= threshold]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    progress['duplicates'] = len(found)
+    progress['recorded'] = record_duplicates(found, source='scan')
+    db.session.commit()
+    return progress
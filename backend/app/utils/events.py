@@ -0,0 +1,228 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, func
+from ..models import ChangeEvent, db
+from .serialization import dumps
+from .routing import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+# A missing id may belong to a transaction that has not committed yet; wait this long
+# for it before skipping it (rolled back transactions leave permanent gaps)
+GAP_GRACE_SECONDS = 2.0
+# Most events read from the table in one go, by the poller or for one lagging client
+READ_BATCH = 500
+
+def publish(kind, data):
+    """Record a change event in the current transaction; it is streamed once committed"""
+    publish_many(kind, [data])
+
+def publish_many(kind, items):
+    if not items:
+        return
+    now = datetime.utcnow()
+    db.session.execute(ChangeEvent.__table__.insert(), [
+        {'type': kind, 'data': dumps(data).decode(), 'created_at': now} for data in items
+    ])
+    db.session.info['published'] = True
+
+def prune_events(retention=None):
+    """Delete change events older than CHANGE_FEED_RETENTION seconds; returns how many.
+
+    Run by every job runner and by `flask events prune`, so the table stays
+    bounded whether or not any process has a stream open.
+    """
+    if retention is None:
+        retention = current_app.config['CHANGE_FEED_RETENTION']
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    newest = db.session.query(func.max(ChangeEvent.id)).scalar()
+    # The newest row always stays: SQLite (and MySQL before 8.0, on restart) would
+    # otherwise hand out its id again, behind every poller's last_id
+    deleted = ChangeEvent.query.filter(ChangeEvent.created_at < cutoff, ChangeEvent.id < newest) \
+        .delete(synchronize_session=False) if newest else 0
+    db.session.commit()
+    return deleted
+
+def _after_commit(session):
+    if session.info.pop('published', None):
+        change_feed.wake()
+
+def _after_rollback(session):
+    session.info.pop('published', None)
+
+event.listen(RoutingSession, 'after_commit', _after_commit)
+event.listen(RoutingSession, 'after_rollback', _after_rollback)
+
+def _sse(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {data}\n\n'.encode()
+
+class ChangeFeed:
+    """Fans committed change events out to Server-Sent Event streams.
+
+    Write paths insert events into the change_event table inside their own
+    transaction. One poller thread per process reads new rows in id order and
+    appends them, already encoded, to a bounded ring buffer. Streams read
+    from that buffer by event id, so publishers never wait on clients. A
+    client that falls behind the buffer, or resumes with an old
+    Last-Event-ID, catches up from the table. When its events have been
+    pruned, it is told to reload.
+    """
+
+    def __init__(self):
+        self.buffer = deque()
+        self.last_id = 0
+        self.clients = 0
+        self.stats = {'published': 0, 'sent': 0, 'caught_up': 0, 'resets': 0, 'rejected': 0}
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._gap = None
+
+    def init_app(self, app):
+        self.app = app
+        # A poller started for an earlier app stops; the next stream starts one for this one
+        self._pid = None
+        config = app.config
+        self.buffer = deque(maxlen=config['CHANGE_FEED_BUFFER'])
+        self.poll_seconds = config['CHANGE_FEED_POLL_SECONDS']
+        self.keepalive = config['CHANGE_FEED_KEEPALIVE']
+        self.max_clients = config['CHANGE_FEED_MAX_CLIENTS']
+        self.max_seconds = config['CHANGE_FEED_MAX_SECONDS']
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own poller
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.last_id = db.session.query(func.max(ChangeEvent.id)).scalar() or 0
+            self.buffer.clear()
+            threading.Thread(target=self._loop, args=(self.app,), name='change-feed', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _loop(self, app):
+        while True:
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+            if self.app is not app:
+                return
+            with app.app_context():
+                try:
+                    self._poll()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Change feed poll failed')
+                finally:
+                    db.session.remove()
+
+    def _poll(self):
+        rows = db.session.query(ChangeEvent.id, ChangeEvent.type, ChangeEvent.data) \
+            .filter(ChangeEvent.id > self.last_id).order_by(ChangeEvent.id).limit(READ_BATCH).all()
+        accepted = []
+        expected = self.last_id + 1
+        for row in rows:
+            if row.id != expected:
+                now = time.monotonic()
+                if self._gap is None or self._gap[0] != expected:
+                    self._gap = (expected, now)
+                if now - self._gap[1] < GAP_GRACE_SECONDS:
+                    # Keep the buffer in id order; look again on the next pass
+                    break
+            accepted.append((row.id, _sse(row.id, row.type, row.data)))
+            expected = row.id + 1
+        if not accepted:
+            return
+        with self._cond:
+            self.buffer.extend(accepted)
+            self.last_id = accepted[-1][0]
+            self.stats['published'] += len(accepted)
+            self._cond.notify_all()
+
+    def acquire(self):
+        """Reserve a stream slot; False when this process already serves max_clients"""
+        with self._cond:
+            if self.clients >= self.max_clients:
+                self.stats['rejected'] += 1
+                return False
+            self.clients += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.clients -= 1
+
+    def _from_buffer(self, cursor):
+        """Encoded events after cursor, or None when the buffer no longer reaches back that far"""
+        if cursor >= self.last_id:
+            return []
+        if not self.buffer or self.buffer[0][0] > cursor + 1:
+            return None
+        events = []
+        for event_id, chunk in reversed(self.buffer):
+            if event_id <= cursor:
+                break
+            events.append((event_id, chunk))
+        events.reverse()
+        return events
+
+    def _from_table(self, cursor):
+        """Catch a lagging client up from the table; None when its events were pruned"""
+        try:
+            oldest = db.session.query(func.min(ChangeEvent.id)).scalar()
+            if oldest is None or oldest > cursor + 1:
+                return None
+            rows = db.session.query(ChangeEvent.id, ChangeEvent.type, ChangeEvent.data) \
+                .filter(ChangeEvent.id > cursor, ChangeEvent.id <= self.last_id) \
+                .order_by(ChangeEvent.id).limit(READ_BATCH).all()
+        finally:
+            # Give the connection back; the stream may stay open for minutes
+            db.session.close()
+        if not rows:
+            return None
+        self.stats['caught_up'] += len(rows)
+        return [(row.id, _sse(row.id, row.type, row.data)) for row in rows]
+
+    def stream(self, cursor=None):
+        """Yield SSE bytes for events after cursor (the client's Last-Event-ID).
+
+        Pending events are written as one chunk, so a slow client gets fewer,
+        larger writes instead of a growing queue. The stream ends after
+        CHANGE_FEED_MAX_SECONDS and the client reconnects from where it was.
+        """
+        self._ensure_started()
+        db.session.close()
+        if cursor is None or cursor > self.last_id + READ_BATCH:
+            # New client, or an id from another database: start from now
+            cursor = self.last_id
+        deadline = time.monotonic() + self.max_seconds
+        yield b'retry: 3000\n: connected\n\n'
+        while time.monotonic() < deadline:
+            with self._cond:
+                events = self._from_buffer(cursor)
+                if events == []:
+                    self._cond.wait(self.keepalive)
+                    events = self._from_buffer(cursor)
+            if events is None:
+                events = self._from_table(cursor)
+            if events is None:
+                self.stats['resets'] += 1
+                cursor = self.last_id
+                yield _sse(cursor, 'reset', dumps({'last_event_id': cursor}).decode())
+            elif events:
+                cursor = events[-1][0]
+                self.stats['sent'] += len(events)
+                yield b''.join(chunk for _, chunk in events)
+            else:
+                yield b': keepalive\n\n'
+
+change_feed = ChangeFeed()
@@ -0,0 +1,172 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import DateTime, Integer, bindparam, case, func, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from ..models import Member, MemberFeeProjection, Transaction, db
+
+class days_between(FunctionElement):
+    """Whole days from start to end, truncated like timedelta.days"""
+    type = Integer()
+    name = 'days_between'
+    inherit_cache = True
+
+@compiles(days_between)
+def _days_between_default(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return 'CAST(EXTRACT(DAY FROM (%s - %s)) AS INTEGER)' % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+@compiles(days_between, 'sqlite')
+def _days_between_sqlite(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return 'CAST(julianday(%s) - julianday(%s) AS INTEGER)' % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+@compiles(days_between, 'mysql')
+def _days_between_mysql(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return 'TIMESTAMPDIFF(DAY, %s, %s)' % (compiler.process(start, **kw), compiler.process(end, **kw))
+
+class FeePolicy:
+    """Rent charged for a loan: `daily_rate` per day after `grace_days`, capped at `max_fee`"""
+
+    def __init__(self, daily_rate=10, grace_days=0, max_fee=None):
+        self.daily_rate = daily_rate
+        self.grace_days = grace_days
+        self.max_fee = max_fee
+
+    @classmethod
+    def from_config(cls, config=None):
+        config = config or current_app.config
+        return cls(config['FEE_DAILY_RATE'], config['FEE_GRACE_DAYS'], config['FEE_MAX_PER_LOAN'])
+
+    def fee(self, issue_date, until):
+        days = (until - issue_date).days
+        fee = max((days - self.grace_days) * self.daily_rate, 0)
+        if self.max_fee is not None:
+            fee = min(fee, self.max_fee)
+        return fee
+
+    def sql_fee(self, issue_date, until):
+        """The same rule as fee(), as a SQL expression evaluated per row"""
+        days = days_between(issue_date, until)
+        fee = case((days > self.grace_days, (days - self.grace_days) * self.daily_rate), else_=0)
+        if self.max_fee is not None:
+            fee = case((fee > self.max_fee, self.max_fee), else_=fee)
+        return fee
+
+def _as_of(now):
+    return literal(now, DateTime())
+
+def accrued_fees_query(now=None, overdue_before=None):
+    """One aggregate pass over open loans: (member_id, open_loans, accrued_fee) per member.
+
+    Answered from ix_transaction_member_id_return_date_issue_date alone, in
+    member_id order, so it never touches the table rows or sorts.
+    """
+    now = now or datetime.utcnow()
+    policy = FeePolicy.from_config()
+    query = db.session.query(
+        Transaction.member_id.label('member_id'),
+        func.count(Transaction.id).label('open_loans'),
+        func.coalesce(func.sum(policy.sql_fee(Transaction.issue_date, _as_of(now))), 0).label('accrued_fee')
+    ).filter(Transaction.return_date.is_(None))
+    if overdue_before is not None:
+        query = query.filter(Transaction.issue_date < overdue_before)
+    return query.group_by(Transaction.member_id)
+
+def _insert_projections(now, member_ids=None):
+    """Build projection rows from open loans, for all members or just member_ids"""
+    query = accrued_fees_query(now)
+    if member_ids is not None:
+        query = query.filter(Transaction.member_id.in_(member_ids))
+    aggregate = query.add_columns(_as_of(now).label('refreshed_at')).subquery()
+    db.session.execute(MemberFeeProjection.__table__.insert().from_select(
+        ['member_id', 'open_loans', 'accrued_fee', 'refreshed_at'],
+        db.session.query(aggregate.c.member_id, aggregate.c.open_loans,
+                         aggregate.c.accrued_fee, aggregate.c.refreshed_at)
+    ))
+
+def refresh_projections(now=None):
+    """Rebuild every member's projected fees with one INSERT ... SELECT"""
+    now = now or datetime.utcnow()
+    db.session.execute(MemberFeeProjection.__table__.delete())
+    _insert_projections(now)
+    db.session.commit()
+    return db.session.query(func.count(MemberFeeProjection.member_id)).scalar()
+
+def record_issues(member_counts):
+    """Count new loans into the projections; a fresh loan has accrued nothing yet.
+
+    `member_counts` maps member_id to the number of loans just issued.
+    Members without a projection row get one built from all their open
+    loans, including the new ones.
+    """
+    table = MemberFeeProjection.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.member_id == bindparam('m_id'))
+        .values(open_loans=table.c.open_loans + bindparam('n')),
+        [{'m_id': member_id, 'n': n} for member_id, n in member_counts.items()]
+    )
+    existing = {member_id for (member_id,) in db.session.query(MemberFeeProjection.member_id)
+                .filter(MemberFeeProjection.member_id.in_(list(member_counts)))}
+    missing = [member_id for member_id in member_counts if member_id not in existing]
+    if not missing:
+        return
+
+    db.session.flush()
+    now = datetime.utcnow()
+    try:
+        with db.session.begin_nested():
+            _insert_projections(now, missing)
+    except IntegrityError:
+        # Another request created some of the rows first; retry member by member
+        for member_id in missing:
+            try:
+                with db.session.begin_nested():
+                    _insert_projections(now, [member_id])
+            except IntegrityError:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.member_id == member_id)
+                    .values(open_loans=table.c.open_loans + member_counts[member_id])
+                )
+
+def record_returns(loans):
+    """Take returned loans out of the projections.
+
+    `loans` is a list of (member_id, issue_date) pairs. Each loan's fee as of
+    the row's refresh time is subtracted, so the remaining total still
+    describes the loans that are open.
+    """
+    policy = FeePolicy.from_config()
+    table = MemberFeeProjection.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.member_id == bindparam('m_id'))
+        .values(
+            open_loans=table.c.open_loans - 1,
+            accrued_fee=table.c.accrued_fee - policy.sql_fee(bindparam('issued', type_=DateTime()), table.c.refreshed_at)
+        ),
+        [{'m_id': member_id, 'issued': issue_date} for member_id, issue_date in loans]
+    )
+
+def projected_debt(member_id):
+    """Charged debt plus fees accrued on open loans as of the last refresh"""
+    row = db.session.query(
+        Member.outstanding_debt, MemberFeeProjection.open_loans,
+        MemberFeeProjection.accrued_fee, MemberFeeProjection.refreshed_at
+    ).outerjoin(MemberFeeProjection, MemberFeeProjection.member_id == Member.id) \
+        .filter(Member.id == member_id).first()
+    if row is None:
+        return None
+    accrued_fee = row.accrued_fee or 0.0
+    return {
+        'member_id': member_id,
+        'outstanding_debt': row.outstanding_debt,
+        'open_loans': row.open_loans or 0,
+        'accrued_fee': accrued_fee,
+        'projected_debt': row.outstanding_debt + accrued_fee,
+        'refreshed_at': row.refreshed_at.isoformat() if row.refreshed_at else None
+    }
@@ -0,0 +1,146 @@
+import os
+import asyncio
+import threading
+from urllib.parse import urlencode
+import aiohttp
+from .cache import LRUCache
+
+# Query parameters forwarded to Frappe; anything else is dropped from the request and the cache key
+SEARCH_PARAMS = ('title', 'authors', 'isbn', 'publisher', 'page')
+
+class FrappeProxyError(Exception):
+    """Upstream failure, carrying the HTTP status to answer with"""
+
+    def __init__(self, message, status=502, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def normalize_params(params):
+    """Forwarded params with whitespace collapsed, lowercased and blanks dropped, in a fixed order"""
+    normalized = {}
+    for name in SEARCH_PARAMS:
+        value = ' '.join(str(params.get(name) or '').split()).lower()
+        if value:
+            normalized[name] = value
+    return normalized
+
+class TokenBucket:
+    """Upstream rate limit; only touched from the proxy's event loop, so it needs no lock"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    async def acquire(self, max_wait):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Reserve a token up front; callers queue behind the deficit
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            raise FrappeProxyError('Frappe rate limit reached, try again shortly', 429, retry_after=wait)
+        self.tokens -= 1
+        if wait:
+            await asyncio.sleep(wait)
+
+class FrappeSearchProxy:
+    """Catalog search against the Frappe API, served from an asyncio loop on a background thread.
+
+    Flask views stay synchronous and hand each lookup to the loop, which
+    owns one aiohttp session with a bounded connection pool. Results are
+    cached per normalized query, identical queries already in flight share
+    one upstream call, and upstream calls go through a token bucket.
+    """
+
+    def __init__(self):
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'upstream': 0, 'rate_limited': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._inflight = {}
+
+    def init_app(self, app):
+        config = app.config
+        self.url = config['FRAPPE_API_URL']
+        self.timeout = config['FRAPPE_TIMEOUT']
+        self.pool_size = config['FRAPPE_CONCURRENCY']
+        self.ttl = config['FRAPPE_SEARCH_CACHE_TTL']
+        self.cache = LRUCache(config['FRAPPE_SEARCH_CACHE_ENTRIES'])
+        self.bucket = TokenBucket(config['FRAPPE_RATE_LIMIT'], config['FRAPPE_RATE_BURST'])
+
+    def _ensure_loop(self):
+        # Threads do not survive a fork, so gunicorn workers each start their own loop
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='frappe-proxy', daemon=True).start()
+                self._session = asyncio.run_coroutine_threadsafe(self._open_session(), loop).result()
+                self._inflight = {}
+                self._loop, self._pid = loop, os.getpid()
+        return self._loop
+
+    async def _open_session(self):
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    def search(self, params):
+        """Return (books, source) for a query, where source is 'hit', 'miss' or 'coalesced'"""
+        params = normalize_params(params)
+        key = urlencode(params)
+        books = self.cache.get(key)
+        if books is not None:
+            self.stats['hits'] += 1
+            return books, 'hit'
+
+        future = asyncio.run_coroutine_threadsafe(self._lookup(key, params), self._ensure_loop())
+        # The rate limit queue may add up to one timeout on top of the request itself
+        return future.result(self.timeout * 2 + 1)
+
+    async def _lookup(self, key, params):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(task), 'coalesced'
+
+        self.stats['misses'] += 1
+        task = asyncio.ensure_future(self._fetch(key, params))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), 'miss'
+
+    async def _fetch(self, key, params):
+        try:
+            await self.bucket.acquire(max_wait=self.timeout)
+        except FrappeProxyError:
+            self.stats['rate_limited'] += 1
+            raise
+        self.stats['upstream'] += 1
+        try:
+            async with self._session.get(self.url, params=params) as response:
+                response.raise_for_status()
+                payload = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.stats['errors'] += 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise FrappeProxyError('Frappe API timed out', 504)
+            raise FrappeProxyError(f'Failed to fetch books from Frappe API: {e}')
+        except ValueError:
+            self.stats['errors'] += 1
+            raise FrappeProxyError('Frappe API returned invalid JSON')
+        books = payload.get('message', []) if isinstance(payload, dict) else None
+        if not isinstance(books, list):
+            self.stats['errors'] += 1
+            raise FrappeProxyError('Frappe API returned an unexpected response')
+        self.cache.set(key, books, ex=self.ttl)
+        return books
+
+frappe_proxy = FrappeSearchProxy()
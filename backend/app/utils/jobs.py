@@ -0,0 +1,295 @@
+import os
+import json
+import uuid
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import bindparam, func, select
+from ..models import Job, db
+from .events import prune_events
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, FINISHED, FAILED = 'queued', 'running', 'finished', 'failed'
+
+class JobType:
+    def __init__(self, name, func, concurrency, max_attempts):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+JOB_TYPES = {}
+
+def job_type(name, concurrency=1, max_attempts=3):
+    """Register func(params, progress) as a job type.
+
+    At most `concurrency` jobs of the type run at once across all runners,
+    and a failing job is retried until it has run `max_attempts` times.
+    `progress` is a dict the function may update; the runner saves it with
+    every heartbeat.
+    """
+    def decorator(func):
+        JOB_TYPES[name] = JobType(name, func, concurrency, max_attempts)
+        return func
+    return decorator
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'type': job.type,
+        'status': job.status,
+        'params': json.loads(job.params),
+        'progress': json.loads(job.progress) if job.progress else None,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+def enqueue(name, params=None):
+    """Queue a job, commit it and wake the local runner; returns the Job row"""
+    spec = JOB_TYPES.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown job type {name}; expected one of {', '.join(sorted(JOB_TYPES))}")
+    job = Job(id=uuid.uuid4().hex, type=name, status=QUEUED, params=json.dumps(params or {}),
+              max_attempts=spec.max_attempts)
+    db.session.add(job)
+    db.session.commit()
+    runner.wake()
+    return job
+
+class JobRunner:
+    """Runs queued jobs on a thread pool, claiming them through the job table.
+
+    Every web worker process (and `flask jobs worker`) can run one. A
+    conditional UPDATE claims each job, so one job never runs twice at
+    once. A heartbeat marks the runner's jobs as alive and saves their
+    progress. Jobs whose runner stopped beating are queued again.
+    """
+
+    def __init__(self):
+        self.running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._pid = None
+        self._pruned_at = None
+
+    def init_app(self, app):
+        self.app = app
+        config = app.config
+        self.max_workers = config['JOB_WORKERS']
+        self.poll_seconds = config['JOB_POLL_SECONDS']
+        self.stale_seconds = config['JOB_STALE_SECONDS']
+        self.retry_backoff = config['JOB_RETRY_BACKOFF']
+        self.prune_seconds = config['CHANGE_FEED_PRUNE_SECONDS']
+        if config['JOB_RUNNER_ENABLED']:
+            # Started on the first request, so each forked gunicorn worker gets its own threads
+            app.before_request(self.start)
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self.running = {}
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            threading.Thread(target=self._loop, name='job-dispatcher', daemon=True).start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run_forever(self):
+        """Run in the foreground until interrupted (`flask jobs worker`)"""
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self._stop.set()
+            self._executor.shutdown(wait=True)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self._heartbeat()
+                    self._requeue_stale()
+                    self._dispatch()
+                    self._housekeeping()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Job dispatcher pass failed')
+                finally:
+                    db.session.remove()
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def _heartbeat(self):
+        if not self.running:
+            return
+        job_table = Job.__table__
+        db.session.execute(
+            job_table.update()
+            .where(job_table.c.id == bindparam('j_id'), job_table.c.locked_by == self.worker_id)
+            .values(heartbeat_at=bindparam('now'), progress=bindparam('p')),
+            [{'j_id': job_id, 'now': datetime.utcnow(), 'p': json.dumps(dict(progress))}
+             for job_id, progress in list(self.running.items())]
+        )
+        db.session.commit()
+
+    def _requeue_stale(self):
+        stale = Job.query.filter(Job.status == RUNNING,
+                                 Job.heartbeat_at < datetime.utcnow() - timedelta(seconds=self.stale_seconds))
+        stale.filter(Job.attempts < Job.max_attempts).update(
+            {Job.status: QUEUED, Job.locked_by: None, Job.error: 'Runner stopped responding'},
+            synchronize_session=False)
+        stale.update({Job.status: FAILED, Job.locked_by: None, Job.finished_at: datetime.utcnow(),
+                      Job.error: 'Runner stopped responding'}, synchronize_session=False)
+        db.session.commit()
+
+    def _dispatch(self):
+        free = self.max_workers - len(self.running)
+        if free <= 0:
+            return
+        now = datetime.utcnow()
+        due = db.session.query(Job.id, Job.type) \
+            .filter(Job.status == QUEUED, Job.run_after <= now) \
+            .order_by(Job.run_after).limit(free * 4).all()
+        full = set()
+        for job_id, name in due:
+            spec = JOB_TYPES.get(name)
+            # Another deployment may know job types this one does not
+            if spec is None or name in full:
+                continue
+            if not self._claim(job_id, spec, now):
+                # Taken by another runner, or the type is at its concurrency
+                full.add(name)
+                continue
+            self.running[job_id] = {}
+            self._executor.submit(self._run, job_id, spec)
+            free -= 1
+            if not free:
+                return
+
+    def _claim(self, job_id, spec, now):
+        """Mark a queued job as ours if fewer than spec.concurrency of its type are running.
+
+        The type's queued and running rows are locked first, so runners
+        claiming the same type take turns, and the running count is part of
+        the UPDATE, so it cannot go stale between the check and the claim.
+        """
+        db.session.query(Job.id).filter(Job.type == spec.name, Job.status.in_((QUEUED, RUNNING))) \
+            .with_for_update().all()
+        job_table = Job.__table__
+        # Counted in a derived table: MySQL refuses a subquery on the table being updated
+        counted = select(func.count().label('n')) \
+            .where(job_table.c.type == spec.name, job_table.c.status == RUNNING).subquery()
+        claimed = db.session.execute(
+            job_table.update()
+            .where(job_table.c.id == job_id, job_table.c.status == QUEUED,
+                   select(counted.c.n).scalar_subquery() < spec.concurrency)
+            .values(status=RUNNING, locked_by=self.worker_id, attempts=job_table.c.attempts + 1,
+                    started_at=now, heartbeat_at=now, error=None)
+        ).rowcount
+        db.session.commit()
+        return bool(claimed)
+
+    def _housekeeping(self):
+        # Change events pile up with every write, whether or not anyone streams them
+        if self._pruned_at is not None and time.monotonic() - self._pruned_at < self.prune_seconds:
+            return
+        self._pruned_at = time.monotonic()
+        prune_events()
+
+    def _run(self, job_id, spec):
+        progress = self.running[job_id]
+        with self.app.app_context():
+            try:
+                params = json.loads(Job.query.get(job_id).params)
+                result = spec.func(params, progress)
+                self._finish(job_id, progress, {Job.status: FINISHED, Job.result: json.dumps(result)})
+            except Exception as e:
+                db.session.rollback()
+                logger.exception('Job %s (%s) failed', job_id, spec.name)
+                job = Job.query.get(job_id)
+                if job.attempts < job.max_attempts:
+                    delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                    self._finish(job_id, progress, {Job.status: QUEUED, Job.error: str(e),
+                                                    Job.run_after: datetime.utcnow() + timedelta(seconds=delay)})
+                else:
+                    self._finish(job_id, progress, {Job.status: FAILED, Job.error: str(e)})
+            finally:
+                self.running.pop(job_id, None)
+                db.session.remove()
+                self.wake()
+
+    def _finish(self, job_id, progress, values):
+        values = {**values, Job.progress: json.dumps(dict(progress)), Job.locked_by: None}
+        if values[Job.status] != QUEUED:
+            values[Job.finished_at] = datetime.utcnow()
+        Job.query.filter_by(id=job_id, locked_by=self.worker_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+runner = JobRunner()
+
+# Job types. Each must be safe to run again after a partial failure.
+
+@job_type('frappe_import', concurrency=1, max_attempts=3)
+def frappe_import(params, progress):
+    from .api_helper import run_import
+    params = dict(params)
+    pages = max(1, int(params.pop('pages', 1)))
+    near_duplicates = params.pop('near_duplicates', None)
+    return run_import(params, pages, progress, near_duplicates)
+
+@job_type('fees_refresh', concurrency=1, max_attempts=2)
+def fees_refresh(params, progress):
+    from .fees import refresh_projections
+    return {'members': refresh_projections()}
+
+@job_type('analytics_backfill', concurrency=1, max_attempts=2)
+def analytics_backfill(params, progress):
+    from datetime import date
+    from .analytics import backfill
+    until = date.fromisoformat(params['until']) if params.get('until') else None
+    return backfill(until, progress)
+
+@job_type('recommendations_build', concurrency=1, max_attempts=2)
+def recommendations_build(params, progress):
+    from flask import current_app
+    from .recommendations import build
+    full = params.get('full') in (True, 1, '1', 'true')
+    return build(current_app.config['RECOMMENDATIONS_DIR'], full=full, progress=progress)
+
+@job_type('transactions_archive', concurrency=1, max_attempts=3)
+def transactions_archive(params, progress):
+    from .archive import run_archive
+    days = int(params['days']) if params.get('days') is not None else None
+    max_batches = int(params['max_batches']) if params.get('max_batches') is not None else None
+    return run_archive(days, max_batches, progress)
+
+@job_type('books_duplicates_scan', concurrency=1, max_attempts=2)
+def books_duplicates_scan(params, progress):
+    from .dedup import scan_catalog
+    threshold = float(params['threshold']) if params.get('threshold') is not None else None
+    processes = int(params['processes']) if params.get('processes') is not None else None
+    return scan_catalog(threshold, processes, progress)
+
+@job_type('ledger_reconcile', concurrency=1, max_attempts=1)
+def ledger_reconcile(params, progress):
+    from .ledger import reconcile
+    # `flask jobs enqueue -p fix=1` passes strings
+    fix = params.get('fix') in (True, 1, '1', 'true')
+    checked, mismatches = reconcile(fix=fix)
+    return {'checked': checked, 'mismatches': len(mismatches), 'fixed': fix}
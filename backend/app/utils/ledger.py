@@ -0,0 +1,97 @@
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import bindparam, func, select
+from ..models import LedgerEntry, Member, db
+from .pagination import keyset_page
+
+FEE = 'fee'
+PAYMENT = 'payment'
+WAIVER = 'waiver'
+OPENING = 'opening'
+ADJUSTMENT = 'adjustment'
+
+def to_paise(amount):
+    """Convert a rupee amount to whole paise without going through float maths"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def to_rupees(paise):
+    return paise / 100
+
+def charge_fees(fees):
+    """Append fee entries and add them to the members' running balances.
+
+    `fees` is a list of (member_id, transaction_id, rupees) tuples; zero
+    fees are skipped.
+    """
+    entries = [{'member_id': member_id, 'transaction_id': transaction_id,
+                'kind': FEE, 'amount_paise': to_paise(amount)}
+               for member_id, transaction_id, amount in fees if amount]
+    if not entries:
+        return
+    db.session.bulk_insert_mappings(LedgerEntry, entries)
+
+    totals = {}
+    for entry in entries:
+        totals[entry['member_id']] = totals.get(entry['member_id'], 0) + entry['amount_paise']
+    member_table = Member.__table__
+    db.session.execute(
+        member_table.update()
+        .where(member_table.c.id == bindparam('m_id'))
+        .values(debt_paise=member_table.c.debt_paise + bindparam('p')),
+        [{'m_id': member_id, 'p': paise} for member_id, paise in totals.items()]
+    )
+
+def record_credit(member_id, paise, kind=PAYMENT, note=None):
+    """Append a payment or waiver, refusing to take the balance below zero.
+
+    Returns False when the member owes less than `paise`.
+    """
+    member_table = Member.__table__
+    updated = db.session.execute(
+        member_table.update()
+        .where(member_table.c.id == member_id)
+        .where(member_table.c.debt_paise >= paise)
+        .values(debt_paise=member_table.c.debt_paise - paise)
+    ).rowcount
+    if not updated:
+        return False
+    db.session.add(LedgerEntry(member_id=member_id, kind=kind, amount_paise=-paise, note=note))
+    return True
+
+def reconcile(fix=False, batch_size=1000):
+    """Check every member's running balance against the sum of their ledger.
+
+    Members are walked in keyset batches, each compared against one
+    GROUP BY over the ledger for that id range, so memory stays flat.
+    With fix=True mismatched balances are reset to the ledger total, summed
+    in the UPDATE itself.
+    Returns (members_checked, [(member_id, balance_paise, ledger_paise), ...]).
+    """
+    checked = 0
+    mismatches = []
+    after = 0
+    query = db.session.query(Member.id, Member.debt_paise)
+    while True:
+        members = keyset_page(query, Member.id, after, batch_size)
+        if not members:
+            break
+        first, last = members[0].id, members[-1].id
+        totals = dict(db.session.query(LedgerEntry.member_id, func.sum(LedgerEntry.amount_paise))
+                      .filter(LedgerEntry.member_id.between(first, last))
+                      .group_by(LedgerEntry.member_id))
+        batch = [(member.id, member.debt_paise, int(totals.get(member.id) or 0))
+                 for member in members if member.debt_paise != int(totals.get(member.id) or 0)]
+        if fix and batch:
+            # Sum the ledger inside the UPDATE, so a fee charged since the read above is kept
+            member_table, ledger_table = Member.__table__, LedgerEntry.__table__
+            ledger_total = select(func.coalesce(func.sum(ledger_table.c.amount_paise), 0)) \
+                .where(ledger_table.c.member_id == member_table.c.id).scalar_subquery()
+            db.session.execute(
+                member_table.update()
+                .where(member_table.c.id.in_([member_id for member_id, _, _ in batch]))
+                .values(debt_paise=ledger_total)
+            )
+            db.session.commit()
+        mismatches.extend(batch)
+        checked += len(members)
+        after = last
+    return checked, mismatches
@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval.
+
+    The result is in "folded" form (frame;frame;frame count per line), which
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+class Metrics:
+    """Per-endpoint latency, SQL and response size metrics served at /metrics.
+
+    Numbers are kept per worker process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.query_seconds = defaultdict(float)
+        self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.statuses = Counter()
+        self.slow_queries = 0
+        self._listening = False
+
+    def init_app(self, app):
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            self._listening = True
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if not has_request_context():
+            return
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_time = g.get('sql_time', 0.0) + elapsed
+        if elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+            self.slow_queries += 1
+            logger.warning('Slow query (%.1f ms) in %s %s: %s',
+                           elapsed * 1000, request.method, request.path, statement)
+
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute; drop its start time
+        if context.connection is not None:
+            starts = context.connection.info.get('query_start')
+            if starts:
+                starts.pop()
+
+    def _before_request(self):
+        g.request_start = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        sample_rate = current_app.config['PROFILE_SAMPLE_RATE']
+        if sample_rate and random.random() < sample_rate:
+            g.sampler = StackSampler(threading.get_ident(), current_app.config['PROFILE_INTERVAL_MS'] / 1000)
+            g.sampler.start()
+
+    def _after_request(self, response):
+        if 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        key = (endpoint, request.method)
+        with self._lock:
+            self.latency[key].observe(elapsed)
+            self.queries[key].observe(g.sql_count)
+            self.query_seconds[key] += g.sql_time
+            self.statuses[key + (response.status_code,)] += 1
+            # Streamed responses have no length up front
+            if response.content_length is not None:
+                self.sizes[key].observe(response.content_length)
+
+        sampler = g.pop('sampler', None)
+        if sampler is not None:
+            self._dump_profile(sampler.stop(), endpoint, elapsed)
+        return response
+
+    def _teardown_request(self, exc):
+        # Unhandled errors skip after_request; never leave a sampler running
+        sampler = g.pop('sampler', None)
+        if sampler is not None:
+            sampler.stop()
+
+    def _dump_profile(self, stacks, endpoint, elapsed):
+        if not stacks:
+            return
+        directory = current_app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = endpoint.strip('/').replace('/', '_').replace('<', '').replace('>', '').replace(':', '_') or 'root'
+        path = os.path.join(directory, f'{name}-{request.method}-{time.time_ns()}-{elapsed * 1000:.0f}ms.folded')
+        with open(path, 'w') as f:
+            for stack, count in stacks.items():
+                f.write(f'{stack} {count}\n')
+
+    def render(self):
+        lines = [
+            '# HELP http_request_duration_seconds Request latency per endpoint.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                lines += histogram.render('http_request_duration_seconds', f'endpoint="{endpoint}",method="{method}"')
+            lines += ['# HELP http_requests_total Responses per endpoint and status.',
+                      '# TYPE http_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.statuses.items()):
+                lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            lines += ['# HELP db_queries_per_request SQL statements executed per request.',
+                      '# TYPE db_queries_per_request histogram']
+            for (endpoint, method), histogram in sorted(self.queries.items()):
+                lines += histogram.render('db_queries_per_request', f'endpoint="{endpoint}",method="{method}"')
+            lines += ['# HELP db_query_seconds_total Time spent in SQL per endpoint.',
+                      '# TYPE db_query_seconds_total counter']
+            for (endpoint, method), seconds in sorted(self.query_seconds.items()):
+                lines.append(f'db_query_seconds_total{{endpoint="{endpoint}",method="{method}"}} {seconds}')
+            lines += ['# HELP http_response_size_bytes Response body size per endpoint.',
+                      '# TYPE http_response_size_bytes histogram']
+            for (endpoint, method), histogram in sorted(self.sizes.items()):
+                lines += histogram.render('http_response_size_bytes', f'endpoint="{endpoint}",method="{method}"')
+        lines += ['# HELP db_slow_queries_total Statements slower than SLOW_QUERY_MS.',
+                  '# TYPE db_slow_queries_total counter',
+                  f'db_slow_queries_total {self.slow_queries}']
+
+        from .cache import response_cache
+        lines += ['# HELP response_cache_total Response cache lookups by result.',
+                  '# TYPE response_cache_total counter']
+        for result, count in response_cache.stats().items():
+            lines.append(f'response_cache_total{{result="{result}"}} {count}')
+
+        from .frappe_proxy import frappe_proxy
+        lines += ['# HELP frappe_search_total Frappe search proxy lookups by outcome.',
+                  '# TYPE frappe_search_total counter']
+        for result, count in frappe_proxy.stats.items():
+            lines.append(f'frappe_search_total{{result="{result}"}} {count}')
+
+        from .admission import admission
+        lines += ['# HELP admission_requests_total API requests by endpoint class and admission outcome.',
+                  '# TYPE admission_requests_total counter']
+        for (klass, outcome), count in sorted(admission.stats.items()):
+            lines.append(f'admission_requests_total{{class="{klass}",outcome="{outcome}"}} {count}')
+        lines += ['# HELP admission_queue_delay_seconds Moving average of time queued before the app.',
+                  '# TYPE admission_queue_delay_seconds gauge',
+                  f'admission_queue_delay_seconds {admission.queue_delay}']
+
+        from .events import change_feed
+        lines += ['# HELP change_feed_clients Open change feed streams.',
+                  '# TYPE change_feed_clients gauge',
+                  f'change_feed_clients {change_feed.clients}',
+                  '# HELP change_feed_events_total Change feed events by outcome.',
+                  '# TYPE change_feed_events_total counter']
+        for result, count in change_feed.stats.items():
+            lines.append(f'change_feed_events_total{{result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+metrics = Metrics()
@@ -0,0 +1,79 @@
+from flask import Response, request, stream_with_context
+from .serialization import dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+def _int_arg(name, default):
+    value = request.args.get(name, '')
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer') from None
+
+def get_page_args():
+    """Read and clamp the `limit`/`after` keyset pagination arguments.
+
+    Raises ValueError for a value that is not an integer, rather than
+    quietly starting over from the first page.
+    """
+    limit = _int_arg('limit', DEFAULT_PAGE_SIZE)
+    after = _int_arg('after', 0)
+    return max(1, min(limit, MAX_PAGE_SIZE)), max(after, 0)
+
+def is_paginated():
+    """Check whether the client asked for a single keyset page"""
+    return 'limit' in request.args or 'after' in request.args
+
+def keyset_page(query, key_column, after, limit):
+    """Fetch one page of rows with key_column > after, ordered by key_column"""
+    return query.filter(key_column > after).order_by(key_column).limit(limit).all()
+
+def iter_keyset(query, key_column, key_index=0, batch_size=STREAM_BATCH_SIZE):
+    """Yield every row of query in key order, one bounded batch at a time.
+
+    Each batch is a separate `WHERE key > last ORDER BY key LIMIT n` query, so
+    memory stays flat and no long-running cursor is held open on the server.
+    """
+    after = 0
+    while True:
+        rows = keyset_page(query, key_column, after, batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][key_index]
+
+def page_response(items, limit, key='id'):
+    """Build the JSON body for a keyset page"""
+    next_after = items[-1][key] if len(items) == limit else None
+    return {'items': items, 'next_after': next_after, 'limit': limit}
+
+def _chunked(parts, chunk_size=STREAM_BATCH_SIZE):
+    """Join small string parts into larger chunks before they hit the socket"""
+    buffer = []
+    for part in parts:
+        buffer.append(part)
+        if len(buffer) >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+    if buffer:
+        yield b''.join(buffer)
+
+def stream_json(items, fmt='json'):
+    """Stream serialized dicts as NDJSON or as one chunked JSON array"""
+    if fmt == 'ndjson':
+        parts = (dumps(item) + b'\n' for item in items)
+        return Response(stream_with_context(_chunked(parts)), mimetype='application/x-ndjson')
+
+    def generate():
+        yield b'['
+        for i, item in enumerate(items):
+            yield (b',' if i else b'') + dumps(item)
+        yield b']'
+    return Response(stream_with_context(_chunked(generate())), mimetype='application/json')
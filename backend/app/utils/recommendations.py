@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+from sqlalchemy import false, func, or_, select
+from ..models import Transaction, TransactionArchive, db
+from .archive import both_tables
+
+logger = logging.getLogger(__name__)
+
+ARRAYS = ('indptr', 'indices', 'counts', 'popularity')
+# A member's first MAX_BASKET distinct books count; beyond that the pairs grow quadratically for little signal
+MAX_BASKET = 200
+# Members read per query when building from scratch
+MEMBER_BATCH = 5000
+# Co-borrow pairs gathered before they are folded into the running totals
+PAIR_BATCH = 5_000_000
+# Loans among the newest OVERLAP ids may still be committing when a build reads them
+# (InnoDB hands out ids at insert time), so each build re-reads that window and the
+# saved matrix lists which of its ids it already holds
+OVERLAP = 2000
+
+def _merge(keys, counts):
+    """Sum counts of equal keys; returns sorted unique keys and their totals"""
+    if not len(keys):
+        return keys, counts
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(counts, starts)
+
+def _basket_pairs(old, new):
+    """(row, col) book id arrays for every pair a member's new books add to the matrix"""
+    new = np.asarray(new, dtype=np.int64)
+    old = np.asarray(old, dtype=np.int64)
+    # New books with each other, both directions, no diagonal
+    rows, cols = np.meshgrid(new, new, indexing='ij')
+    mask = rows != cols
+    rows, cols = [rows[mask]], [cols[mask]]
+    if len(old):
+        a, b = np.meshgrid(new, old, indexing='ij')
+        rows += [a.ravel(), b.ravel()]
+        cols += [b.ravel(), a.ravel()]
+    return np.concatenate(rows), np.concatenate(cols)
+
+class CoBorrowMatrix:
+    """Item-item co-occurrence counts in CSR form, indexed directly by book id.
+
+    Row `b` lists the books borrowed by members who also borrowed book `b`
+    (indices) and how many such members there are (counts). popularity[b]
+    is the number of distinct members who borrowed `b`. Saved as .npy files
+    and opened with mmap_mode='r', so every worker process shares one copy
+    in the page cache.
+    """
+
+    def __init__(self, indptr, indices, counts, popularity, meta):
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.popularity = popularity
+        self.meta = meta
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(1, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int32),
+                   np.zeros(0, np.int32), {'last_transaction_id': 0, 'recent_transaction_ids': []})
+
+    @property
+    def n_books(self):
+        return len(self.indptr) - 1
+
+    def row(self, book_id):
+        if not 0 <= book_id < self.n_books:
+            return np.zeros(0, np.int32), np.zeros(0, np.float64), np.zeros(0, np.int32)
+        start, end = self.indptr[book_id], self.indptr[book_id + 1]
+        cols, counts = self.indices[start:end], self.counts[start:end]
+        # Cosine similarity of the two books' borrower sets
+        scores = counts / np.sqrt(float(self.popularity[book_id]) * self.popularity[cols])
+        return cols, scores, counts
+
+    def add(self, rows, cols, popularity_delta):
+        """A new matrix with (row, col) pair counts and per-book borrower counts added"""
+        size = int(max(self.n_books, rows.max() + 1 if len(rows) else 0, len(popularity_delta)))
+        old_rows = np.repeat(np.arange(self.n_books, dtype=np.int64), np.diff(self.indptr))
+        keys, counts = _merge(
+            np.concatenate([old_rows * size + self.indices, rows * size + cols]),
+            np.concatenate([np.asarray(self.counts, np.int64), np.ones(len(rows), np.int64)])
+        )
+        new_rows = keys // size
+        indptr = np.zeros(size + 1, np.int64)
+        np.cumsum(np.bincount(new_rows, minlength=size), out=indptr[1:])
+        popularity = np.zeros(size, np.int32)
+        popularity[:self.n_books] = self.popularity
+        popularity[:len(popularity_delta)] += popularity_delta.astype(np.int32)
+        return CoBorrowMatrix(indptr, (keys % size).astype(np.int32), counts.astype(np.int32),
+                              popularity, dict(self.meta))
+
+    def save(self, directory):
+        """Write a new version next to the old ones and point CURRENT at it atomically"""
+        version = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(directory, version)
+        os.makedirs(path)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+        with open(os.path.join(directory, 'CURRENT.tmp'), 'w') as f:
+            f.write(version)
+        os.replace(os.path.join(directory, 'CURRENT.tmp'), os.path.join(directory, 'CURRENT'))
+        # Workers may still map the previous version; older ones can go (mappings outlive unlinking)
+        for old in sorted(name for name in os.listdir(directory) if name[0].isdigit())[:-2]:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+        return version
+
+    @classmethod
+    def load(cls, directory):
+        """Memory-map the current version, or None if nothing has been built yet"""
+        try:
+            with open(os.path.join(directory, 'CURRENT')) as f:
+                path = os.path.join(directory, f.read().strip())
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        # Plain ndarray views of the mappings skip np.memmap's per-slice bookkeeping
+        arrays = [np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r').view(np.ndarray) for name in ARRAYS]
+        return cls(*arrays, meta)
+
+def _baskets(query):
+    """{member_id: [book_id, ...]} in first-borrow order from (member_id, book_id, first_id) rows"""
+    baskets = {}
+    for member_id, book_id, _ in sorted(query, key=lambda row: (row[0], row[2])):
+        baskets.setdefault(member_id, []).append(book_id)
+    return baskets
+
+def _distinct_loans(where):
+    """(member_id, book_id, first_id) over hot and archived loans matching where(model)"""
+    loans = both_tables(lambda model, _: select(model.member_id, model.book_id, model.id).where(*where(model)))
+    return db.session.query(loans.c.member_id, loans.c.book_id, func.min(loans.c.id)) \
+        .group_by(loans.c.member_id, loans.c.book_id)
+
+def _member_ids(where, limit=None):
+    """Distinct member ids, ascending, of hot and archived loans matching where(model)"""
+    def build(model, _):
+        query = select(model.member_id).where(*where(model)).group_by(model.member_id).order_by(model.member_id)
+        return query.limit(limit) if limit else query
+    loans = both_tables(build)
+    query = select(loans.c.member_id).group_by(loans.c.member_id).order_by(loans.c.member_id)
+    return [member_id for (member_id,) in db.session.execute(query.limit(limit) if limit else query)]
+
+def _loan_ids(low, high):
+    """Ids of hot and archived loans in (low, high], ascending"""
+    loans = both_tables(lambda model, _: select(model.id).where(model.id > low, model.id <= high))
+    return [loan_id for (loan_id,) in db.session.execute(select(loans.c.id).order_by(loans.c.id))]
+
+def _pairs_for(baskets_before, baskets_after, rows, cols, popularity):
+    """Collect the pairs and borrower counts each member's new books add; returns the pair count"""
+    added = 0
+    for member_id, after in baskets_after.items():
+        before = baskets_before.get(member_id, [])[:MAX_BASKET]
+        seen = set(before)
+        new = [book_id for book_id in after if book_id not in seen][:MAX_BASKET - len(before)]
+        if not new:
+            continue
+        r, c = _basket_pairs(before, new)
+        rows.append(r)
+        cols.append(c)
+        popularity.extend(new)
+        added += len(r)
+    return added
+
+def build(directory, full=False, progress=None):
+    """Fold loans made since the last build into the matrix and save a new version.
+
+    With full=True, or when nothing was built yet, every loan is read, member
+    batch by member batch. Otherwise only loans the matrix does not hold yet
+    are read, plus the earlier books of the members who made them. A loan
+    holds if its id is below the last build's OVERLAP window or listed in
+    the window, so one that committed after a later id was read is still
+    picked up by the next build.
+    """
+    progress = progress if progress is not None else {}
+    current = None if full else CoBorrowMatrix.load(directory)
+    matrix = current or CoBorrowMatrix.empty()
+    last_id = matrix.meta['last_transaction_id']
+    # Matrices saved before the window was tracked hold every id up to last_id
+    held_recent = matrix.meta.get('recent_transaction_ids')
+    held_below = last_id if held_recent is None else max(last_id - OVERLAP, 0)
+    held_recent = held_recent or []
+    high_id = max(db.session.query(func.max(model.id)).scalar() or 0 for model in (Transaction, TransactionArchive))
+    recent = _loan_ids(max(high_id - OVERLAP, 0), high_id)
+    progress.update({'from_transaction_id': held_below, 'to_transaction_id': high_id, 'members': 0})
+    if current is not None and not set(recent) - set(held_recent) \
+            and high_id - OVERLAP <= held_below:
+        return progress
+
+    rows, cols, popularity = [], [], []
+    pending = 0
+
+    def fold():
+        nonlocal matrix, rows, cols, popularity, pending
+        if rows:
+            matrix = matrix.add(np.concatenate(rows), np.concatenate(cols),
+                                np.bincount(np.asarray(popularity, np.int64)))
+        rows, cols, popularity, pending = [], [], [], 0
+
+    def held(model):
+        return or_(model.id <= held_below, model.id.in_(held_recent)) if last_id else false()
+
+    def visible(model):
+        # Below the window every loan has committed; within it, only those read above
+        return or_(model.id <= high_id - OVERLAP, model.id.in_(recent))
+
+    def window(model):
+        return visible(model), ~held(model)
+
+    if last_id == 0:
+        after_member = 0
+        while True:
+            member_ids = _member_ids(lambda model: (model.member_id > after_member, *window(model)), MEMBER_BATCH)
+            if not member_ids:
+                break
+            after = _baskets(_distinct_loans(
+                lambda model: (model.member_id.between(member_ids[0], member_ids[-1]), *window(model))))
+            pending += _pairs_for({}, after, rows, cols, popularity)
+            progress['members'] += len(after)
+            after_member = member_ids[-1]
+            if pending >= PAIR_BATCH:
+                fold()
+    else:
+        member_ids = _member_ids(window)
+        for start in range(0, len(member_ids), MEMBER_BATCH):
+            batch = member_ids[start:start + MEMBER_BATCH]
+            before = _baskets(_distinct_loans(lambda model: (model.member_id.in_(batch), held(model))))
+            after = _baskets(_distinct_loans(lambda model: (model.member_id.in_(batch), visible(model))))
+            pending += _pairs_for(before, after, rows, cols, popularity)
+            progress['members'] += len(batch)
+            if pending >= PAIR_BATCH:
+                fold()
+    fold()
+
+    matrix.meta.update({'last_transaction_id': high_id, 'recent_transaction_ids': recent, 'built_at': datetime.utcnow().isoformat(),
+                        'pairs': int(len(matrix.indices))})
+    os.makedirs(directory, exist_ok=True)
+    progress['version'] = matrix.save(directory)
+    progress['pairs'] = matrix.meta['pairs']
+    return progress
+
+class Recommender:
+    """Serves lookups from the memory-mapped matrix, picking up new versions as they are saved"""
+
+    def __init__(self):
+        self.matrix = None
+        self._version = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config['RECOMMENDATIONS_DIR']
+        self.reload_seconds = app.config['RECOMMENDATIONS_RELOAD_SECONDS']
+        self.min_support = app.config['RECOMMENDATIONS_MIN_SUPPORT']
+
+    def _current(self):
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.reload_seconds:
+            return self.matrix
+        with self._lock:
+            self._checked = now
+            try:
+                with open(os.path.join(self.directory, 'CURRENT')) as f:
+                    version = f.read().strip()
+            except FileNotFoundError:
+                return self.matrix
+            if version != self._version:
+                self.matrix = CoBorrowMatrix.load(self.directory)
+                self._version = version
+        return self.matrix
+
+    def _top(self, cols, scores, counts, limit, exclude=()):
+        keep = counts >= self.min_support
+        if exclude:
+            keep &= ~np.isin(cols, list(exclude))
+        cols, scores, counts = cols[keep], scores[keep], counts[keep]
+        if len(cols) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            cols, scores, counts = cols[best], scores[best], counts[best]
+        order = np.lexsort((cols, -scores))
+        return [(int(cols[i]), round(float(scores[i]), 4), int(counts[i])) for i in order]
+
+    def similar(self, book_id, limit=10):
+        """[(book_id, score, members who borrowed both)] for "also borrowed" under a book"""
+        matrix = self._current()
+        if matrix is None:
+            return []
+        cols, scores, counts = matrix.row(book_id)
+        return self._top(cols, scores, counts, limit, exclude=(book_id,))
+
+    def for_books(self, book_ids, limit=10):
+        """Suggestions for a member who borrowed book_ids: summed similarity, excluding those books"""
+        matrix = self._current()
+        if matrix is None or not book_ids:
+            return []
+        parts = [matrix.row(book_id) for book_id in book_ids]
+        cols = np.concatenate([part[0] for part in parts])
+        if not len(cols):
+            return []
+        # Book ids are small dense integers, so summing by bincount beats sorting the candidates
+        scores = np.bincount(cols, weights=np.concatenate([part[1] for part in parts]))
+        counts = np.bincount(cols, weights=np.concatenate([part[2] for part in parts]))
+        candidates = np.flatnonzero(counts)
+        return self._top(candidates, scores[candidates], counts[candidates].astype(np.int64), limit,
+                         exclude=set(book_ids))
+
+    def status(self):
+        matrix = self._current()
+        return dict(matrix.meta, books=matrix.n_books) if matrix is not None else None
+
+recommender = Recommender()
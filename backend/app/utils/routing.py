@@ -0,0 +1,158 @@
+import time
+import logging
+import threading
+from itertools import count
+from flask import current_app, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Only GETs on these blueprints may be served from a replica (response cache misses excepted)
+ROUTED_BLUEPRINTS = ('books', 'members', 'transactions')
+# Set by write requests; GETs carrying it read from the primary until it expires
+STICKY_COOKIE = 'read_primary_until'
+PRIMARY_HEADER = 'X-Read-Primary'
+
+class ReplicaPool:
+    """Round-robin over read replicas, skipping replicas that recently failed.
+
+    A replica that raises a connection error is marked down for
+    REPLICA_RETRY_SECONDS. After that, it is probed with SELECT 1 before it
+    is used again. With no healthy replica, reads fall back to the primary.
+    """
+
+    def __init__(self):
+        self.engines = []
+        self.down_until = {}
+        self._counter = count()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        from ..config import engine_options
+        self.retry_seconds = app.config['REPLICA_RETRY_SECONDS']
+        self.engines = [create_engine(url, **engine_options(url, prefix='REPLICA'))
+                        for url in app.config['SQLALCHEMY_REPLICA_URLS']]
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self._handle_error)
+
+    def choose(self):
+        """A healthy replica engine, or None to use the primary"""
+        start = next(self._counter)
+        for i in range(len(self.engines)):
+            engine = self.engines[(start + i) % len(self.engines)]
+            if self._healthy(engine):
+                return engine
+        return None
+
+    def _healthy(self, engine):
+        until = self.down_until.get(engine)
+        if until is None:
+            return True
+        if time.monotonic() < until:
+            return False
+        with self._lock:
+            # Another thread may have probed it while we waited
+            if self.down_until.get(engine, 0) > time.monotonic():
+                return False
+            try:
+                with engine.connect() as connection:
+                    connection.exec_driver_sql('SELECT 1')
+            except OperationalError:
+                self.mark_down(engine)
+                return False
+            self.down_until.pop(engine, None)
+            logger.info('Replica %s is back', engine.url)
+            return True
+
+    def mark_down(self, engine):
+        self.down_until[engine] = time.monotonic() + self.retry_seconds
+        logger.warning('Replica %s marked down for %ss', engine.url, self.retry_seconds)
+
+    def _handle_error(self, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            self.mark_down(context.engine)
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+replicas = ReplicaPool()
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads to the replica picked for the request.
+
+    Anything flushed in the session, and every query after it, goes to the
+    primary, as do requests that never picked a replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not self.info.get('wrote'):
+            return replica
+        return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+def _after_flush(session, flush_context):
+    session.info['wrote'] = True
+
+event.listen(RoutingSession, 'after_flush', _after_flush)
+
+def _wants_primary():
+    if request.headers.get(PRIMARY_HEADER):
+        return True
+    until = request.cookies.get(STICKY_COOKIE, type=float)
+    return until is not None and until > time.time()
+
+def read_from_primary():
+    """Send the rest of the request's reads to the primary; True if it had picked a replica"""
+    session = current_app.extensions['sqlalchemy'].db.session
+    if session.info.pop('replica', None) is None:
+        return False
+    # Nothing has been read yet; give the replica connection back
+    session.close()
+    return True
+
+def init_app(app, db):
+    """Route reads on the listed blueprints to replicas, with read-your-writes stickiness"""
+    replicas.init_app(app)
+    if not replicas.engines:
+        return
+    sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+
+    @app.before_request
+    def pick_replica():
+        if request.method not in ('GET', 'HEAD') or request.blueprint not in ROUTED_BLUEPRINTS or _wants_primary():
+            return
+        for _ in replicas.engines:
+            replica = replicas.choose()
+            if replica is None:
+                return
+            try:
+                # Check out the connection now, so a dead replica fails over before the view runs
+                db.session.connection(bind_arguments={'bind': replica})
+            except OperationalError:
+                db.session.rollback()
+                continue
+            db.session.info['replica'] = replica
+            return
+
+    @app.after_request
+    def stick_to_primary(response):
+        # Let the client read its own write even if the replicas lag behind
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and request.blueprint in ROUTED_BLUEPRINTS \
+                and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky_seconds),
+                                max_age=sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    @app.teardown_request
+    def forget_replica(exc):
+        # The scoped session can outlive the request when an outer app context is pushed
+        if db.session.registry.has():
+            db.session.info.pop('replica', None)
+            db.session.info.pop('wrote', None)
@@ -0,0 +1,318 @@
+import re
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Relative weight of a match in each field
+FIELD_WEIGHTS = {'title': 3.0, 'author': 2.0, 'publisher': 1.0}
+# A prefix match scores less than the whole word
+PREFIX_FACTOR = 0.5
+# Scores are counted in steps of 1/SCORE_SCALE, so they are small integers; every
+# field weight, whole or times PREFIX_FACTOR, must be a whole number of steps
+SCORE_SCALE = 2
+# Books scanned at a time for the lowest ids tied at the cut-off score
+TIE_BLOCK = 1 << 16
+# A multi-word query is intersected from its rarest word's books when that word
+# matches fewer than one book in SPARSE_FRACTION, and across all books otherwise
+SPARSE_FRACTION = 8
+# Upper bound on vocabulary terms a single prefix may expand to; results say when it was hit
+MAX_PREFIX_EXPANSION = 200
+# Change events that touch the index
+BOOK_EVENTS = ('book.created', 'book.updated', 'book.deleted', 'books.imported')
+# A missing event id may belong to a transaction that has not committed yet; wait this
+# long for it before moving past it, as the change feed does
+GAP_GRACE_SECONDS = 2.0
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+class BookSearchIndex:
+    """In-process inverted index over book title, author and publisher.
+
+    Postings map each token to {book_id: weight}; a sorted vocabulary list
+    gives prefix (typeahead) lookups with bisect. Queries score in numpy:
+    each term's postings are also kept as id and score arrays, rebuilt
+    after the term changes, and scattered into a dense array per token.
+    The index is built once from the database. Book writes in this process
+    update it directly; writes in other processes are read back from the
+    change_event table.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._doc_tokens = {}
+        self._vocab = []
+        self._arrays = {}
+        self.loaded = False
+        # Last change event applied, highest book id seen, and when the catch-up last ran
+        self.event_id = 0
+        self.max_id = 0
+        self.synced_at = 0.0
+        self.rebuilding = False
+        self._gap = None
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    def add(self, book_id, title, author, publisher=None):
+        weights = defaultdict(float)
+        for field, text in (('title', title), ('author', author), ('publisher', publisher)):
+            for token in tokenize(text):
+                weights[token] += FIELD_WEIGHTS[field]
+
+        with self._lock:
+            self._remove(book_id)
+            for token, weight in weights.items():
+                postings = self._postings[token]
+                if not postings:
+                    insort(self._vocab, token)
+                postings[book_id] = weight
+                self._arrays.pop(token, None)
+            self._doc_tokens[book_id] = tuple(weights)
+            self.max_id = max(self.max_id, book_id)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def _remove(self, book_id):
+        for token in self._doc_tokens.pop(book_id, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(book_id, None)
+            self._arrays.pop(token, None)
+            if not postings:
+                del self._postings[token]
+                i = bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+
+    def _expand(self, prefix):
+        """Vocabulary terms starting with prefix, in sorted order, and whether there were more"""
+        i = bisect_left(self._vocab, prefix)
+        terms = []
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            if len(terms) == MAX_PREFIX_EXPANSION:
+                return terms, True
+            terms.append(self._vocab[i])
+            i += 1
+        return terms, False
+
+    def _term_arrays(self, term):
+        """A term's postings as (book ids, whole-word scores, prefix scores) arrays"""
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings[term]
+            ids = np.fromiter(postings.keys(), np.int64, len(postings))
+            weights = np.fromiter(postings.values(), np.float64, len(postings))
+            arrays = self._arrays[term] = (ids, np.rint(weights * SCORE_SCALE).astype(np.uint16),
+                                           np.rint(weights * SCORE_SCALE * PREFIX_FACTOR).astype(np.uint16))
+        return arrays
+
+    def _match(self, token):
+        """Best score per book for one query token (exact or prefix match) as a dense array,
+        the number of postings it covered, and whether it was truncated"""
+        scores = np.zeros(self.max_id + 1, np.uint16)
+        postings = 0
+        terms, truncated = self._expand(token)
+        for term in terms:
+            ids, exact, prefix = self._term_arrays(term)
+            scores[ids] = np.maximum(scores[ids], exact if term == token else prefix)
+            postings += len(ids)
+        return scores, postings, truncated
+
+    def warm(self):
+        """Build every term's arrays now rather than on the first query that needs them"""
+        with self._lock:
+            for term in self._vocab:
+                self._term_arrays(term)
+
+    def search(self, query, limit=20, offset=0):
+        """Return (total, [(book_id, score), ...], truncated) for books matching every query token.
+
+        Hits are ordered by score, then book id. truncated is True when a
+        prefix matched more than MAX_PREFIX_EXPANSION terms; total and hits
+        then only cover the first terms in sort order.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return 0, [], False
+
+        with self._lock:
+            matched = sorted((self._match(token) for token in tokens), key=lambda match: match[1])
+        truncated = any(cut for _, _, cut in matched)
+        wanted = offset + limit
+
+        rarest = matched[0][0]
+        if len(matched) > 1 and matched[0][1] * SPARSE_FRACTION < len(rarest):
+            # Intersect from the rarest token's books rather than across every book
+            ids = np.flatnonzero(rarest)
+            scores = rarest[ids]
+            for other, _, _ in matched[1:]:
+                extra = other[ids]
+                keep = extra > 0
+                ids, scores = ids[keep], scores[keep] + extra[keep]
+            total = len(ids)
+            if total > wanted:
+                cutoff, better = _cutoff(scores, wanted)
+                ids = np.concatenate((ids[scores > cutoff], ids[scores == cutoff][:wanted - better]))
+                scores = np.concatenate((scores[scores > cutoff], np.full(wanted - better, cutoff, np.uint16)))
+        else:
+            dense = rarest
+            for other, _, _ in matched[1:]:
+                dense = np.where((dense > 0) & (other > 0), dense + other, 0).astype(np.uint16)
+            total = int(np.count_nonzero(dense))
+            if total <= wanted:
+                ids = np.flatnonzero(dense)
+            else:
+                cutoff, better = _cutoff(dense, wanted)
+                ids = np.concatenate((np.flatnonzero(dense > cutoff), _first_at(dense, cutoff, wanted - better)))
+            scores = dense[ids]
+
+        order = np.lexsort((ids, -scores.astype(np.int32)))[offset:wanted]
+        return total, [(int(ids[i]), int(scores[i]) / SCORE_SCALE) for i in order], truncated
+
+    def replace(self, other):
+        """Take over another index's contents (a rebuild made without holding this lock)"""
+        with self._lock:
+            self._postings, self._doc_tokens, self._vocab = other._postings, other._doc_tokens, other._vocab
+            self._arrays = other._arrays
+            self.event_id, self.max_id, self._gap = other.event_id, other.max_id, None
+
+def _cutoff(scores, wanted):
+    """The score of the wanted-th best hit, and how many score higher; there must be more than wanted hits"""
+    # Walks down the score levels present, a few passes over scores in practice
+    cutoff = int(scores.max())
+    better = 0
+    while True:
+        at_least = int(np.count_nonzero(scores >= cutoff))
+        if at_least >= wanted:
+            return cutoff, better
+        better = at_least
+        cutoff = int(np.max(scores, where=scores < cutoff, initial=0))
+
+def _first_at(scores, value, count):
+    """The `count` lowest ids whose score is value, scanning a block at a time"""
+    found = []
+    for start in range(0, len(scores), TIE_BLOCK):
+        ids = np.flatnonzero(scores[start:start + TIE_BLOCK] == value) + start
+        found.append(ids[:count])
+        count -= len(found[-1])
+        if not count:
+            break
+    return np.concatenate(found)
+
+def _load(index):
+    """Fill an empty index from the book table; events after the returned mark still need applying"""
+    from ..models import Book, ChangeEvent, db
+    from sqlalchemy import func
+    from .pagination import iter_keyset
+    # Read the mark first: a write that lands during the scan is applied again, never missed
+    index.event_id = db.session.query(func.max(ChangeEvent.id)).scalar() or 0
+    query = db.session.query(Book.id, Book.title, Book.author, Book.publisher)
+    for row in iter_keyset(query, Book.id):
+        index.add(row.id, row.title, row.author, row.publisher)
+    index.warm()
+
+def _catch_up(index):
+    """Apply book changes other processes committed since the index last looked.
+
+    Returns False when the index must be rebuilt as well: the events it needs
+    were pruned, or a bulk import changed too many books to apply one by one.
+    The events after an import are still applied meanwhile.
+    """
+    from ..models import ChangeEvent, db
+    from sqlalchemy import func
+    rows = db.session.query(ChangeEvent.id, ChangeEvent.type, ChangeEvent.data) \
+        .filter(ChangeEvent.id > index.event_id).order_by(ChangeEvent.id).limit(1000).all()
+    if rows and rows[0].id > index.event_id + 1 and \
+            (db.session.query(func.min(ChangeEvent.id)).scalar() or 0) > index.event_id + 1:
+        return False
+    current = True
+    expected = index.event_id + 1
+    for row in rows:
+        if row.id != expected:
+            now = time.monotonic()
+            if index._gap is None or index._gap[0] != expected:
+                index._gap = (expected, now)
+            if now - index._gap[1] < GAP_GRACE_SECONDS:
+                break
+        if row.type in BOOK_EVENTS:
+            data = json.loads(row.data)
+            if row.type == 'book.deleted':
+                index.remove(data['id'])
+            elif row.type == 'books.imported':
+                current = False
+            else:
+                index.add(data['id'], data['title'], data['author'], data.get('publisher'))
+        index.event_id = expected = row.id
+        expected += 1
+    return current
+
+search_index = BookSearchIndex()
+
+def get_search_index():
+    """Return the process-wide index, built on first use and then caught up with other processes' writes.
+
+    The catch-up runs at most every SEARCH_SYNC_SECONDS. A rebuild runs on
+    a background thread into a separate index, so searches keep using the
+    old one meanwhile and never wait for it.
+    """
+    from flask import current_app
+    if not search_index.loaded:
+        with search_index._lock:
+            if not search_index.loaded:
+                _load(search_index)
+                search_index.synced_at = time.monotonic()
+                search_index.loaded = True
+    current = True
+    if time.monotonic() - search_index.synced_at >= current_app.config['SEARCH_SYNC_SECONDS']:
+        with search_index._lock:
+            if time.monotonic() - search_index.synced_at >= current_app.config['SEARCH_SYNC_SECONDS']:
+                current = _catch_up(search_index)
+                search_index.synced_at = time.monotonic()
+        if not current:
+            _rebuild_in_background(current_app._get_current_object())
+    return search_index
+
+def _rebuild_in_background(app):
+    with search_index._lock:
+        if search_index.rebuilding:
+            return
+        search_index.rebuilding = True
+
+    def rebuild():
+        from ..models import db
+        with app.app_context():
+            try:
+                fresh = BookSearchIndex()
+                _load(fresh)
+                # Events from the mark onwards are applied again by the next catch-up
+                search_index.replace(fresh)
+            except Exception:
+                logger.exception('Search index rebuild failed')
+            finally:
+                search_index.rebuilding = False
+                db.session.remove()
+
+    threading.Thread(target=rebuild, name='search-index-rebuild', daemon=True).start()
+
+def index_book(book):
+    """Refresh a book in the index after it was created or updated"""
+    if search_index.loaded:
+        search_index.add(book.id, book.title, book.author, book.publisher)
+
+def unindex_book(book_id):
+    """Drop a deleted book from the index"""
+    if search_index.loaded:
+        search_index.remove(book_id)
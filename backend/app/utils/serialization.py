@@ -0,0 +1,122 @@
+import datetime
+import decimal
+from flask import current_app
+from ..models import Book, BookDuplicate, LedgerEntry, Member, Transaction
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional, stdlib json is the fallback
+    orjson = None
+    import json
+
+def _default(obj):
+    """Types neither encoder handles natively (MySQL aggregates come back as Decimal)"""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+if orjson is not None:
+    def dumps(obj):
+        """Encode obj as UTF-8 JSON bytes"""
+        return orjson.dumps(obj, default=_default)
+else:
+    def dumps(obj):
+        """Encode obj as UTF-8 JSON bytes"""
+        return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+def jsonify(*args, **kwargs):
+    """Drop-in for flask.jsonify that encodes with the fast backend"""
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    data = args[0] if len(args) == 1 else (list(args) if args else kwargs)
+    return current_app.response_class(dumps(data), mimetype='application/json')
+
+# Read-only listings select these column tuples instead of full ORM entities
+
+BOOK_COLUMNS = (Book.id, Book.title, Book.author, Book.isbn, Book.publisher, Book.stock)
+
+def book_to_dict(row):
+    return {
+        'id': row.id,
+        'title': row.title,
+        'author': row.author,
+        'isbn': row.isbn,
+        'publisher': row.publisher,
+        'stock': row.stock
+    }
+
+BOOK_DUPLICATE_COLUMNS = (BookDuplicate.id, BookDuplicate.book_id, BookDuplicate.duplicate_of_id,
+                          BookDuplicate.similarity, BookDuplicate.source, BookDuplicate.status, BookDuplicate.created_at)
+
+def book_duplicate_to_dict(row, books):
+    """A duplicate pair with both books, looked up in {id: book row}"""
+    return {
+        'id': row.id,
+        'book': book_to_dict(books[row.book_id]) if row.book_id in books else None,
+        'duplicate_of': book_to_dict(books[row.duplicate_of_id]) if row.duplicate_of_id in books else None,
+        'similarity': row.similarity,
+        'source': row.source,
+        'status': row.status,
+        'created_at': row.created_at.isoformat()
+    }
+
+MEMBER_COLUMNS = (Member.id, Member.name, Member.email, Member.outstanding_debt)
+
+def member_to_dict(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'email': row.email,
+        'outstanding_debt': row.outstanding_debt
+    }
+
+ACTIVE_LOAN_COLUMNS = (
+    Transaction.id,
+    Transaction.issue_date,
+    Book.id.label('book_id'),
+    Book.title.label('book_title'),
+    Member.id.label('member_id'),
+    Member.name.label('member_name')
+)
+
+def active_loan_to_dict(row):
+    return {
+        'id': row.id,
+        'book': {
+            'id': row.book_id,
+            'title': row.book_title
+        },
+        'member': {
+            'id': row.member_id,
+            'name': row.member_name
+        },
+        'issue_date': row.issue_date.isoformat(),
+    }
+
+def loan_history_to_dict(row):
+    return {
+        'id': row.id,
+        'book_id': row.book_id,
+        'member_id': row.member_id,
+        'issue_date': row.issue_date.isoformat(),
+        'return_date': row.return_date.isoformat() if row.return_date else None,
+        'rent_fee': row.rent_fee,
+        'archived': bool(row.archived)
+    }
+
+LEDGER_COLUMNS = (
+    LedgerEntry.id, LedgerEntry.transaction_id, LedgerEntry.kind,
+    LedgerEntry.amount_paise, LedgerEntry.note, LedgerEntry.created_at
+)
+
+def ledger_entry_to_dict(row):
+    return {
+        'id': row.id,
+        'transaction_id': row.transaction_id,
+        'kind': row.kind,
+        'amount': row.amount_paise / 100,
+        'note': row.note,
+        'created_at': row.created_at.isoformat()
+    }
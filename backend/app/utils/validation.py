@@ -1,3 +1,6 @@
+from sqlalchemy import or_
+from ..models import Transaction, TransactionArchive, db
+
 def validate_member_debt(member):
     """Validate that member's debt doesn't exceed Rs. 500"""
     return member.outstanding_debt < 500
@@ -8,4 +11,17 @@ def validate_book_stock(book):
 
 def validate_isbn(isbn):
     """Basic ISBN validation"""
-    return len(isbn) == 13 and isbn.isdigit() 
\ No newline at end of file
+    return len(isbn) == 13 and isbn.isdigit()
+
+def active_loans_exist(member_id):
+    """EXISTS query for a member's unreturned loans, answered from ix_transaction_member_id_return_date_issue_date"""
+    return db.session.query(
+        Transaction.query.filter(Transaction.member_id == member_id, Transaction.return_date.is_(None)).exists()
+    )
+
+def loan_history_exists(member_id):
+    """EXISTS query for any loan of a member, hot or archived, answered from the member_id indexes"""
+    return db.session.query(or_(
+        Transaction.query.filter(Transaction.member_id == member_id).exists(),
+        TransactionArchive.query.filter(TransactionArchive.member_id == member_id).exists()
+    ))
@@ -1,47 +1,64 @@
-from flask import Blueprint, jsonify, request, make_response
-import requests
-from ..models import Book, db
+from flask import Blueprint, request, make_response
+from concurrent.futures import TimeoutError as FutureTimeout
+from ..models import Job, db
+from ..utils.admission import HEAVY, limit_class
+from ..utils.jobs import enqueue, job_to_dict
+from ..utils.frappe_proxy import FrappeProxyError, frappe_proxy
+from ..utils.serialization import jsonify
 
 bp = Blueprint('api_integration', __name__, url_prefix='/api/frappe')
 
-FRAPPE_API_URL = 'https://frappe.io/api/method/frappe-library'
-
 @bp.route('/import', methods=['OPTIONS'])
+@bp.route('/search', methods=['OPTIONS'])
 def handle_options():
     response = make_response()
     response.headers.add('Access-Control-Allow-Origin', request.origin)  # Dynamic origin
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
     return response
 
 @bp.route('/import', methods=['POST'])
+@limit_class(HEAVY)
 def import_books():
-    params = request.json
-    
+    """Queue a Frappe import; poll /api/frappe/import/<job_id> for its progress"""
+    try:
+        params = request.get_json(silent=True) or {}
+        if not isinstance(params, dict):
+            raise ValueError('Send the import parameters as a JSON object')
+        params = dict(params)
+        # Checked here so bad input is a 400, not a failed job
+        params['pages'] = max(1, int(params.get('pages', 1)))
+        if 'page' in params:
+            params['page'] = max(1, int(params['page']))
+        if params.get('near_duplicates') not in (None, 'flag', 'merge', 'off'):
+            raise ValueError("near_duplicates must be 'flag', 'merge' or 'off'")
+        job = enqueue('frappe_import', params)
+        return jsonify({'job_id': job.id, 'status': job.status}), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/import/<job_id>', methods=['GET'])
+def import_status(job_id):
+    job = Job.query.filter_by(id=job_id, type='frappe_import').first()
+    if job is None:
+        return jsonify({'error': 'Import job not found'}), 404
+    return jsonify(job_to_dict(job))
+
+@bp.route('/search', methods=['GET'])
+def search_frappe():
+    """Search the Frappe catalog through the cached, rate-limited proxy"""
     try:
-        response = requests.get(FRAPPE_API_URL, params=params)
-        response.raise_for_status()
-        books_data = response.json().get('message', [])
-        
-        imported_count = 0
-        for book_data in books_data:
-            # Check if book already exists
-            existing_book = Book.query.filter_by(isbn=book_data['isbn']).first()
-            if not existing_book:
-                book = Book(
-                    title=book_data['title'],
-                    author=book_data['authors'],
-                    isbn=book_data['isbn'],
-                    publisher=book_data['publisher'],
-                    stock=1  # Default stock value
-                )
-                db.session.add(book)
-                imported_count += 1
-        
-        db.session.commit()
-        return jsonify({
-            'message': f'Successfully imported {imported_count} books'
-        }), 201
-        
-    except requests.RequestException as e:
-        return jsonify({'error': str(e)}), 500 
\ No newline at end of file
+        books, source = frappe_proxy.search(request.args)
+    except FrappeProxyError as e:
+        response = jsonify({'error': str(e)})
+        if e.retry_after is not None:
+            response.headers['Retry-After'] = str(max(1, round(e.retry_after)))
+        return response, e.status
+    except FutureTimeout:
+        return jsonify({'error': 'Frappe API did not answer in time'}), 504
+
+    response = jsonify({'message': books})
+    response.headers['X-Cache'] = source.upper()
+    return response
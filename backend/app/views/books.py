@@ -1,72 +1,166 @@
-from flask import Blueprint, jsonify, request, make_response
-from ..models import Book, db
+from flask import Blueprint, request, make_response
+from marshmallow import ValidationError
+from sqlalchemy import or_
+from ..models import Book, BookDuplicate, db
+from ..schemas import book_schema, book_update_schema, error_message
+from ..utils.admission import HEAVY, limit_class
+from ..utils.pagination import get_page_args, is_paginated, keyset_page, iter_keyset, page_response, stream_json, MAX_PAGE_SIZE
+from ..utils.bulk import export_response, import_request
+from ..utils.cache import cached, invalidate
+from ..utils.dedup import index_duplicate, unindex_duplicate
+from ..utils.events import publish
+from ..utils.search_index import get_search_index, index_book, unindex_book
+from ..utils.serialization import jsonify, BOOK_COLUMNS, BOOK_DUPLICATE_COLUMNS, book_to_dict, book_duplicate_to_dict
 
 bp = Blueprint('books', __name__, url_prefix='/api/books')
 
 # Handle OPTIONS requests for all routes
 @bp.route('', methods=['OPTIONS'])
 @bp.route('/<int:book_id>', methods=['OPTIONS'])
-def handle_options(book_id=None):
+@bp.route('/import', methods=['OPTIONS'])
+@bp.route('/duplicates', methods=['OPTIONS'])
+@bp.route('/duplicates/<int:pair_id>/dismiss', methods=['OPTIONS'])
+def handle_options(book_id=None, pair_id=None):
     response = make_response()
     response.headers.add('Access-Control-Allow-Origin', request.origin)
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
     return response
 
 @bp.route('', methods=['GET', 'POST'])
+@cached('books')
 def books():
     if request.method == 'GET':
-        books = Book.query.all()
-        return jsonify([{
-            'id': book.id,
-            'title': book.title,
-            'author': book.author,
-            'isbn': book.isbn,
-            'publisher': book.publisher,
-            'stock': book.stock
-        } for book in books])
+        query = db.session.query(*BOOK_COLUMNS)
+        if is_paginated():
+            try:
+                limit, after = get_page_args()
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            rows = keyset_page(query, Book.id, after, limit)
+            return jsonify(page_response([book_to_dict(row) for row in rows], limit))
+
+        # Stream the whole catalog in keyset batches instead of loading it at once
+        fmt = request.args.get('stream', 'json')
+        return stream_json((book_to_dict(row) for row in iter_keyset(query, Book.id)), fmt)
     
     if request.method == 'POST':
         try:
-            data = request.get_json()
-            book = Book(
-                title=data['title'],
-                author=data['author'],
-                isbn=data['isbn'],
-                publisher=data.get('publisher'),
-                stock=data.get('stock', 0)
-            )
+            book = Book(**book_schema.load(request.get_json() or {}))
             db.session.add(book)
+            db.session.flush()
+            publish('book.created', book_to_dict(book))
             db.session.commit()
+            index_book(book)
+            invalidate('books')
             return jsonify({'message': 'Book created successfully'}), 201
+        except ValidationError as err:
+            return jsonify({'error': error_message(err)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 400
 
+@bp.route('/search', methods=['GET'])
+@cached('books')
+def search_books():
+    """Ranked prefix search over title, author and publisher"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 20, type=int), MAX_PAGE_SIZE))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    total, hits, truncated = get_search_index().search(query, limit, offset)
+    rows = {}
+    if hits:
+        rows = {row.id: row for row in db.session.query(*BOOK_COLUMNS)
+                .filter(Book.id.in_([book_id for book_id, _ in hits]))}
+
+    items = []
+    for book_id, score in hits:
+        if book_id in rows:
+            item = book_to_dict(rows[book_id])
+            item['score'] = score
+            items.append(item)
+    return jsonify({'items': items, 'total': total, 'limit': limit, 'offset': offset, 'truncated': truncated})
+
 @bp.route('/<int:book_id>', methods=['PUT', 'DELETE'])
 def book_operations(book_id):
     book = Book.query.get_or_404(book_id)
     
     if request.method == 'PUT':
         try:
-            data = request.get_json()
-            book.title = data.get('title', book.title)
-            book.author = data.get('author', book.author)
-            book.isbn = data.get('isbn', book.isbn)
-            book.publisher = data.get('publisher', book.publisher)
-            book.stock = data.get('stock', book.stock)
+            for field, value in book_update_schema.load(request.get_json() or {}).items():
+                setattr(book, field, value)
             
+            publish('book.updated', book_to_dict(book))
             db.session.commit()
+            index_book(book)
+            index_duplicate(book)
+            invalidate('books', 'transactions')
             return jsonify({'message': 'Book updated successfully'})
+        except ValidationError as err:
+            return jsonify({'error': error_message(err)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 400
             
     if request.method == 'DELETE':
         try:
+            BookDuplicate.query.filter(or_(BookDuplicate.book_id == book_id, BookDuplicate.duplicate_of_id == book_id)) \
+                .delete(synchronize_session=False)
             db.session.delete(book)
+            publish('book.deleted', {'id': book_id})
             db.session.commit()
+            unindex_book(book_id)
+            unindex_duplicate(book_id)
+            invalidate('books', 'transactions')
             return jsonify({'message': 'Book deleted successfully'})
         except Exception as e:
             db.session.rollback()
-            return jsonify({'error': str(e)}), 400
\ No newline at end of file
+            return jsonify({'error': str(e)}), 400
+
+@bp.route('/duplicates', methods=['GET'])
+def list_duplicates():
+    """Keyset page of near-duplicate pairs found on import or by the catalog scan; ?status=open|dismissed"""
+    try:
+        limit, after = get_page_args()
+        query = db.session.query(*BOOK_DUPLICATE_COLUMNS) \
+            .filter(BookDuplicate.status == request.args.get('status', 'open'))
+        rows = keyset_page(query, BookDuplicate.id, after, limit)
+        book_ids = {row.book_id for row in rows} | {row.duplicate_of_id for row in rows}
+        books = {row.id: row for row in db.session.query(*BOOK_COLUMNS).filter(Book.id.in_(book_ids))}
+        return jsonify(page_response([book_duplicate_to_dict(row, books) for row in rows], limit))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/duplicates/<int:pair_id>/dismiss', methods=['POST'])
+def dismiss_duplicate(pair_id):
+    """Mark a pair as not duplicates; later scans leave it dismissed"""
+    pair = BookDuplicate.query.get_or_404(pair_id)
+    try:
+        pair.status = 'dismissed'
+        db.session.commit()
+        return jsonify({'message': 'Duplicate dismissed'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/import', methods=['POST'])
+@limit_class(HEAVY)
+def import_books():
+    """Bulk-load books from a CSV or NDJSON request body"""
+    try:
+        result = import_request('books')
+        return jsonify(result), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/export', methods=['GET'])
+@limit_class(HEAVY)
+def export_books():
+    """Download every book as CSV or NDJSON, optionally gzipped"""
+    try:
+        return export_response('books')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,41 @@
+from flask import Blueprint, Response, request, make_response, stream_with_context
+from ..utils.admission import limit_class
+from ..utils.events import change_feed
+from ..utils.serialization import jsonify
+
+bp = Blueprint('events', __name__, url_prefix='/api/events')
+
+@bp.route('', methods=['OPTIONS'])
+def handle_options():
+    response = make_response()
+    response.headers.add('Access-Control-Allow-Origin', request.origin)  # Dynamic origin
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Last-Event-ID')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+    return response
+
+@bp.route('', methods=['GET'])
+# Long-lived and capped per process already; a 429 would stop EventSource for good
+@limit_class(None)
+def stream_events():
+    """Server-Sent Events for book, stock and loan changes.
+
+    Resume with the Last-Event-ID header (sent by EventSource when a stream
+    ends) or ?last_event_id=. A 'reset' event means the missed events are
+    gone and the client should reload its lists. EventSource does not retry
+    an error response such as the 503 below; clients reopen it themselves.
+    """
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = request.args.get('last_event_id', type=int)
+    if not change_feed.acquire():
+        response = jsonify({'error': 'Too many open event streams, try again shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    response = Response(stream_with_context(change_feed.stream(cursor)), mimetype='text/event-stream')
+    response.call_on_close(change_feed.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,48 @@
+from flask import Blueprint, request, make_response
+from ..models import Job, db
+from ..utils.admission import HEAVY, limit_class
+from ..utils.jobs import JOB_TYPES, enqueue, job_to_dict
+from ..utils.serialization import jsonify
+
+bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+MAX_JOBS_LISTED = 200
+
+@bp.route('', methods=['OPTIONS'])
+@bp.route('/<job_id>', methods=['OPTIONS'])
+def handle_options(job_id=None):
+    response = make_response()
+    response.headers.add('Access-Control-Allow-Origin', request.origin)  # Dynamic origin
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+    return response
+
+@bp.route('', methods=['GET', 'POST'])
+@limit_class(HEAVY, methods=('POST',))
+def jobs():
+    if request.method == 'GET':
+        query = Job.query
+        if request.args.get('status'):
+            query = query.filter(Job.status == request.args['status'])
+        if request.args.get('type'):
+            query = query.filter(Job.type == request.args['type'])
+        limit = max(1, min(request.args.get('limit', 50, type=int), MAX_JOBS_LISTED))
+        return jsonify([job_to_dict(job) for job in query.order_by(Job.created_at.desc()).limit(limit)])
+
+    data = request.json or {}
+    if data.get('type') not in JOB_TYPES:
+        return jsonify({'error': f"type must be one of {', '.join(sorted(JOB_TYPES))}"}), 400
+    try:
+        job = enqueue(data['type'], data.get('params') or {})
+        return jsonify(job_to_dict(job)), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = Job.query.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_to_dict(job))
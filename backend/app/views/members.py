@@ -1,40 +1,53 @@
-from flask import Blueprint, jsonify, request, make_response
-from ..models import Member, db
+from flask import Blueprint, request, make_response, current_app
+from marshmallow import ValidationError
+from datetime import datetime, timedelta
+from ..models import LedgerEntry, Member, MemberFeeProjection, db
+from ..schemas import member_schema, member_update_schema, error_message
+from ..utils.admission import HEAVY, limit_class
+from ..utils.fees import accrued_fees_query, projected_debt
+from ..utils.ledger import PAYMENT, WAIVER, record_credit, to_paise, to_rupees
+from ..utils.pagination import MAX_PAGE_SIZE, get_page_args, keyset_page, page_response
+from ..utils.bulk import export_response, import_request
+from ..utils.cache import cached, invalidate
+from ..utils.validation import active_loans_exist, loan_history_exists
+from ..utils.serialization import (
+    jsonify, LEDGER_COLUMNS, MEMBER_COLUMNS, ledger_entry_to_dict, member_to_dict
+)
 
 bp = Blueprint('members', __name__, url_prefix='/api/members')
 
 # Handle OPTIONS requests for all routes
 @bp.route('', methods=['OPTIONS'])
 @bp.route('/<int:member_id>', methods=['OPTIONS'])
+@bp.route('/<int:member_id>/payments', methods=['OPTIONS'])
+@bp.route('/import', methods=['OPTIONS'])
 def handle_options(member_id=None):
     response = make_response()
     response.headers.add('Access-Control-Allow-Origin', request.origin)  # Dynamic origin
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
     return response
 
 @bp.route('', methods=['GET', 'POST'])
+@cached('members')
 def members():
     if request.method == 'GET':
-        members = Member.query.all()
-        return jsonify([{
-            'id': member.id,
-            'name': member.name,
-            'email': member.email,
-            'outstanding_debt': member.outstanding_debt
-        } for member in members])
+        rows = db.session.query(*MEMBER_COLUMNS).order_by(Member.id)
+        return jsonify([member_to_dict(row) for row in rows])
     
     if request.method == 'POST':
         try:
-            data = request.get_json()
             member = Member(
-                name=data['name'],
-                email=data['email'],
+                **member_schema.load(request.get_json() or {}),
                 outstanding_debt=0.0  # Initialize with zero debt
             )
             db.session.add(member)
             db.session.commit()
+            invalidate('members')
             return jsonify({'message': 'Member created successfully'}), 201
+        except ValidationError as err:
+            return jsonify({'error': error_message(err)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 400
@@ -45,12 +58,14 @@ def member_operations(member_id):
     
     if request.method == 'PUT':
         try:
-            data = request.get_json()
-            member.name = data.get('name', member.name)
-            member.email = data.get('email', member.email)
+            for field, value in member_update_schema.load(request.get_json() or {}).items():
+                setattr(member, field, value)
             
             db.session.commit()
+            invalidate('members', 'transactions')
             return jsonify({'message': 'Member updated successfully'})
+        except ValidationError as err:
+            return jsonify({'error': error_message(err)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 400
@@ -64,14 +79,115 @@ def member_operations(member_id):
                 }), 400
                 
             # Check if member has active transactions
-            if any(not t.return_date for t in member.transactions):
+            if active_loans_exist(member_id).scalar():
                 return jsonify({
                     'error': 'Cannot delete member with active book loans'
                 }), 400
+
+            # Loan history feeds reports, recommendations and the archive; it is never purged
+            if loan_history_exists(member_id).scalar():
+                return jsonify({
+                    'error': 'Cannot delete member with loan history'
+                }), 400
                 
-            db.session.delete(member)
+            MemberFeeProjection.query.filter_by(member_id=member_id).delete()
+            Member.query.filter_by(id=member_id).delete()
             db.session.commit()
+            invalidate('members')
             return jsonify({'message': 'Member deleted successfully'})
         except Exception as e:
             db.session.rollback()
-            return jsonify({'error': str(e)}), 400
\ No newline at end of file
+            return jsonify({'error': str(e)}), 400
+
+@bp.route('/overdue', methods=['GET'])
+def overdue_members():
+    """Members with overdue loans and the fees those loans have accrued so far"""
+    try:
+        now = datetime.utcnow()
+        due_before = now - timedelta(days=current_app.config['LOAN_PERIOD_DAYS'])
+        limit = max(1, min(request.args.get('limit', 100, type=int), MAX_PAGE_SIZE))
+        overdue = accrued_fees_query(now, overdue_before=due_before).subquery()
+        rows = db.session.query(
+            Member.id, Member.name, Member.email, Member.outstanding_debt,
+            overdue.c.open_loans, overdue.c.accrued_fee
+        ).join(overdue, overdue.c.member_id == Member.id) \
+            .order_by(overdue.c.accrued_fee.desc(), Member.id).limit(limit)
+        return jsonify([{
+            'id': row.id,
+            'name': row.name,
+            'email': row.email,
+            'outstanding_debt': row.outstanding_debt,
+            'overdue_loans': row.open_loans,
+            'accrued_fee': row.accrued_fee,
+            'projected_debt': row.outstanding_debt + row.accrued_fee
+        } for row in rows])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/<int:member_id>/fees', methods=['GET'])
+def member_fees(member_id):
+    """Projected debt of one member from the materialized fee projection"""
+    fees = projected_debt(member_id)
+    if fees is None:
+        return jsonify({'error': 'Member not found'}), 404
+    return jsonify(fees)
+
+
+@bp.route('/<int:member_id>/payments', methods=['POST'])
+def record_payment(member_id):
+    """Record a payment or waiver against the member's debt"""
+    try:
+        Member.query.get_or_404(member_id)
+        data = request.get_json()
+        kind = data.get('kind', PAYMENT)
+        if kind not in (PAYMENT, WAIVER):
+            return jsonify({'error': f'kind must be {PAYMENT} or {WAIVER}'}), 400
+        paise = to_paise(data['amount'])
+        if paise <= 0:
+            return jsonify({'error': 'Amount must be positive'}), 400
+
+        if not record_credit(member_id, paise, kind, data.get('note')):
+            db.session.rollback()
+            return jsonify({'error': 'Amount exceeds outstanding debt'}), 400
+        db.session.commit()
+        invalidate('members')
+
+        balance = db.session.query(Member.debt_paise).filter_by(id=member_id).scalar()
+        return jsonify({
+            'message': 'Payment recorded successfully',
+            'outstanding_debt': to_rupees(balance)
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/<int:member_id>/ledger', methods=['GET'])
+def member_ledger(member_id):
+    """Keyset-paginated ledger history of one member, oldest first"""
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = db.session.query(*LEDGER_COLUMNS).filter(LedgerEntry.member_id == member_id)
+    rows = keyset_page(query, LedgerEntry.id, after, limit)
+    return jsonify(page_response([ledger_entry_to_dict(row) for row in rows], limit))
+
+@bp.route('/import', methods=['POST'])
+@limit_class(HEAVY)
+def import_members():
+    """Bulk-load members from a CSV or NDJSON request body"""
+    try:
+        result = import_request('members')
+        return jsonify(result), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/export', methods=['GET'])
+@limit_class(HEAVY)
+def export_members():
+    """Download every member as CSV or NDJSON, optionally gzipped"""
+    try:
+        return export_response('members')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,64 @@
+from flask import Blueprint, request, make_response
+from sqlalchemy import func, select
+from ..models import Book, Member, db
+from ..utils.archive import both_tables
+from ..utils.recommendations import recommender
+from ..utils.serialization import jsonify, BOOK_COLUMNS, book_to_dict
+
+bp = Blueprint('recommendations', __name__, url_prefix='/api/recommendations')
+
+MAX_SUGGESTIONS = 50
+# Most recent distinct books of a member that seed their suggestions
+MEMBER_HISTORY = 50
+
+@bp.route('', methods=['OPTIONS'])
+@bp.route('/books/<int:book_id>', methods=['OPTIONS'])
+@bp.route('/members/<int:member_id>', methods=['OPTIONS'])
+def handle_options(book_id=None, member_id=None):
+    response = make_response()
+    response.headers.add('Access-Control-Allow-Origin', request.origin)  # Dynamic origin
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+    return response
+
+def _limit():
+    return max(1, min(request.args.get('limit', 10, type=int), MAX_SUGGESTIONS))
+
+def _books(suggestions):
+    """Attach book details to (book_id, score, together) tuples, dropping books deleted since the build"""
+    rows = {row.id: row for row in db.session.query(*BOOK_COLUMNS)
+            .filter(Book.id.in_([book_id for book_id, _, _ in suggestions]))} if suggestions else {}
+    items = []
+    for book_id, score, together in suggestions:
+        if book_id in rows:
+            item = book_to_dict(rows[book_id])
+            item.update({'score': score, 'borrowed_together': together})
+            items.append(item)
+    return items
+
+@bp.route('', methods=['GET'])
+def status():
+    """When the matrix was built and up to which transaction"""
+    return jsonify(recommender.status() or {'error': 'Recommendations have not been built yet'})
+
+@bp.route('/books/<int:book_id>', methods=['GET'])
+def also_borrowed(book_id):
+    """Members who borrowed this book also borrowed..."""
+    Book.query.get_or_404(book_id)
+    # Ask for a few extra in case some were deleted since the build
+    suggestions = recommender.similar(book_id, _limit() + 5)
+    return jsonify({'book_id': book_id, 'items': _books(suggestions)[:_limit()]})
+
+@bp.route('/members/<int:member_id>', methods=['GET'])
+def for_member(member_id):
+    """Books similar to what the member borrowed recently, excluding those"""
+    Member.query.get_or_404(member_id)
+    loans = both_tables(lambda model, _: select(model.book_id, func.max(model.id).label('last_id'))
+                        .where(model.member_id == member_id).group_by(model.book_id))
+    history = [book_id for (book_id,) in db.session.query(loans.c.book_id)
+               .group_by(loans.c.book_id)
+               .order_by(func.max(loans.c.last_id).desc())
+               .limit(MEMBER_HISTORY)]
+    suggestions = recommender.for_books(history, _limit() + 5)
+    return jsonify({'member_id': member_id, 'items': _books(suggestions)[:_limit()]})
@@ -0,0 +1,69 @@
+from datetime import date, datetime, timedelta
+from flask import Blueprint, request, make_response
+from ..utils.analytics import daily_totals, member_activity, top_books
+from ..utils.cache import cached
+from ..utils.serialization import jsonify
+
+bp = Blueprint('reports', __name__, url_prefix='/api/reports')
+
+DEFAULT_DAYS = 30
+MAX_TOP = 100
+
+@bp.route('/daily', methods=['OPTIONS'])
+@bp.route('/books', methods=['OPTIONS'])
+@bp.route('/members', methods=['OPTIONS'])
+def handle_options():
+    response = make_response()
+    response.headers.add('Access-Control-Allow-Origin', request.origin)  # Dynamic origin
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+    return response
+
+def _date_range():
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD, both inclusive; the last 30 days by default"""
+    end = date.fromisoformat(request.args['to']) if request.args.get('to') else datetime.utcnow().date()
+    start = date.fromisoformat(request.args['from']) if request.args.get('from') \
+        else end - timedelta(days=DEFAULT_DAYS - 1)
+    if start > end:
+        raise ValueError('from must not be after to')
+    return start, end
+
+def _default_day():
+    """Cache key part: the default range ends today, so its responses must not outlive the day"""
+    return '' if request.args.get('to') else datetime.utcnow().date().isoformat()
+
+def _limit():
+    return max(1, min(request.args.get('limit', 10, type=int), MAX_TOP))
+
+# Answered from the daily rollup tables, never from the transaction table
+
+@bp.route('/daily', methods=['GET'])
+@cached('transactions', vary=_default_day)
+def daily():
+    """Loans, returns and fee revenue per day"""
+    try:
+        start, end = _date_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'days': daily_totals(start, end)})
+
+@bp.route('/books', methods=['GET'])
+@cached('transactions', vary=_default_day)
+def books():
+    """Most borrowed titles in the range"""
+    try:
+        start, end = _date_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'books': top_books(start, end, _limit())})
+
+@bp.route('/members', methods=['GET'])
+@cached('transactions', vary=_default_day)
+def members():
+    """Active member count and the busiest members in the range"""
+    try:
+        start, end = _date_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(member_activity(start, end, _limit()), **{'from': start.isoformat(), 'to': end.isoformat()}))
@@ -1,6 +1,22 @@
-from flask import Blueprint, jsonify, request, make_response
-from datetime import datetime
+from flask import Blueprint, request, make_response, current_app
+from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from marshmallow import ValidationError
+from sqlalchemy import bindparam
 from ..models import Transaction, Book, Member, db
+from ..schemas import issue_schema, issue_batch_schema, error_message
+from ..utils.admission import HEAVY, limit_class
+from ..utils.validation import validate_member_debt, validate_book_stock
+from ..utils.analytics import rollup_issues, rollup_returns
+from ..utils.archive import history_page
+from ..utils.bulk import export_response
+from ..utils.cache import cached, invalidate
+from ..utils.events import publish, publish_many
+from ..utils.fees import FeePolicy, record_issues, record_returns
+from ..utils.ledger import charge_fees
+from ..utils.pagination import get_page_args, is_paginated, keyset_page, page_response
+from ..utils.serialization import jsonify, ACTIVE_LOAN_COLUMNS, active_loan_to_dict, loan_history_to_dict
 
 bp = Blueprint('transactions', __name__, url_prefix='/api/transactions')
 
@@ -9,7 +25,8 @@ bp = Blueprint('transactions', __name__, url_prefix='/api/transactions')
 def handle_return_options(transaction_id):
     response = make_response()
     response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
     response.headers.add('Access-Control-Allow-Methods', 'PUT, OPTIONS')
     return response
 
@@ -17,55 +34,91 @@ def handle_return_options(transaction_id):
 def handle_issue_options():
     response = make_response()
     response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
     response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
     return response
 
+def _overdue_only():
+    return request.args.get('overdue', '').lower() in ('1', 'true', 'yes')
+
 @bp.route('/active', methods=['GET'])
+@cached('transactions', 'books', 'members', unless=_overdue_only)
 def get_active_transactions():
-    """Get all transactions where return_date is NULL"""
+    """Get all transactions where return_date is NULL, in one joined query"""
+    try:
+        query = db.session.query(*ACTIVE_LOAN_COLUMNS) \
+            .join(Book, Transaction.book_id == Book.id) \
+            .join(Member, Transaction.member_id == Member.id) \
+            .filter(Transaction.return_date.is_(None))
+
+        member_id = request.args.get('member_id', type=int)
+        if member_id is not None:
+            query = query.filter(Transaction.member_id == member_id)
+        book_id = request.args.get('book_id', type=int)
+        if book_id is not None:
+            query = query.filter(Transaction.book_id == book_id)
+        if _overdue_only():
+            # Depends on the clock, not just the data, so never cached
+            due_before = datetime.utcnow() - timedelta(days=current_app.config['LOAN_PERIOD_DAYS'])
+            query = query.filter(Transaction.issue_date < due_before)
+
+        if is_paginated():
+            limit, after = get_page_args()
+            rows = keyset_page(query, Transaction.id, after, limit)
+            return jsonify(page_response([active_loan_to_dict(row) for row in rows], limit))
+
+        return jsonify([active_loan_to_dict(row) for row in query.order_by(Transaction.id)])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/history', methods=['GET'])
+@cached('transactions')
+def get_history():
+    """Keyset pages of every loan, including archived ones; ?member_id= or ?book_id= to narrow"""
     try:
-        active_transactions = Transaction.query.filter_by(return_date=None).all()
-        return jsonify([{
-            'id': t.id,
-            'book': {
-                'id': t.book.id,
-                'title': t.book.title
-            },
-            'member': {
-                'id': t.member.id,
-                'name': t.member.name
-            },
-            'issue_date': t.issue_date.isoformat(),
-        } for t in active_transactions])
+        limit, after = get_page_args()
+        rows = history_page(after, limit, member_id=request.args.get('member_id', type=int),
+                            book_id=request.args.get('book_id', type=int))
+        return jsonify(page_response([loan_history_to_dict(row) for row in rows], limit))
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 @bp.route('/issue', methods=['POST'])
 def issue_book():
     try:
-        data = request.get_json()
-        book = Book.query.get_or_404(data['book_id'])
+        data = issue_schema.load(request.get_json() or {})
         member = Member.query.get_or_404(data['member_id'])
         
-        if book.stock <= 0:
-            return jsonify({'error': 'Book not available'}), 400
-            
-        if member.outstanding_debt >= 500:
+        if not validate_member_debt(member):
             return jsonify({'error': 'Member has outstanding debt over Rs. 500'}), 400
 
+        # Take one copy off the shelf only if one is left, in a single statement,
+        # so concurrent checkouts of the last copy cannot both succeed
+        taken = Book.query.filter(Book.id == data['book_id'], Book.stock > 0) \
+            .update({Book.stock: Book.stock - 1}, synchronize_session=False)
+        if not taken:
+            Book.query.get_or_404(data['book_id'])
+            return jsonify({'error': 'Book not available'}), 400
+
         transaction = Transaction(
-            book_id=book.id,
+            book_id=data['book_id'],
             member_id=member.id,
             issue_date=datetime.utcnow()
         )
         
-        book.stock -= 1
         db.session.add(transaction)
+        record_issues({member.id: 1})
+        rollup_issues([(transaction.book_id, member.id, transaction.issue_date)])
+        db.session.flush()
+        _publish_issued([transaction.id])
         db.session.commit()
+        invalidate('books', 'transactions')
         
         return jsonify({'message': 'Book issued successfully'}), 201
         
+    except ValidationError as err:
+        return jsonify({'error': error_message(err)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
@@ -78,31 +131,244 @@ def return_book(transaction_id):
         if transaction.return_date:
             return jsonify({'error': 'Book already returned'}), 400
             
-        transaction.return_date = datetime.utcnow()
-        transaction.book.stock += 1
-        
-        # Calculate rent (Rs. 10 per day)
-        days = (transaction.return_date - transaction.issue_date).days
-        transaction.rent_fee = max(days * 10, 0)
-        transaction.member.outstanding_debt += transaction.rent_fee
+        return_date = datetime.utcnow()
+        rent_fee = FeePolicy.from_config().fee(transaction.issue_date, return_date)
+
+        # Close the loan only if nobody else has, then apply stock and debt
+        # as in-database increments instead of read-modify-write in Python
+        closed = Transaction.query.filter(Transaction.id == transaction_id, Transaction.return_date.is_(None)) \
+            .update({Transaction.return_date: return_date, Transaction.rent_fee: rent_fee},
+                    synchronize_session=False)
+        if not closed:
+            db.session.rollback()
+            return jsonify({'error': 'Book already returned'}), 400
+
+        Book.query.filter(Book.id == transaction.book_id) \
+            .update({Book.stock: Book.stock + 1}, synchronize_session=False)
+        charge_fees([(transaction.member_id, transaction_id, rent_fee)])
+        record_returns([(transaction.member_id, transaction.issue_date)])
+        rollup_returns([(transaction.book_id, transaction.member_id, return_date, rent_fee)])
+        total_debt = db.session.query(Member.outstanding_debt) \
+            .filter(Member.id == transaction.member_id).scalar()
+        _publish_returned([(transaction_id, transaction.book_id, transaction.member_id, rent_fee)])
         
         db.session.commit()
+        invalidate('books', 'members', 'transactions')
         return jsonify({
             'message': 'Book returned successfully',
-            'rent_fee': transaction.rent_fee,
-            'total_debt': transaction.member.outstanding_debt
+            'rent_fee': rent_fee,
+            'total_debt': total_debt
         })
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
+def _publish_stock(book_ids):
+    publish_many('book.stock', [{'id': book_id, 'stock': stock} for book_id, stock in
+                                db.session.query(Book.id, Book.stock).filter(Book.id.in_(set(book_ids)))])
+
+def _publish_issued(transaction_ids):
+    """Change events for new loans, in the shape of /active, plus the stock they took"""
+    loans = db.session.query(*ACTIVE_LOAN_COLUMNS) \
+        .join(Book, Transaction.book_id == Book.id) \
+        .join(Member, Transaction.member_id == Member.id) \
+        .filter(Transaction.id.in_(transaction_ids)).all()
+    publish_many('loan.issued', [active_loan_to_dict(row) for row in loans])
+    _publish_stock(row.book_id for row in loans)
+
+def _publish_returned(returns):
+    """Change events for (transaction id, book id, member id, rent fee) returns"""
+    publish_many('loan.returned', [
+        {'id': transaction_id, 'book_id': book_id, 'member_id': member_id, 'rent_fee': rent_fee}
+        for transaction_id, book_id, member_id, rent_fee in returns
+    ])
+    _publish_stock(book_id for _, book_id, _, _ in returns)
+
+def _too_large(items):
+    return len(items) > current_app.config['MAX_BATCH_SIZE']
+
+@bp.route('/issue/batch', methods=['POST'])
+def issue_books_batch():
+    """Issue a list of (book_id, member_id) pairs with one commit.
+
+    Books and members are loaded with one IN query each, every item is
+    checked against the stock/debt rules, and stock is taken with one
+    conditional UPDATE per distinct title.
+    """
+    try:
+        items = request.get_json()['items']
+        if _too_large(items):
+            return jsonify({'error': f"At most {current_app.config['MAX_BATCH_SIZE']} items per batch"}), 400
+        items = issue_batch_schema.load(items)
+
+        book_ids = {item['book_id'] for item in items}
+        member_ids = {item['member_id'] for item in items}
+        books = {row.id: SimpleNamespace(stock=row.stock) for row in
+                 db.session.query(Book.id, Book.stock).filter(Book.id.in_(book_ids)).with_for_update()}
+        members = {row.id: row for row in
+                   db.session.query(Member.id, Member.outstanding_debt).filter(Member.id.in_(member_ids))}
+
+        issue_date = datetime.utcnow()
+        results = []
+        taken = defaultdict(int)
+        new_transactions = []
+        for item in items:
+            book = books.get(item['book_id'])
+            member = members.get(item['member_id'])
+            result = {'book_id': item['book_id'], 'member_id': item['member_id']}
+            if book is None:
+                result['error'] = 'Book not found'
+            elif member is None:
+                result['error'] = 'Member not found'
+            elif not validate_member_debt(member):
+                result['error'] = 'Member has outstanding debt over Rs. 500'
+            elif not validate_book_stock(book):
+                result['error'] = 'Book not available'
+            else:
+                book.stock -= 1
+                taken[item['book_id']] += 1
+                new_transactions.append(Transaction(
+                    book_id=item['book_id'],
+                    member_id=item['member_id'],
+                    issue_date=issue_date
+                ))
+            result['status'] = 'error' if 'error' in result else 'issued'
+            results.append(result)
+
+        if taken:
+            book_table = Book.__table__
+            updated = db.session.execute(
+                book_table.update()
+                .where(book_table.c.id == bindparam('b_id'))
+                .where(book_table.c.stock >= bindparam('n'))
+                .values(stock=book_table.c.stock - bindparam('n')),
+                [{'b_id': book_id, 'n': n} for book_id, n in taken.items()]
+            ).rowcount
+            if updated != len(taken):
+                # Only reachable on databases without row locks
+                db.session.rollback()
+                return jsonify({'error': 'Stock changed during the batch, please retry'}), 409
+            # A flush rather than a bulk insert, so every new loan comes back with its id
+            db.session.add_all(new_transactions)
+            db.session.flush()
+            record_issues(Counter(loan.member_id for loan in new_transactions))
+            rollup_issues([(loan.book_id, loan.member_id, issue_date) for loan in new_transactions])
+            _publish_issued([loan.id for loan in new_transactions])
+
+        db.session.commit()
+        if new_transactions:
+            invalidate('books', 'transactions')
+        return jsonify({'issued': len(new_transactions), 'results': results}), 201
+        
+    except ValidationError as err:
+        return jsonify({'error': error_message(err)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/return/batch', methods=['PUT'])
+def return_books_batch():
+    """Return a list of transaction ids with one commit"""
+    try:
+        transaction_ids = request.get_json()['transaction_ids']
+        if _too_large(transaction_ids):
+            return jsonify({'error': f"At most {current_app.config['MAX_BATCH_SIZE']} items per batch"}), 400
+
+        loans = {row.id: row for row in db.session.query(
+            Transaction.id, Transaction.book_id, Transaction.member_id,
+            Transaction.issue_date, Transaction.return_date
+        ).filter(Transaction.id.in_(set(transaction_ids))).with_for_update()}
+
+        return_date = datetime.utcnow()
+        policy = FeePolicy.from_config()
+        results = []
+        closed = []
+        returned_loans = []
+        seen = set()
+        restocked = defaultdict(int)
+        fees = []
+        returned = []
+        for transaction_id in transaction_ids:
+            loan = loans.get(transaction_id)
+            result = {'transaction_id': transaction_id}
+            if loan is None:
+                result['error'] = 'Transaction not found'
+            elif loan.return_date or transaction_id in seen:
+                result['error'] = 'Book already returned'
+            else:
+                seen.add(transaction_id)
+                rent_fee = policy.fee(loan.issue_date, return_date)
+                closed.append({'t_id': transaction_id, 'return_date': return_date, 'rent_fee': rent_fee})
+                returned_loans.append((loan.member_id, loan.issue_date))
+                restocked[loan.book_id] += 1
+                fees.append((loan.member_id, transaction_id, rent_fee))
+                returned.append((transaction_id, loan.book_id, loan.member_id, rent_fee))
+                result['rent_fee'] = rent_fee
+                result['member_id'] = loan.member_id
+            result['status'] = 'error' if 'error' in result else 'returned'
+            results.append(result)
+
+        if closed:
+            transaction_table = Transaction.__table__
+            updated = db.session.execute(
+                transaction_table.update()
+                .where(transaction_table.c.id == bindparam('t_id'))
+                .where(transaction_table.c.return_date.is_(None))
+                .values(return_date=bindparam('return_date'), rent_fee=bindparam('rent_fee')),
+                closed
+            ).rowcount
+            if updated != len(closed):
+                db.session.rollback()
+                return jsonify({'error': 'Transactions changed during the batch, please retry'}), 409
+
+            book_table = Book.__table__
+            db.session.execute(
+                book_table.update()
+                .where(book_table.c.id == bindparam('b_id'))
+                .values(stock=book_table.c.stock + bindparam('n')),
+                [{'b_id': book_id, 'n': n} for book_id, n in restocked.items()]
+            )
+            charge_fees(fees)
+            record_returns(returned_loans)
+            rollup_returns([(book_id, member_id, return_date, rent_fee)
+                            for _, book_id, member_id, rent_fee in returned])
+            _publish_returned(returned)
+            debts = dict(db.session.query(Member.id, Member.outstanding_debt)
+                         .filter(Member.id.in_({member_id for member_id, _, _ in fees})))
+            for result in results:
+                if 'member_id' in result:
+                    result['total_debt'] = debts[result['member_id']]
+
+        db.session.commit()
+        if closed:
+            invalidate('books', 'members', 'transactions')
+        return jsonify({'returned': len(closed), 'results': results})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/export', methods=['GET'])
+@limit_class(HEAVY)
+def export_transactions():
+    """Download every transaction, open or returned, as CSV or NDJSON; ?archived=1 for the archive"""
+    try:
+        archived = request.args.get('archived') in ('1', 'true')
+        return export_response('transactions_archive' if archived else 'transactions')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @bp.route('', methods=['OPTIONS'])
+@bp.route('/history', methods=['OPTIONS'])
 @bp.route('/issue', methods=['OPTIONS'])
+@bp.route('/issue/batch', methods=['OPTIONS'])
+@bp.route('/return/batch', methods=['OPTIONS'])
 @bp.route('/return/<int:transaction_id>', methods=['OPTIONS'])
 def handle_options(transaction_id=None):
     response = make_response()
     response.headers.add('Access-Control-Allow-Origin', request.origin)  # Dynamic origin
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Read-Primary')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, OPTIONS')
     return response
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""Populate books, members and loans with skewed synthetic data.
+
+Checkouts follow a Zipf-like law over titles, so a few hot titles get most
+of the loans, and a similar law over members. Rows go in with chunked
+executemany inserts, so 10M loans need no more memory than 10k:
+
+    python -m benchmarks.datagen --books 100000 --members 20000 --loans 1000000
+"""
+import os
+import sys
+import random
+import argparse
+import itertools
+from datetime import datetime, timedelta
+
+WORDS = (
+    'shadow river garden silent empire winter last secret city night house '
+    'light stone child summer iron glass queen forest dream fire island song '
+    'letter road war star book sea mountain storm golden broken hidden lost '
+    'wild heart blood journey kingdom memory north paper silver time'
+).split()
+FIRST_NAMES = 'Aarav Vivaan Aditya Diya Ananya Isha Kabir Meera Rohan Saanvi Arjun Priya Rahul Neha Vikram'.split()
+LAST_NAMES = 'Sharma Verma Iyer Nair Reddy Gupta Mehta Kapoor Das Bose Rao Menon Joshi Singh Khan'.split()
+PUBLISHERS = ['Penguin', 'HarperCollins', 'Rupa', 'Scholastic', 'Macmillan', 'Vintage', 'Bloomsbury', None]
+
+def zipf_cum_weights(n, s):
+    """Cumulative weights of rank**-s for ranks 1..n, for random.choices"""
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def book_rows(rng, count, start_id):
+    for i in range(count):
+        book_id = start_id + i
+        yield {
+            'title': ' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4))),
+            'author': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'isbn': f'978{book_id:010d}',
+            'publisher': rng.choice(PUBLISHERS),
+            'stock': rng.randint(1, 10),
+        }
+
+def member_rows(rng, count, start_id):
+    for i in range(count):
+        member_id = start_id + i
+        yield {
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'email': f'member{member_id}@example.com',
+            'debt_paise': 0,
+        }
+
+def spread(ids, stride=7919):
+    """A fixed permutation of a contiguous id range, so the hot ids are not simply the lowest"""
+    n = len(ids)
+    while n > 1 and n % stride == 0:
+        stride += 2
+    return lambda rank: ids[(rank * stride) % n] if n > 1 else ids[0]
+
+def loan_rows(rng, count, book_ids, member_ids, open_ratio, days, skew, now, daily_rate):
+    book_ranks = range(len(book_ids))
+    member_ranks = range(len(member_ids))
+    book_weights = zipf_cum_weights(len(book_ids), skew)
+    member_weights = zipf_cum_weights(len(member_ids), skew / 2)
+    book_for_rank = spread(book_ids)
+    member_for_rank = spread(member_ids)
+    for _ in range(count):
+        issue_date = now - timedelta(seconds=rng.randint(0, days * 86400))
+        row = {
+            'book_id': book_for_rank(rng.choices(book_ranks, cum_weights=book_weights)[0]),
+            'member_id': member_for_rank(rng.choices(member_ranks, cum_weights=member_weights)[0]),
+            'issue_date': issue_date,
+            'return_date': None,
+            'rent_fee': 0.0,
+        }
+        if rng.random() >= open_ratio:
+            return_date = issue_date + timedelta(seconds=rng.randint(3600, 30 * 86400))
+            if return_date > now:
+                return_date = now
+            row['return_date'] = return_date
+            row['rent_fee'] = float((return_date - issue_date).days * daily_rate)
+        yield row
+
+def generate(books=10000, members=2000, loans=50000, open_ratio=0.1, days=365,
+             skew=1.1, seed=42, chunk_size=5000, echo=print):
+    """Append synthetic rows to the current app's database and return the counts"""
+    from flask import current_app
+    from sqlalchemy import func
+    from app import db
+    from app.models import Book, Member, Transaction
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    first_book = (db.session.query(func.max(Book.id)).scalar() or 0) + 1
+    first_member = (db.session.query(func.max(Member.id)).scalar() or 0) + 1
+
+    for name, table, rows, total in (
+        ('books', Book.__table__, book_rows(rng, books, first_book), books),
+        ('members', Member.__table__, member_rows(rng, members, first_member), members),
+    ):
+        done = 0
+        for chunk in chunked(rows, chunk_size):
+            db.session.execute(table.insert(), chunk)
+            db.session.commit()
+            done += len(chunk)
+            echo(f'\r{name}: {done}/{total}', end='')
+        echo()
+
+    # Bulk inserts into fresh id ranges, so the new ids are contiguous
+    book_ids = range(first_book, db.session.query(func.max(Book.id)).scalar() + 1)
+    member_ids = range(first_member, db.session.query(func.max(Member.id)).scalar() + 1)
+    done = 0
+    rows = loan_rows(rng, loans, book_ids, member_ids, open_ratio, days, skew, now,
+                     current_app.config['FEE_DAILY_RATE'])
+    for chunk in chunked(rows, chunk_size):
+        db.session.execute(Transaction.__table__.insert(), chunk)
+        db.session.commit()
+        done += len(chunk)
+        echo(f'\rloans: {done}/{loans}', end='')
+    echo()
+    return {'books': books, 'members': members, 'loans': loans}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--loans', type=int, default=50000)
+    parser.add_argument('--open-ratio', type=float, default=0.1, help='share of loans not yet returned')
+    parser.add_argument('--days', type=int, default=365, help='spread issue dates over this many days')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of title popularity')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--create', action='store_true', help='create missing tables first')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        parser.error('set DATABASE_URL to the database to fill')
+
+    from app import create_app, db
+    app = create_app()
+    with app.app_context():
+        if args.create:
+            db.create_all()
+        generate(args.books, args.members, args.loans, args.open_ratio, args.days, args.skew, args.seed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Check with EXPLAIN that the hot queries are answered from their indexes.
+
+Seeds a small throwaway SQLite database (or uses DATABASE_URL, e.g. a MySQL
+copy), runs EXPLAIN for each query and exits non-zero if a query does not
+use the index it was designed for:
+
+    python -m benchmarks.explain
+
+tests/test_query_plans.py runs the same checks on SQLite with the test suite.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+def hot_queries():
+    """(name, query, index it must use) for the queries on the request paths"""
+    from app import db
+    from app.models import Book, LedgerEntry, Member, Transaction, TransactionArchive
+    from app.utils.serialization import ACTIVE_LOAN_COLUMNS
+    from app.utils.validation import active_loans_exist
+
+    open_loans = db.session.query(*ACTIVE_LOAN_COLUMNS) \
+        .join(Book, Transaction.book_id == Book.id) \
+        .join(Member, Transaction.member_id == Member.id) \
+        .filter(Transaction.return_date.is_(None))
+    overdue_before = datetime.utcnow() - timedelta(days=14)
+    return [
+        ('member delete: active loan EXISTS', active_loans_exist(1),
+         'ix_transaction_member_id_return_date_issue_date'),
+        ('active loans of a member', open_loans.filter(Transaction.member_id == 1),
+         'ix_transaction_member_id_return_date_issue_date'),
+        ('active loans of a book', open_loans.filter(Transaction.book_id == 1),
+         'ix_transaction_book_id_return_date'),
+        ('overdue loans', db.session.query(Transaction.id).filter(
+            Transaction.return_date.is_(None), Transaction.issue_date < overdue_before),
+         'ix_transaction_return_date_issue_date'),
+        ('loan history of a member', db.session.query(Transaction.id).filter(Transaction.member_id == 1),
+         'ix_transaction_member_id_return_date_issue_date'),
+        ('archived loan history of a member', db.session.query(TransactionArchive.id).filter(
+            TransactionArchive.member_id == 1, TransactionArchive.id > 0).order_by(TransactionArchive.id).limit(100),
+         'ix_transaction_archive_member_id_id'),
+        ('archiver: loans returned before the horizon', db.session.query(Transaction.id).filter(
+            Transaction.return_date < overdue_before).order_by(Transaction.return_date).limit(1000),
+         'ix_transaction_return_date_issue_date'),
+        ('member ledger page', db.session.query(LedgerEntry.id).filter(
+            LedgerEntry.member_id == 1, LedgerEntry.id > 0).order_by(LedgerEntry.id).limit(100),
+         'ix_ledger_entry_member_id_id'),
+    ]
+
+def explain(query):
+    """EXPLAIN output of a query as a list of strings, for SQLite or MySQL"""
+    from app import db
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'sqlite':
+        return [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)]
+    rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).mappings()
+    return [f"{row['table']}: type={row['type']} key={row['key']}" for row in rows]
+
+def main():
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'explain.db')}"
+        seed = True
+    else:
+        seed = False
+
+    from app import create_app, db
+    from .datagen import generate
+
+    app = create_app()
+    with app.app_context():
+        if seed:
+            db.create_all()
+            generate(books=2000, members=400, loans=20000, echo=lambda *a, **k: None)
+            db.session.execute(db.text('ANALYZE'))
+
+        failures = 0
+        for name, query, index in hot_queries():
+            plan = explain(query)
+            ok = any(index in line for line in plan)
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {name} (expects {index})")
+            for line in plan:
+                print(f'       {line}')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
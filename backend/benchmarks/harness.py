@@ -0,0 +1,333 @@
+"""Drive every API endpoint through the Flask test client and record its speed.
+
+Seeds a database with benchmarks.datagen (a throwaway SQLite file unless
+DATABASE_URL is set), then times each scenario and reports throughput,
+p50/p99 latency and peak RSS. Results are saved as JSON so two runs can be
+compared:
+
+    python -m benchmarks.harness --scale 10000 --output before.json
+    python -m benchmarks.harness --scale 10000 --output after.json --compare before.json
+
+--no-orjson serializes with the stdlib json fallback instead, which gives a
+before/after of the encoder on the full 100k-book listing:
+
+    python -m benchmarks.harness --scale 100000 --loans-per-book 0 --only 'books: full' --no-orjson --output stdlib.json
+    python -m benchmarks.harness --scale 100000 --loans-per-book 0 --only 'books: full' --compare stdlib.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import threading
+from datetime import datetime
+
+from .datagen import generate
+
+RETURN_BATCH = 50
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage / 1024 / 1024 if sys.platform == 'darwin' else usage / 1024
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def start_frappe_stub():
+    """Local HTTP server answering like the Frappe library API"""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            page = int(parse_qs(urlparse(self.path).query).get('page', ['1'])[0])
+            books = [{
+                'title': f'Imported Title {page}-{i}',
+                'authors': 'Stub Author',
+                'isbn': f'{random.randrange(10 ** 12, 10 ** 13)}',
+                'publisher': 'Stub Press',
+            } for i in range(20)]
+            body = json.dumps({'message': books}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class Bench:
+    """Shared state the scenarios draw ids from"""
+
+    def __init__(self, app, rng):
+        from app import db
+        from app.models import Book, Member, Transaction
+        self.rng = rng
+        with app.app_context():
+            self.max_book = db.session.query(db.func.max(Book.id)).scalar()
+            self.max_member = db.session.query(db.func.max(Member.id)).scalar()
+        self.resolve_open_loans(app)
+        self.created_books = []
+        self.created_members = []
+        self.sequence = 0
+
+    def resolve_open_loans(self, app):
+        """Look up the loans the return scenarios may close, including any issued since"""
+        from app import db
+        from app.models import Transaction
+        with app.app_context():
+            self.open_loans = [loan_id for (loan_id,) in db.session.query(Transaction.id)
+                               .filter(Transaction.return_date.is_(None)).limit(200000)]
+        self.rng.shuffle(self.open_loans)
+
+    def book(self):
+        return self.rng.randint(1, self.max_book)
+
+    def member(self):
+        return self.rng.randint(1, self.max_member)
+
+    def next(self):
+        self.sequence += 1
+        return self.sequence
+
+def scenarios(bench):
+    """(name, iterations, request factory) tuples; factories return client call kwargs"""
+    rng = bench.rng
+    words = ['river', 'shadow', 'gold', 'night', 'sha', 'ki', 'sto', 'secret garden']
+
+    def create_book():
+        n = bench.next()
+        return {'method': 'POST', 'path': '/api/books', 'json': {
+            'title': f'Bench Book {n}', 'author': 'Bench Author',
+            'isbn': f'555{n:010d}', 'publisher': 'Bench', 'stock': 3}}
+
+    def update_book():
+        return {'method': 'PUT', 'path': f'/api/books/{bench.book()}', 'json': {'publisher': 'Updated Press'}}
+
+    def delete_book():
+        # Delete the books this run created, which have no loans
+        return {'method': 'DELETE', 'path': f'/api/books/{bench.created_books.pop()}'}
+
+    def create_member():
+        n = bench.next()
+        return {'method': 'POST', 'path': '/api/members', 'json': {
+            'name': f'Bench Member {n}', 'email': f'bench{n}@example.com'}}
+
+    def delete_member():
+        return {'method': 'DELETE', 'path': f'/api/members/{bench.created_members.pop()}'}
+
+    def return_one():
+        return {'method': 'PUT', 'path': f'/api/transactions/return/{bench.open_loans.pop()}'}
+
+    def return_batch():
+        ids = [bench.open_loans.pop() for _ in range(RETURN_BATCH)]
+        return {'method': 'PUT', 'path': '/api/transactions/return/batch', 'json': {'transaction_ids': ids}}
+
+    return [
+        ('books: page', 200, lambda: {'method': 'GET', 'path': f'/api/books?limit=100&after={rng.randint(0, bench.max_book)}'}),
+        ('books: full stream json', 3, lambda: {'method': 'GET', 'path': '/api/books'}),
+        ('books: full stream ndjson', 3, lambda: {'method': 'GET', 'path': '/api/books?stream=ndjson'}),
+        ('books: search', 300, lambda: {'method': 'GET', 'path': f'/api/books/search?q={rng.choice(words)}'}),
+        ('books: create', 200, create_book),
+        ('books: update', 200, update_book),
+        ('books: delete', 100, delete_book),
+        ('members: list', 5, lambda: {'method': 'GET', 'path': '/api/members'}),
+        ('members: create', 200, create_member),
+        ('members: update', 200, lambda: {'method': 'PUT', 'path': f'/api/members/{bench.member()}', 'json': {'name': 'Renamed Member'}}),
+        ('members: delete', 100, delete_member),
+        ('members: overdue', 20, lambda: {'method': 'GET', 'path': '/api/members/overdue'}),
+        ('members: fees', 300, lambda: {'method': 'GET', 'path': f'/api/members/{bench.member()}/fees'}),
+        ('members: ledger', 300, lambda: {'method': 'GET', 'path': f'/api/members/{bench.member()}/ledger'}),
+        ('members: payment', 100, lambda: {'method': 'POST', 'path': f'/api/members/{rng.randint(1, min(1000, bench.max_member))}/payments', 'json': {'amount': 1}}),
+        ('transactions: active page', 200, lambda: {'method': 'GET', 'path': '/api/transactions/active?limit=100'}),
+        ('transactions: active by member', 200, lambda: {'method': 'GET', 'path': f'/api/transactions/active?member_id={bench.member()}'}),
+        ('transactions: active overdue', 50, lambda: {'method': 'GET', 'path': '/api/transactions/active?overdue=1&limit=100'}),
+        ('transactions: active full', 3, lambda: {'method': 'GET', 'path': '/api/transactions/active'}),
+        ('transactions: issue', 300, lambda: {'method': 'POST', 'path': '/api/transactions/issue', 'json': {'book_id': bench.book(), 'member_id': bench.member()}}),
+        ('transactions: return', 300, return_one),
+        ('transactions: issue batch (50)', 20, lambda: {'method': 'POST', 'path': '/api/transactions/issue/batch', 'json': {'items': [
+            {'book_id': bench.book(), 'member_id': bench.member()} for _ in range(50)]}}),
+        (f'transactions: return batch ({RETURN_BATCH})', 20, return_batch),
+        ('frappe: search', 300, lambda: {'method': 'GET', 'path': f'/api/frappe/search?title={rng.choice(words)}'}),
+        ('frappe: import', 10, lambda: {'method': 'POST', 'path': '/api/frappe/import', 'json': {'title': 'stub', 'pages': 4}}),
+        ('metrics', 20, lambda: {'method': 'GET', 'path': '/metrics'}),
+    ]
+
+def run_scenario(client, iterations, factory):
+    latencies = []
+    statuses = {}
+    body_bytes = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        kwargs = factory()
+        method = kwargs.pop('method')
+        path = kwargs.pop('path')
+        t0 = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        data = response.get_data()
+        latencies.append(time.perf_counter() - t0)
+        body_bytes += len(data)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'throughput_rps': iterations / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'bytes_per_s': body_bytes / elapsed if elapsed else 0.0,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def resolve_created(app, bench):
+    """Look up the ids of rows the create scenarios inserted"""
+    from app import db
+    from app.models import Book, Member
+    with app.app_context():
+        bench.created_books = [book_id for (book_id,) in db.session.query(Book.id)
+                               .filter(Book.isbn.like('555%')).order_by(Book.id)]
+        bench.created_members = [member_id for (member_id,) in db.session.query(Member.id)
+                                 .filter(Member.email.like('bench%@example.com')).order_by(Member.id)]
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    print(f"\n{'scenario':<34}{'rps before':>12}{'rps after':>12}{'p99 before':>12}{'p99 after':>12}"
+          f"{'MB/s before':>13}{'MB/s after':>12}")
+    for name, after in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        print(f"{name:<34}{before['throughput_rps']:>12.1f}{after['throughput_rps']:>12.1f}"
+              f"{before['p99_ms']:>12.2f}{after['p99_ms']:>12.2f}"
+              f"{before['bytes_per_s'] / 1e6:>13.2f}{after['bytes_per_s'] / 1e6:>12.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=10000, help='number of books; members and loans scale with it')
+    parser.add_argument('--loans-per-book', type=float, default=5.0)
+    parser.add_argument('--only', help='run only scenarios whose name contains this text')
+    parser.add_argument('--max-iterations', type=int, help='cap every scenario at this many requests, for smoke runs')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--no-orjson', action='store_true', help='encode responses with the stdlib json fallback')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['CACHE_ENABLED'] = '1' if args.cache else '0'
+    stub = start_frappe_stub()
+    os.environ['FRAPPE_API_URL'] = f'http://127.0.0.1:{stub.server_port}/'
+    # Measure the proxy itself, not the upstream rate limit
+    os.environ.setdefault('FRAPPE_RATE_LIMIT', '1000')
+    # Imports only queue a job now; running them would compete with the timed scenarios
+    os.environ.setdefault('JOB_RUNNER_ENABLED', '0')
+    # Every simulated client shares one address; per-client limits would cap the load itself
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    if args.no_orjson:
+        # A None entry makes `import orjson` raise ImportError, as if it were not installed
+        sys.modules['orjson'] = None
+
+    from app import create_app, db
+    from app.config import ProductionConfig
+    from app.utils.fees import refresh_projections
+    from app.utils.ledger import charge_fees
+
+    app = create_app(ProductionConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_started = time.perf_counter()
+        counts = generate(books=args.scale, members=max(1, args.scale // 5),
+                          loans=int(args.scale * args.loans_per_book), seed=args.seed,
+                          echo=lambda *a, **k: None)
+        refresh_projections()
+        # Give the members the payment scenario picks from something to pay off
+        charge_fees([(member_id, None, 100) for member_id in range(1, min(1000, counts['members']) + 1)])
+        db.session.commit()
+        seed_seconds = time.perf_counter() - seed_started
+
+    bench = Bench(app, random.Random(args.seed))
+    client = app.test_client()
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+            'cache': args.cache,
+            'encoder': 'json' if args.no_orjson else 'orjson',
+            'rows': counts,
+            'seed_seconds': seed_seconds,
+        },
+        'scenarios': {},
+    }
+
+    print(f"{'scenario':<34}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'MB/s':>10}{'rss MB':>10}  statuses")
+    all_scenarios = scenarios(bench)
+    factories = {name: factory for name, _, factory in all_scenarios}
+    for name, iterations, factory in all_scenarios:
+        if args.only and args.only not in name:
+            continue
+        if args.max_iterations:
+            iterations = min(iterations, args.max_iterations)
+        if name.endswith(': delete'):
+            resolve_created(app, bench)
+            created = bench.created_books if name.startswith('books') else bench.created_members
+            if len(created) < iterations:
+                # The create scenario did not run (e.g. --only): insert the rows to delete, untimed
+                creator = name.replace(': delete', ': create')
+                print(f'{name}: seeding {iterations - len(created)} rows with {creator!r}')
+                run_scenario(client, iterations - len(created), factories[creator])
+                resolve_created(app, bench)
+        if name.startswith('transactions: return'):
+            needed = iterations * (RETURN_BATCH if 'batch' in name else 1)
+            if len(bench.open_loans) < needed:
+                # Small datasets run out of open loans; issue more, untimed
+                print(f"{name}: seeding {needed - len(bench.open_loans)} loans with 'transactions: issue'")
+                run_scenario(client, needed - len(bench.open_loans), factories['transactions: issue'])
+                bench.resolve_open_loans(app)
+            # Some issues fail on stock or debt; run what the open loans allow
+            iterations = min(iterations, len(bench.open_loans) // (needed // iterations))
+            if not iterations:
+                print(f'{name}: skipped, no open loans left')
+                continue
+        result = run_scenario(client, iterations, factory)
+        results['scenarios'][name] = result
+        print(f"{name:<34}{result['throughput_rps']:>10.1f}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['bytes_per_s'] / 1e6:>10.2f}{result['peak_rss_mb']:>10.1f}  {result['statuses']}")
+
+    stub.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
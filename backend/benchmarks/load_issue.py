@@ -0,0 +1,91 @@
+"""Hammer one hot title with concurrent checkouts and returns.
+
+Checks that stock never goes negative and that exactly `stock` issues
+succeed, then reports throughput. Runs against DATABASE_URL, or a
+throwaway SQLite file when it is not set:
+
+    python -m benchmarks.load_issue --threads 16 --stock 50 --requests 200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help='issue attempts per thread')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if not os.environ.get('DATABASE_URL'):
+        path = os.path.join(tempfile.mkdtemp(), 'load_issue.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}?timeout=30'
+    # All threads share one client address; the contention on the last copy is what is measured
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+    from app import create_app, db
+    from app.models import Book, Member
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        book = Book(title='Hot Title', author='Popular Author', isbn='9780000000001', stock=args.stock)
+        db.session.add(book)
+        db.session.add_all(Member(name=f'Member {i}', email=f'member{i}@example.com', outstanding_debt=0.0)
+                           for i in range(args.threads))
+        db.session.commit()
+        book_id = book.id
+        member_ids = [m.id for m in Member.query.order_by(Member.id)]
+
+    results = {'issued': 0, 'rejected': 0, 'errors': 0, 'min_stock': args.stock}
+    lock = threading.Lock()
+    start = threading.Barrier(args.threads)
+
+    def worker(member_id):
+        client = app.test_client()
+        start.wait()
+        for _ in range(args.requests):
+            response = client.post('/api/transactions/issue',
+                                   json={'book_id': book_id, 'member_id': member_id})
+            with app.app_context():
+                stock = db.session.query(Book.stock).filter_by(id=book_id).scalar()
+            with lock:
+                results['min_stock'] = min(results['min_stock'], stock)
+                if response.status_code == 201:
+                    results['issued'] += 1
+                elif response.get_json().get('error') == 'Book not available':
+                    results['rejected'] += 1
+                else:
+                    results['errors'] += 1
+
+    threads = [threading.Thread(target=worker, args=(member_id,)) for member_id in member_ids]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    with app.app_context():
+        final_stock = db.session.query(Book.stock).filter_by(id=book_id).scalar()
+
+    total = args.threads * args.requests
+    print(f"requests:    {total} in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+    print(f"issued:      {results['issued']}")
+    print(f"rejected:    {results['rejected']}")
+    print(f"errors:      {results['errors']}")
+    print(f"min stock:   {results['min_stock']}")
+    print(f"final stock: {final_stock}")
+
+    ok = final_stock == 0 and results['min_stock'] >= 0 and results['issued'] == args.stock
+    print('OK' if ok else 'FAILED: stock was oversold or lost')
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
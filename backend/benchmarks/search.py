@@ -0,0 +1,88 @@
+"""Time the in-process book search index against its p99 target.
+
+Fills a BookSearchIndex straight from benchmarks.datagen titles (no
+database), then runs a mix of whole-word, prefix and multi-word queries
+as GET /api/books/search does and reports p50/p99 latency:
+
+    python -m benchmarks.search --books 1000000 --target-ms 20 --output search.json
+
+Exits with status 1 when p99 is over the target.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+
+from .datagen import WORDS, book_rows
+from .harness import peak_rss_mb, percentile
+
+def queries(rng, count):
+    """Query mix of whole words, typeahead prefixes and two-word searches"""
+    for _ in range(count):
+        word = rng.choice(WORDS)
+        kind = rng.random()
+        if kind < 0.4:
+            yield word
+        elif kind < 0.8:
+            yield word[:rng.randint(1, 3)]
+        else:
+            yield f'{word} {rng.choice(WORDS)[:rng.randint(2, 4)]}'
+
+def run(books, count, limit, seed):
+    from app.utils.search_index import BookSearchIndex
+    rng = random.Random(seed)
+    index = BookSearchIndex()
+    started = time.perf_counter()
+    for book_id, row in enumerate(book_rows(rng, books, 1), 1):
+        index.add(book_id, row['title'], row['author'], row['publisher'])
+    # As the app's load does
+    index.warm()
+    build_seconds = time.perf_counter() - started
+
+    by_kind = {}
+    latencies = []
+    for query in queries(rng, count):
+        t0 = time.perf_counter()
+        index.search(query, limit)
+        elapsed = time.perf_counter() - t0
+        latencies.append(elapsed)
+        kind = 'multi-word' if ' ' in query else 'word' if query in WORDS else 'prefix'
+        by_kind.setdefault(kind, []).append(elapsed)
+
+    def summary(values):
+        values = sorted(values)
+        return {'queries': len(values), 'p50_ms': percentile(values, 0.50) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000}
+
+    return {
+        'books': books,
+        'build_seconds': build_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        **summary(latencies),
+        'by_kind': {kind: summary(values) for kind, values in sorted(by_kind.items())},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=20, help='results per query, as ?limit=')
+    parser.add_argument('--target-ms', type=float, default=20.0, help='p99 budget')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    result = run(args.books, args.queries, args.limit, args.seed)
+    result['target_ms'] = args.target_ms
+    print(f"{args.books} books indexed in {result['build_seconds']:.1f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    print(f"{'queries':<12}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for kind, row in [('all', result)] + list(result['by_kind'].items()):
+        print(f"{kind:<12}{row['queries']:>8}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0 if result['p99_ms'] <= args.target_ms else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Measure import and app-factory cost of a cold worker start.
+
+Every run is a fresh interpreter, so nothing is cached between samples:
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+PROBE = r'''
+import json, time
+t0 = time.perf_counter()
+import app
+from app.config import Config, ProductionConfig
+t1 = time.perf_counter()
+app.create_app({config})
+t2 = time.perf_counter()
+print(json.dumps({{'import_ms': (t1 - t0) * 1000, 'factory_ms': (t2 - t1) * 1000}}))
+'''
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_probe(config):
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    out = subprocess.run([sys.executable, '-c', PROBE.format(config=config)],
+                         cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def slowest_imports(config, top):
+    """Import self-time summed per top-level package, from -X importtime"""
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE.format(config=config)],
+                         cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    totals = {}
+    for line in out.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \| \s*(\S+)', line)
+        if match:
+            package = match.group(2).split('.')[0]
+            totals[package] = totals.get(package, 0) + int(match.group(1)) / 1000
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+def summarize(samples, key):
+    values = [sample[key] for sample in samples]
+    return {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports to list')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for name in ('Config', 'ProductionConfig'):
+        samples = [run_probe(name) for _ in range(args.runs)]
+        results[name] = {
+            'import_ms': summarize(samples, 'import_ms'),
+            'factory_ms': summarize(samples, 'factory_ms'),
+            'slowest_imports_ms': slowest_imports(name, args.top),
+        }
+        print(f"{name}: import {results[name]['import_ms']['median']:.1f} ms, "
+              f"create_app {results[name]['factory_ms']['median']:.1f} ms (median of {args.runs})")
+        for module, ms in results[name]['slowest_imports_ms']:
+            print(f'    {module:<30} {ms:8.1f} ms')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import os
+import multiprocessing
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Pre-forked worker processes, each serving requests on a small thread pool.
+# Keep DB_POOL_SIZE >= threads so a worker never waits for a connection.
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# A per-process response cache would keep serving what other workers have
+# invalidated; share it through Redis or do without it. Set here, before the
+# preloaded app reads its config; on_starting reports it through gunicorn's log.
+cache_disabled = workers > 1 and os.environ.get('CACHE_BACKEND', 'memory') == 'memory' \
+    and os.environ.get('CACHE_ENABLED', '1') == '1'
+if cache_disabled:
+    os.environ['CACHE_ENABLED'] = '0'
+
+# Import the app once in the master and fork it, sharing its pages copy-on-write
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks cannot build up
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    if cache_disabled:
+        server.log.warning('Response cache disabled: CACHE_BACKEND=memory with %d workers; set CACHE_BACKEND=redis',
+                           workers)
+
+def post_fork(server, worker):
+    # Connections must never be shared across processes; start each worker with an empty pool
+    from app import db
+    from app.utils.routing import replicas
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose()
+    replicas.dispose()
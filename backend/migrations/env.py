@@ -71,6 +71,10 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # SQLite's bookkeeping table for AUTOINCREMENT tables is not part of the models
+    def include_object(object, name, type_, reflected, compare_to):
+        return not (type_ == 'table' and name == 'sqlite_sequence')
+
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
@@ -78,6 +82,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
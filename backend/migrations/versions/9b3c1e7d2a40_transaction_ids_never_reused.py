@@ -0,0 +1,42 @@
+"""transaction ids never reused
+
+Revision ID: 9b3c1e7d2a40
+Revises: 52874ebdf646
+Create Date: 2026-10-18 11:02:47.215330
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3c1e7d2a40'
+down_revision = '52874ebdf646'
+branch_labels = None
+depends_on = None
+
+# The next loan id must be above every id ever used, hot or archived
+NEXT_ID = 'SELECT coalesce(max(id), 0) + 1 FROM (SELECT id FROM "transaction" UNION ALL SELECT id FROM transaction_archive) ids'
+
+
+def upgrade():
+    bind = op.get_bind()
+    next_id = bind.execute(sa.text(NEXT_ID.replace('"', '`' if bind.dialect.name == 'mysql' else '"'))).scalar()
+    if bind.dialect.name == 'sqlite':
+        # SQLite reuses the largest rowid after a delete unless the table is AUTOINCREMENT
+        with op.batch_alter_table('transaction', recreate='always',
+                                  table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+            pass
+        op.execute("DELETE FROM sqlite_sequence WHERE name = 'transaction'")
+        op.execute(sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('transaction', :seq)")
+                   .bindparams(seq=next_id - 1))
+    elif bind.dialect.name == 'mysql':
+        op.execute(f'ALTER TABLE `transaction` AUTO_INCREMENT = {next_id}')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        with op.batch_alter_table('transaction', recreate='always',
+                                  table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+            pass
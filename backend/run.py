@@ -1,11 +1,8 @@
-from app import create_app, db
+from app import create_app
 
 app = create_app()
 
-def init_db():
-    with app.app_context():
-        db.create_all()
-
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True) 
\ No newline at end of file
+    # Development server only; run `flask db upgrade` first to create the schema
+    # and use wsgi.py with gunicorn in production
+    app.run(debug=True)
@@ -0,0 +1,116 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+from sqlalchemy import event
+from app import create_app, db
+from app.config import Config
+from app.utils.dedup import duplicate_index
+from app.utils.recommendations import recommender
+from app.utils.search_index import search_index
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLALCHEMY_REPLICA_URLS = []
+    ENABLE_MIGRATIONS = False
+    CACHE_ENABLED = False
+    CACHE_BACKEND = 'memory'
+    RATE_LIMIT_ENABLED = False
+    JOB_RUNNER_ENABLED = False
+
+def make_app(tmp_path, **settings):
+    """An app on a fresh SQLite file, with its tables created"""
+    config = type('Config', (TestConfig,), {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}", **settings})
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+    # The in-process indexes outlive an app; start each test from empty ones
+    search_index.__init__()
+    duplicate_index.__init__()
+    recommender.__init__()
+    return app
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+class QueryCounter:
+    """Counts statements sent to an engine while in use as a context manager"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+    def __len__(self):
+        return len(self.statements)
+
+@pytest.fixture
+def count_queries(app):
+    return lambda: QueryCounter(db.engine)
+
+class StubUpstream:
+    """Local HTTP server standing in for the Frappe API.
+
+    `respond(query)` gets the request's query parameters and returns a
+    (status, JSON body) pair, or (status, bytes) to send a body as is;
+    every query is also kept in `requests`.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+                with stub._lock:
+                    stub.requests.append(query)
+                status, body = stub.respond(query)
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/method/frappe-library'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub_upstream():
+    stubs = []
+    def start(respond):
+        stubs.append(StubUpstream(respond))
+        return stubs[-1]
+    yield start
+    for stub in stubs:
+        stub.close()
@@ -0,0 +1,40 @@
+import time
+import pytest
+from app.utils.admission import admission
+from conftest import make_app
+
+def admission_client(tmp_path, **settings):
+    app = make_app(tmp_path, RATE_LIMIT_ENABLED=True, **settings)
+    admission.queue_delay = 0.0
+    return app.test_client()
+
+def export(client, start, addr='10.0.0.1'):
+    return client.get('/api/books/export', headers={'X-Request-Start': start},
+                      environ_base={'REMOTE_ADDR': addr})
+
+@pytest.mark.parametrize('start', ['t=1', f't={time.time() - 5:.3f}'])
+def test_request_start_is_ignored_without_a_trusted_proxy(tmp_path, start):
+    client = admission_client(tmp_path)
+    assert export(client, start).status_code == 200
+    assert admission.queue_delay == 0.0
+
+@pytest.mark.parametrize('start', ['t=1', 'garbage', f't={time.time() + 30:.3f}'])
+def test_implausible_request_start_is_ignored(tmp_path, start):
+    client = admission_client(tmp_path, TRUSTED_PROXY_HOPS=1)
+    assert export(client, start).status_code == 200
+    assert admission.queue_delay == 0.0
+
+def test_queue_delay_samples_are_clamped(tmp_path):
+    client = admission_client(tmp_path, TRUSTED_PROXY_HOPS=1, ADMISSION_QUEUE_BUDGET_MS=500)
+    assert export(client, f't={time.time() - 50:.3f}').status_code == 503
+    # One slow sample counts for at most a few budgets, and the average recovers
+    assert admission.queue_delay <= 0.2 * 4 * 0.5
+    for _ in range(5):
+        client.get('/api/books', headers={'X-Request-Start': f't={time.time():.3f}'})
+    assert export(client, f't={time.time():.3f}', addr='10.0.0.2').status_code == 200
+
+def test_proxy_hops_key_buckets_on_the_forwarded_client(tmp_path):
+    client = admission_client(tmp_path, TRUSTED_PROXY_HOPS=1, RATE_LIMITS='read=0.01/2')
+    for addr in ('198.51.100.1', '198.51.100.2'):
+        codes = [client.get('/api/books', headers={'X-Forwarded-For': addr}).status_code for _ in range(3)]
+        assert codes == [200, 200, 429]
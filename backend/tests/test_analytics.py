@@ -0,0 +1,66 @@
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import event
+from app import db
+from app.models import CirculationDaily, CirculationDailyStaging
+from app.utils.analytics import _add, backfill
+from conftest import make_app
+from test_transactions import add_loans
+
+@pytest.fixture
+def cached_app(tmp_path):
+    app = make_app(tmp_path, CACHE_ENABLED=True)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+def test_backfill_replaces_past_rollups_and_invalidates_reports(cached_app):
+    client = cached_app.test_client()
+    add_loans(3)
+    # Reports default to UTC days
+    today = datetime.utcnow().date()
+    yesterday = today - timedelta(days=1)
+    db.session.add(CirculationDaily(day=yesterday, loans=99, returns=0, fees_paise=0))
+    db.session.commit()
+    assert [day['loans'] for day in client.get('/api/reports/daily').get_json()['days']] == [99]
+
+    backfill()
+    days = client.get('/api/reports/daily').get_json()['days']
+    assert [(day['day'], day['loans']) for day in days] == [
+        ((today - timedelta(days=2)).isoformat(), 1), (yesterday.isoformat(), 1)]
+    assert CirculationDailyStaging.query.count() == 0
+
+def test_cached_reports_move_their_default_range_with_the_day(cached_app, monkeypatch):
+    client = cached_app.test_client()
+    first = client.get('/api/reports/daily').get_json()
+    assert first == client.get('/api/reports/daily').get_json()
+
+    class Tomorrow(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcnow() + timedelta(days=1)
+
+    monkeypatch.setattr('app.views.reports.datetime', Tomorrow)
+    second = client.get('/api/reports/daily').get_json()
+    assert date.fromisoformat(second['to']) == date.fromisoformat(first['to']) + timedelta(days=1)
+    # An explicit range does not depend on the day
+    assert client.get(f"/api/reports/daily?from={first['from']}&to={first['to']}").get_json()['to'] == first['to']
+
+def test_add_keeps_every_delta_when_some_rows_appear_concurrently(app):
+    first, second = date(2024, 1, 1), date(2024, 1, 2)
+    raced = []
+
+    def create_first_row(conn, cursor, statement, parameters, context, executemany):
+        # Another request inserts one of the missing rows after they were looked up
+        if statement.startswith('SELECT circulation_daily.day') and not raced:
+            raced.append(True)
+            conn.execute(CirculationDaily.__table__.insert(), {'day': first, 'loans': 5, 'returns': 0, 'fees_paise': 0})
+
+    event.listen(db.engine, 'after_cursor_execute', create_first_row)
+    try:
+        _add(CirculationDaily, None, {(first, None): [1, 0, 0], (second, None): [2, 0, 0]})
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', create_first_row)
+    assert raced
+    assert dict(db.session.query(CirculationDaily.day, CirculationDaily.loans)) == {first: 6, second: 2}
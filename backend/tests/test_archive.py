@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models import Book, Transaction
+from app.utils.archive import run_archive
+from test_transactions import add_loans
+
+def test_archived_loan_ids_are_never_handed_out_again(app, client):
+    app.config['ARCHIVE_PAUSE_SECONDS'] = 0
+    add_loans(4)
+    Transaction.query.update({Transaction.return_date: datetime.utcnow() - timedelta(days=365)})
+    db.session.commit()
+    assert run_archive(days=30)['archived'] == 3
+    # Even once the newest loan, which the archiver keeps, is gone
+    db.session.execute(Transaction.__table__.delete())
+    Book.query.update({Book.stock: 1})
+    db.session.commit()
+
+    assert client.post('/api/transactions/issue', json={'book_id': 1, 'member_id': 1}).status_code == 201
+    ids = [loan['id'] for loan in client.get('/api/transactions/history').get_json()['items']]
+    assert ids == [1, 2, 3, 5]
@@ -0,0 +1,35 @@
+import os
+import sys
+import json
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_benchmark(module, *args):
+    # Each benchmark picks its own throwaway database
+    env = {name: value for name, value in os.environ.items() if name != 'DATABASE_URL'}
+    return subprocess.run([sys.executable, '-m', module, *args], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True, timeout=600)
+
+def test_the_startup_benchmark_runs(tmp_path):
+    output = tmp_path / 'startup.json'
+    result = run_benchmark('benchmarks.startup', '--runs', '1', '--top', '3', '--output', str(output))
+    assert result.returncode == 0, result.stderr
+    results = json.loads(output.read_text())
+    assert set(results) == {'Config', 'ProductionConfig'}
+    for config in results.values():
+        assert config['import_ms']['median'] > 0 and config['factory_ms']['median'] > 0
+        assert len(config['slowest_imports_ms']) == 3
+
+def test_the_endpoint_harness_runs_every_scenario_on_a_tiny_dataset(tmp_path):
+    output = tmp_path / 'harness.json'
+    # Too few open loans for the return scenarios, so the harness has to issue more first
+    result = run_benchmark('benchmarks.harness', '--scale', '20', '--max-iterations', '10', '--output', str(output))
+    assert result.returncode == 0, result.stderr
+    results = json.loads(output.read_text())
+    assert results['meta']['rows']['books'] == 20
+    scenarios = results['scenarios']
+    assert len(scenarios) == 26 and 'seeding' in result.stdout
+    for name, scenario in scenarios.items():
+        assert scenario['iterations'] > 0 and scenario['throughput_rps'] > 0, name
+        assert not any(status.startswith('5') for status in scenario['statuses']), (name, scenario['statuses'])
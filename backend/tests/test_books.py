@@ -0,0 +1,59 @@
+import json
+from app import db
+from app.models import Book
+
+def add_books(count, title='Same Title'):
+    """Books that share every column but id and ISBN"""
+    db.session.execute(Book.__table__.insert(), [
+        {'title': title, 'author': 'Same Author', 'isbn': f'978{i:010d}', 'stock': 1} for i in range(count)])
+    db.session.commit()
+    return [book_id for (book_id,) in db.session.query(Book.id).order_by(Book.id)]
+
+def test_pages_continue_from_the_cursor_over_identical_rows(client):
+    ids = add_books(25)
+    seen = []
+    page = client.get('/api/books?limit=10').get_json()
+    while True:
+        seen += [item['id'] for item in page['items']]
+        if page['next_after'] is None:
+            break
+        assert page['next_after'] == page['items'][-1]['id']
+        page = client.get(f"/api/books?limit=10&after={page['next_after']}").get_json()
+    assert seen == ids
+
+def test_rows_deleted_between_pages_do_not_shift_the_next_page(client):
+    ids = add_books(6)
+    first = client.get('/api/books?limit=3').get_json()
+    Book.query.filter(Book.id.in_(ids[:2])).delete(synchronize_session=False)
+    db.session.commit()
+    second = client.get(f"/api/books?limit=3&after={first['next_after']}").get_json()
+    assert [item['id'] for item in second['items']] == ids[3:]
+
+def test_limit_is_clamped_and_bad_cursors_are_refused(client):
+    add_books(3)
+    assert len(client.get('/api/books?limit=0').get_json()['items']) == 1
+    assert len(client.get('/api/books?after=-5').get_json()['items']) == 3
+    for query in ('after=abc', 'after=1.5', 'limit=ten'):
+        response = client.get(f'/api/books?{query}')
+        assert response.status_code == 400 and 'must be an integer' in response.get_json()['error']
+
+def test_the_full_listing_streams_in_keyset_batches(client, count_queries):
+    # Past two batches of STREAM_BATCH_SIZE
+    ids = add_books(2100)
+    with count_queries() as queries:
+        response = client.get('/api/books')
+        assert response.is_streamed and response.mimetype == 'application/json'
+        body = json.loads(response.get_data())
+    assert [book['id'] for book in body] == ids
+    assert body[0] == {'id': ids[0], 'title': 'Same Title', 'author': 'Same Author', 'isbn': '9780000000000',
+                       'publisher': None, 'stock': 1}
+    assert len(queries) == 3
+
+    response = client.get('/api/books?stream=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data().splitlines()
+    assert [json.loads(line)['id'] for line in lines] == ids
+
+def test_an_empty_catalog_streams_an_empty_array(client):
+    assert client.get('/api/books').get_data() == b'[]'
+    assert client.get('/api/books?stream=ndjson').get_data() == b''
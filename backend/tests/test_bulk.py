@@ -0,0 +1,87 @@
+import json
+from sqlalchemy import event
+from app import db
+from app.models import Book
+
+CSV = (b'title,author,isbn,publisher,stock\n'
+       b'Monsoon Letters,Asha Menon,9780000000001,Coral Press,3\n'
+       b'Deccan Nights,Farid Khan,978-0000000002,,1\n')
+
+def import_books(client, body, fmt, **args):
+    return client.post('/api/books/import', data=body, query_string={'format': fmt, **args})
+
+def exported(client, fmt):
+    response = client.get('/api/books/export', query_string={'format': fmt})
+    assert response.status_code == 200
+    return response.get_data()
+
+def test_csv_import_round_trips_through_export(client):
+    result = import_books(client, CSV, 'csv').get_json()
+    assert result['inserted'] == 2 and result['invalid'] == 0
+    body = exported(client, 'csv').decode()
+    assert body.splitlines() == ['id,title,author,isbn,publisher,stock',
+                                 '1,Monsoon Letters,Asha Menon,9780000000001,Coral Press,3',
+                                 '2,Deccan Nights,Farid Khan,9780000000002,,1']
+
+    # Re-importing an export changes nothing
+    again = import_books(client, body.encode(), 'csv').get_json()
+    assert again['inserted'] == 0 and again['skipped'] == 2
+    assert exported(client, 'csv').decode() == body
+
+def test_ndjson_import_round_trips_through_export(client):
+    books = [{'title': 'Salt Road', 'author': 'Leela Das', 'isbn': '9780000000001', 'publisher': None, 'stock': 2},
+             {'title': 'Quiet Harbour', 'author': 'Tom Paul', 'isbn': '9780000000002', 'publisher': 'Tide', 'stock': 0}]
+    body = b''.join(json.dumps(book).encode() + b'\n' for book in books)
+    assert import_books(client, body, 'ndjson').get_json()['inserted'] == 2
+    lines = [json.loads(line) for line in exported(client, 'ndjson').splitlines()]
+    assert [{k: v for k, v in line.items() if k != 'id'} for line in lines] == books
+
+def test_bad_rows_are_reported_by_line_and_the_rest_imported(client):
+    body = b'\n'.join([
+        json.dumps({'title': 'Good Book', 'author': 'A. Writer', 'isbn': '9780000000001'}).encode(),
+        json.dumps({'title': 'No Author', 'isbn': '9780000000002'}).encode(),
+        json.dumps({'title': 'Short ISBN', 'author': 'B. Writer', 'isbn': '123'}).encode(),
+        json.dumps({'title': 'Odd Stock', 'author': 'C. Writer', 'isbn': '9780000000003', 'stock': 'many'}).encode(),
+        b'{not json',
+        b'[1, 2]',
+    ])
+    result = import_books(client, body, 'ndjson').get_json()
+    assert result['inserted'] == 1 and result['invalid'] == 5
+    assert [error['line'] for error in result['errors']] == [2, 3, 4, 5, 6]
+    assert result['errors'][0]['error'] == 'author is required'
+    assert [book.title for book in Book.query] == ['Good Book']
+
+def test_duplicate_isbns_are_skipped_or_updated(client):
+    import_books(client, CSV, 'csv')
+    body = (b'title,author,isbn,stock\n'
+            b'Monsoon Letters (2nd ed.),Asha Menon,9780000000001,5\n'
+            b'Monsoon Letters (copy),Asha Menon,9780000000001,9\n'
+            b'Harbour Lights,Nila Roy,9780000000003,1\n')
+    result = import_books(client, body, 'csv').get_json()
+    assert (result['inserted'], result['skipped'], result['updated']) == (1, 2, 0)
+    assert Book.query.filter_by(isbn='9780000000001').one().title == 'Monsoon Letters'
+
+    result = import_books(client, body, 'csv', on_duplicate='update').get_json()
+    assert (result['inserted'], result['skipped'], result['updated']) == (0, 1, 2)
+    book = Book.query.filter_by(isbn='9780000000001').one()
+    assert (book.title, book.stock) == ('Monsoon Letters (2nd ed.)', 5)
+
+def test_an_isbn_inserted_by_a_concurrent_import_counts_as_existing(client):
+    raced = []
+
+    def insert_elsewhere(conn, cursor, statement, parameters, context, executemany):
+        # Another import inserts one of the ISBNs after this one has looked them up
+        if statement.startswith('SELECT book.isbn') and not raced:
+            raced.append(True)
+            conn.execute(Book.__table__.insert(), {'title': 'Monsoon Letters', 'author': 'Asha Menon',
+                                                   'isbn': '9780000000001', 'stock': 7})
+
+    event.listen(db.engine, 'after_cursor_execute', insert_elsewhere)
+    try:
+        response = import_books(client, CSV, 'csv', on_duplicate='update')
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', insert_elsewhere)
+    assert raced and response.status_code == 201
+    result = response.get_json()
+    assert (result['inserted'], result['updated']) == (1, 1)
+    assert {book.isbn: book.stock for book in Book.query} == {'9780000000001': 3, '9780000000002': 1}
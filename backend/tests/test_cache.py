@@ -0,0 +1,66 @@
+import shutil
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.models import Book, Member, Transaction
+from app.utils.cache import response_cache
+from app.utils.routing import replicas
+from conftest import make_app
+from test_transactions import add_loans
+
+@pytest.fixture
+def cached_client(tmp_path):
+    app = make_app(tmp_path, CACHE_ENABLED=True)
+    with app.app_context():
+        yield app.test_client()
+        db.session.remove()
+
+def test_listing_is_served_from_cache_until_invalidated(cached_client):
+    add_loans(2)
+    before = response_cache.stats()
+    first = cached_client.get('/api/transactions/active')
+    second = cached_client.get('/api/transactions/active')
+    assert second.get_json() == first.get_json() and second.headers['ETag'] == first.headers['ETag']
+    assert cached_client.get('/api/transactions/active', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    after = response_cache.stats()
+    assert [after[result] - before[result] for result in ('misses', 'hits', 'not_modified')] == [1, 1, 1]
+
+def test_overdue_listing_is_never_cached(cached_client):
+    add_loans(20)
+    before = response_cache.stats()
+    for _ in range(2):
+        response = cached_client.get('/api/transactions/active?overdue=1')
+        assert response.status_code == 200 and 'ETag' not in response.headers
+    assert response_cache.stats() == before
+
+def test_cache_misses_are_never_filled_from_a_lagging_replica(tmp_path):
+    replica_path = tmp_path / 'replica.db'
+    app = make_app(tmp_path, CACHE_ENABLED=True, SQLALCHEMY_REPLICA_URLS=[f'sqlite:///{replica_path}'])
+    try:
+        with app.app_context():
+            add_loans(1)
+            db.engine.dispose()
+            # The replica stops here: it never sees the writes below
+            shutil.copy(tmp_path / 'test.db', replica_path)
+
+            writer, reader = app.test_client(), app.test_client()
+            assert writer.post('/api/books', json={'title': 'New', 'author': 'Author',
+                                                   'isbn': '9780000000001', 'stock': 1}).status_code == 201
+            book = Book.query.filter_by(isbn='9780000000001').one()
+            db.session.add(Transaction(book_id=book.id, member_id=Member.query.first().id,
+                                       issue_date=datetime.utcnow() - timedelta(days=365)))
+            db.session.commit()
+            db.session.remove()
+
+            # Uncached reads still go to the replica...
+            assert reader.get('/api/transactions/active?overdue=1').get_json() == []
+            assert len(writer.get('/api/transactions/active?overdue=1').get_json()) == 1
+            # ...but a miss is read from the primary, so the writer gets the fresh list too
+            fresh = reader.get('/api/books')
+            assert len(fresh.get_json()) == 2
+            again = writer.get('/api/books')
+            assert again.get_json() == fresh.get_json() and again.headers['ETag'] == fresh.headers['ETag']
+            db.session.remove()
+    finally:
+        replicas.dispose()
+        replicas.engines = []
@@ -0,0 +1,31 @@
+from sqlalchemy import event
+from app import db
+from app.models import Book, BookDuplicate
+from app.utils.dedup import record_duplicates
+
+def add_books(count):
+    db.session.add_all(Book(title=f'Book {i}', author='Author', isbn=f'{i:013d}', stock=1) for i in range(count))
+    db.session.commit()
+
+def test_pairs_recorded_concurrently_are_skipped(app):
+    add_books(4)
+    raced = []
+
+    def record_first_pair(conn, cursor, statement, parameters, context, executemany):
+        # Another import records one of the pairs after they were looked up
+        if statement.startswith('SELECT book_duplicate.book_id') and not raced:
+            raced.append(True)
+            conn.execute(BookDuplicate.__table__.insert(), {'book_id': 2, 'duplicate_of_id': 1, 'similarity': 0.9,
+                                                            'source': 'import', 'status': 'open'})
+
+    event.listen(db.engine, 'after_cursor_execute', record_first_pair)
+    try:
+        assert record_duplicates([(2, 1, 0.9), (4, 3, 0.85)]) == 1
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', record_first_pair)
+    assert raced
+    assert sorted(db.session.query(BookDuplicate.book_id, BookDuplicate.duplicate_of_id)) == [(2, 1), (4, 3)]
+
+def test_bad_page_arguments_are_a_400(client):
+    assert client.get('/api/books/duplicates?limit=5&after=99999999999999999999').status_code == 400
@@ -0,0 +1,153 @@
+import json
+import time
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.models import Book, ChangeEvent, Member, Transaction
+from app.utils.events import change_feed, prune_events, publish_many
+from app.utils.jobs import runner
+from app.views import transactions
+from conftest import make_app
+
+def test_event_streams_are_not_rate_limited(tmp_path):
+    app = make_app(tmp_path, RATE_LIMIT_ENABLED=True, RATE_LIMITS='read=0.01/1', CHANGE_FEED_MAX_CLIENTS=3)
+    client = app.test_client()
+    streams = [client.get('/api/events', buffered=False) for _ in range(3)]
+    try:
+        assert [stream.status_code for stream in streams] == [200, 200, 200]
+        # Over the per-process cap: 503, for the client to retry later
+        full = client.get('/api/events')
+        assert full.status_code == 503 and full.headers['Retry-After']
+        assert client.get('/api/books').status_code == 200
+        assert client.get('/api/books').status_code == 429
+    finally:
+        for stream in reversed(streams):
+            stream.close()
+    assert change_feed.clients == 0
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting for the change feed'
+        time.sleep(0.01)
+
+def publish_books(app, count):
+    with app.app_context():
+        before = db.session.query(db.func.max(ChangeEvent.id)).scalar() or 0
+        publish_many('book.created', [{'id': i} for i in range(count)])
+        db.session.commit()
+        ids = [row.id for row in ChangeEvent.query.filter(ChangeEvent.id > before).order_by(ChangeEvent.id)]
+        db.session.remove()
+    wait_for(lambda: change_feed.last_id == ids[-1])
+    return ids
+
+def read_events(stream, count):
+    """The next `count` (id, type) pairs on an open stream, skipping comments"""
+    events = []
+    for chunk in stream.response:
+        for message in chunk.decode().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in message.split('\n') if line.startswith(('id:', 'event:')))
+            if 'id' in fields:
+                events.append((int(fields['id']), fields['event']))
+        if len(events) >= count:
+            return events
+    return events
+
+@pytest.fixture
+def feed_app(tmp_path):
+    return make_app(tmp_path, CHANGE_FEED_BUFFER=3, CHANGE_FEED_KEEPALIVE=1, CHANGE_FEED_POLL_SECONDS=0.05)
+
+def test_a_client_resumes_after_its_last_event_id(feed_app):
+    client = feed_app.test_client()
+    first = client.get('/api/events', buffered=False)
+    try:
+        ids = publish_books(feed_app, 2)
+        assert read_events(first, 2) == [(ids[0], 'book.created'), (ids[1], 'book.created')]
+    finally:
+        first.close()
+
+    more = publish_books(feed_app, 2)
+    resumed = client.get('/api/events', headers={'Last-Event-ID': str(ids[-1])}, buffered=False)
+    try:
+        assert read_events(resumed, 2) == [(event_id, 'book.created') for event_id in more]
+    finally:
+        resumed.close()
+
+def test_a_client_behind_the_ring_buffer_catches_up_from_the_table(feed_app):
+    client = feed_app.test_client()
+    client.get('/api/events', buffered=False).close()
+    # Ten events through a three-event buffer
+    ids = publish_books(feed_app, 10)
+    assert change_feed.buffer[0][0] == ids[-3]
+    caught_up = change_feed.stats['caught_up']
+
+    stream = client.get(f'/api/events?last_event_id={ids[0] - 1}', buffered=False)
+    try:
+        assert [event_id for event_id, _ in read_events(stream, 10)] == ids
+    finally:
+        stream.close()
+    assert change_feed.stats['caught_up'] - caught_up == 10
+
+def test_a_client_whose_events_were_pruned_is_told_to_reset(feed_app):
+    client = feed_app.test_client()
+    client.get('/api/events', buffered=False).close()
+    ids = publish_books(feed_app, 5)
+    with feed_app.app_context():
+        assert prune_events(retention=-1) == 4
+        assert [row.id for row in ChangeEvent.query] == ids[-1:]
+
+    stream = client.get('/api/events', headers={'Last-Event-ID': str(ids[0])}, buffered=False)
+    try:
+        assert read_events(stream, 1) == [(ids[-1], 'reset')]
+        # Live again from the reset point
+        newer = publish_books(feed_app, 1)
+        assert read_events(stream, 1) == [(newer[0], 'book.created')]
+    finally:
+        stream.close()
+
+def test_old_events_are_pruned_without_any_stream_open(tmp_path):
+    app = make_app(tmp_path, CHANGE_FEED_RETENTION=3600)
+    with app.app_context():
+        publish_many('book.created', [{'id': 1}, {'id': 2}, {'id': 3}])
+        db.session.commit()
+        ChangeEvent.query.filter(ChangeEvent.id == 1) \
+            .update({ChangeEvent.created_at: datetime.utcnow() - timedelta(hours=2)})
+        db.session.commit()
+        db.session.remove()
+
+    result = app.test_cli_runner().invoke(args=['events', 'prune'])
+    assert result.exit_code == 0 and 'Pruned 1 change events' in result.output
+    with app.app_context():
+        assert [row.id for row in ChangeEvent.query] == [2, 3]
+        # The job runner's housekeeping pass does the same on its own schedule
+        ChangeEvent.query.update({ChangeEvent.created_at: datetime.utcnow() - timedelta(hours=2)})
+        db.session.commit()
+        runner._pruned_at = None
+        runner._housekeeping()
+        # All but the newest, whose id must not be handed out again
+        assert [row.id for row in ChangeEvent.query] == [3]
+        db.session.remove()
+
+def test_batch_issue_publishes_one_event_per_new_loan(app, client, monkeypatch):
+    # MySQL keeps whole seconds, so another batch in the same second shares the issue date
+    now = datetime.utcnow().replace(microsecond=0)
+    monkeypatch.setattr(transactions, 'datetime', type('FrozenClock', (datetime,), {'utcnow': staticmethod(lambda: now)}))
+    books = [Book(title=f'Batch {i}', author='Author', isbn=f'97800000000{i:02d}', stock=3) for i in range(2)]
+    member = Member(name='Reader', email='reader@example.com')
+    db.session.add_all(books + [member])
+    db.session.flush()
+    earlier = Transaction(book_id=books[0].id, member_id=member.id, issue_date=now)
+    db.session.add(earlier)
+    db.session.commit()
+    items = [{'book_id': book.id, 'member_id': member.id} for book in books] * 2
+    earlier_id = earlier.id
+    db.session.remove()
+
+    response = client.post('/api/transactions/issue/batch', json={'items': items})
+    assert response.status_code == 201 and response.get_json()['issued'] == 4
+
+    new_loans = {row.id for row in Transaction.query.filter(Transaction.member_id == member.id,
+                                                            Transaction.id != earlier_id)}
+    events = [json.loads(row.data) for row in ChangeEvent.query.filter_by(type='loan.issued')]
+    assert len(new_loans) == 4
+    assert sorted(event['id'] for event in events) == sorted(new_loans)
@@ -0,0 +1,25 @@
+from datetime import datetime
+from sqlalchemy import event
+from app import db
+from app.models import MemberFeeProjection
+from app.utils.fees import record_issues
+from test_transactions import add_loans
+
+def test_record_issues_keeps_every_count_when_some_projections_appear_concurrently(app):
+    add_loans(2)
+    raced = []
+
+    def create_first_projection(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT member_fee_projection.member_id') and not raced:
+            raced.append(True)
+            conn.execute(MemberFeeProjection.__table__.insert(),
+                         {'member_id': 1, 'open_loans': 1, 'accrued_fee': 0.0, 'refreshed_at': datetime.utcnow()})
+
+    event.listen(db.engine, 'after_cursor_execute', create_first_projection)
+    try:
+        record_issues({1: 1, 2: 1})
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', create_first_projection)
+    assert raced
+    assert dict(db.session.query(MemberFeeProjection.member_id, MemberFeeProjection.open_loans)) == {1: 2, 2: 1}
@@ -0,0 +1,127 @@
+import threading
+import pytest
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Book
+from app.utils import api_helper
+from app.utils.api_helper import run_import, save_books
+from app.utils.jobs import JOB_TYPES
+from conftest import make_app
+
+def catalog(pages, per_page=20):
+    """Stub responder serving `pages` pages; ISBNs repeat across pages so some rows are duplicates"""
+    def respond(query):
+        page = int(query.get('page', 1))
+        if page > pages:
+            return 200, {'message': []}
+        return 200, {'message': [{'title': f'Title {page}-{i}', 'authors': f'Author {i}', 'publisher': 'Pub',
+                                  'isbn': f'978{(page * per_page + i) % (per_page * 2):010d}'}
+                                 for i in range(per_page)]}
+    return respond
+
+@pytest.fixture
+def frappe_app(tmp_path, stub_upstream):
+    def start(respond, **settings):
+        stub = stub_upstream(respond)
+        app = make_app(tmp_path, FRAPPE_API_URL=stub.url, FRAPPE_CONCURRENCY=2, FRAPPE_BACKOFF_FACTOR=0,
+                       IMPORT_CHUNK_SIZE=7, NEAR_DUPLICATE_ACTION='off', **settings)
+        # The pooled session keeps the retry settings of whichever app made it first
+        api_helper._session = None
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        return app, stub
+    contexts = []
+    yield start
+    for context in contexts:
+        db.session.remove()
+        context.pop()
+
+def test_import_fetches_pages_concurrently_and_stops_at_the_first_empty_page(frappe_app):
+    app, stub = frappe_app(catalog(pages=3))
+    progress = run_import({'title': 'x'}, pages=10)
+
+    # Pages come in waves of FRAPPE_CONCURRENCY, so the wave holding the first empty page is fetched whole
+    assert sorted(int(query['page']) for query in stub.requests) == [1, 2, 3, 4]
+    assert all(query['title'] == 'x' for query in stub.requests)
+    assert progress['pages_fetched'] == 3 and progress['fetched'] == 60
+    # Pages 1 and 3 carry the same ISBNs
+    assert progress['imported'] == 40 and progress['skipped'] == 20
+    assert Book.query.count() == 40
+
+def test_import_again_skips_every_known_isbn(frappe_app):
+    frappe_app(catalog(pages=2))
+    run_import({}, pages=2)
+    progress = run_import({}, pages=2)
+    assert progress['imported'] == 0 and progress['skipped'] == 40
+    assert Book.query.count() == 40
+
+def test_upstream_errors_are_retried(frappe_app):
+    failures = {'left': 2}
+    serve = catalog(pages=1)
+    def flaky(query):
+        if failures['left']:
+            failures['left'] -= 1
+            return 503, {'error': 'busy'}
+        return serve(query)
+    frappe_app(flaky)
+    assert run_import({}, pages=1)['imported'] == 20
+
+def test_an_isbn_inserted_concurrently_is_skipped_not_fatal(frappe_app, monkeypatch):
+    frappe_app(catalog(pages=1))
+    split = api_helper.split_duplicates
+    raced = []
+    def split_then_race(rows, action=None):
+        # Another import commits one of this chunk's ISBNs after the existence check
+        if not raced and rows:
+            raced.append(rows[0]['isbn'])
+            with Session(db.engine) as other:
+                other.add(Book(title='Elsewhere', author='Other', isbn=rows[0]['isbn'], stock=1))
+                other.commit()
+        return split(rows, action)
+    monkeypatch.setattr(api_helper, 'split_duplicates', split_then_race)
+
+    result = save_books([{'title': f'T{i}', 'authors': 'A', 'isbn': f'97800000000{i:02d}'} for i in range(5)])
+    assert result == {'imported': 4, 'skipped': 1, 'merged': 0, 'flagged': 0}
+    assert Book.query.filter_by(isbn=raced[0]).one().title == 'Elsewhere'
+    assert Book.query.count() == 5
+
+def test_concurrent_imports_of_the_same_pages_insert_each_isbn_once(frappe_app):
+    app, _ = frappe_app(catalog(pages=2))
+    errors = []
+    def worker():
+        with app.app_context():
+            try:
+                run_import({}, pages=2)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert Book.query.count() == 40
+
+@pytest.mark.parametrize('body', [{'pages': 'many'}, {'pages': None}, {'page': 'x'}, ['pages', 2], 'pages'])
+def test_import_endpoint_rejects_bad_parameters(frappe_app, body):
+    app, stub = frappe_app(catalog(pages=1))
+    response = app.test_client().post('/api/frappe/import', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    assert not stub.requests
+
+def test_import_endpoint_queues_a_job_that_imports(frappe_app):
+    app, _ = frappe_app(catalog(pages=2))
+    client = app.test_client()
+    response = client.post('/api/frappe/import', json={'pages': '2', 'title': 'x'})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    status = client.get(f'/api/frappe/import/{job_id}').get_json()
+    assert status['status'] == 'queued' and status['params']['pages'] == 2
+
+    progress = {}
+    JOB_TYPES['frappe_import'].func(status['params'], progress)
+    assert progress['imported'] == 40
@@ -0,0 +1,95 @@
+import threading
+import time
+import pytest
+from app.utils.frappe_proxy import frappe_proxy
+from conftest import make_app
+
+def books(query):
+    return 200, {'message': [{'title': query.get('title', ''), 'isbn': '9780000000001'}]}
+
+@pytest.fixture
+def proxy_client(tmp_path, stub_upstream):
+    def start(respond=books, **settings):
+        stub = stub_upstream(respond)
+        app = make_app(tmp_path, FRAPPE_API_URL=stub.url, **settings)
+        return app.test_client(), stub
+    return start
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting for the proxy'
+        time.sleep(0.01)
+
+def test_a_repeated_search_is_served_from_the_cache(proxy_client):
+    client, stub = proxy_client()
+    first = client.get('/api/frappe/search?title=Dune')
+    assert first.status_code == 200 and first.headers['X-Cache'] == 'MISS'
+    # Same query after normalization: case, spacing and unknown params do not change the key
+    again = client.get('/api/frappe/search?title=%20%20dune%20&utm_source=x')
+    assert again.status_code == 200 and again.headers['X-Cache'] == 'HIT'
+    assert again.get_json() == first.get_json()
+    assert stub.requests == [{'title': 'dune'}]
+
+    assert client.get('/api/frappe/search?title=Emma').headers['X-Cache'] == 'MISS'
+    assert len(stub.requests) == 2
+
+def test_identical_searches_in_flight_share_one_upstream_call(proxy_client):
+    release = threading.Event()
+    def slow(query):
+        release.wait(5)
+        return books(query)
+    client, stub = proxy_client(slow)
+    coalesced = frappe_proxy.stats['coalesced']
+
+    results = []
+    def search():
+        response = client.get('/api/frappe/search?title=Dune')
+        results.append((response.status_code, response.headers['X-Cache'], response.get_json()))
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # Hold the upstream answer until every caller has joined the first lookup
+    wait_for(lambda: frappe_proxy.stats['coalesced'] - coalesced == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(stub.requests) == 1
+    assert sorted(source for _, source, _ in results) == ['COALESCED'] * 3 + ['MISS']
+    assert all(status == 200 and body == results[0][2] for status, _, body in results)
+    # Once answered, the query is no longer in flight but cached
+    assert client.get('/api/frappe/search?title=Dune').headers['X-Cache'] == 'HIT'
+
+def test_searches_past_the_rate_limit_queue_then_get_429(proxy_client):
+    # One call per 10 s after a burst of one; a caller may queue for at most FRAPPE_TIMEOUT
+    client, stub = proxy_client(FRAPPE_RATE_LIMIT=0.1, FRAPPE_RATE_BURST=1, FRAPPE_TIMEOUT=2)
+    rate_limited = frappe_proxy.stats['rate_limited']
+    assert client.get('/api/frappe/search?title=Dune').status_code == 200
+
+    response = client.get('/api/frappe/search?title=Emma')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 2
+    assert frappe_proxy.stats['rate_limited'] - rate_limited == 1
+    assert len(stub.requests) == 1
+    # Cached answers do not spend tokens
+    assert client.get('/api/frappe/search?title=Dune').status_code == 200
+
+def test_a_short_deficit_is_waited_out_rather_than_refused(proxy_client):
+    client, stub = proxy_client(FRAPPE_RATE_LIMIT=5, FRAPPE_RATE_BURST=1, FRAPPE_TIMEOUT=2)
+    started = time.monotonic()
+    assert client.get('/api/frappe/search?title=Dune').status_code == 200
+    assert client.get('/api/frappe/search?title=Emma').status_code == 200
+    # The second call waited for the next token, 1 / FRAPPE_RATE_LIMIT seconds
+    assert time.monotonic() - started >= 0.15
+    assert len(stub.requests) == 2
+
+@pytest.mark.parametrize('body', [b'<html>Bad gateway</html>', [1, 2], {'message': 'Not found'}])
+def test_a_malformed_upstream_answer_is_a_502_and_not_cached(proxy_client, body):
+    client, stub = proxy_client(lambda query: (200, body))
+    errors = frappe_proxy.stats['errors']
+    response = client.get('/api/frappe/search?title=Dune')
+    assert response.status_code == 502 and 'Frappe API returned' in response.get_json()['error']
+    assert frappe_proxy.stats['errors'] - errors == 1
+    assert client.get('/api/frappe/search?title=Dune').status_code == 502
+    assert len(stub.requests) == 2
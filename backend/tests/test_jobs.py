@@ -0,0 +1,134 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from app import db
+from app.models import Job
+from app.utils.jobs import JOB_TYPES, JobRunner, JobType, QUEUED, RUNNING, FINISHED, FAILED, enqueue
+
+class Deferred:
+    """Executor stand-in that keeps submitted jobs for the test to run"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append((func, args))
+
+    def run_all(self):
+        while self.submitted:
+            func, args = self.submitted.pop(0)
+            func(*args)
+
+def make_runner(app, name):
+    runner = JobRunner()
+    runner.init_app(app)
+    runner.worker_id = name
+    runner._executor = Deferred()
+    return runner
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Registers test job types; 'flaky' fails until it has been called `fail_times` times"""
+    calls = {'echo': [], 'flaky': [], 'fail_times': 1}
+
+    def echo(params, progress):
+        calls['echo'].append(params)
+        progress['done'] = 1
+        return {'echoed': params}
+
+    def flaky(params, progress):
+        calls['flaky'].append(params)
+        if len(calls['flaky']) <= calls['fail_times']:
+            raise RuntimeError('upstream down')
+        return {'ok': True}
+
+    monkeypatch.setitem(JOB_TYPES, 'test_echo', JobType('test_echo', echo, concurrency=1, max_attempts=1))
+    monkeypatch.setitem(JOB_TYPES, 'test_flaky', JobType('test_flaky', flaky, concurrency=1, max_attempts=2))
+    return calls
+
+def test_a_queued_job_runs_once_and_keeps_its_result(app, calls):
+    job_id = enqueue('test_echo', {'n': 1}).id
+    first, second = make_runner(app, 'first'), make_runner(app, 'second')
+    first._dispatch()
+    second._dispatch()
+    assert len(first._executor.submitted) == 1 and not second._executor.submitted
+
+    first._executor.run_all()
+    db.session.expire_all()
+    job = Job.query.get(job_id)
+    assert job.status == FINISHED and job.locked_by is None and job.attempts == 1
+    assert json.loads(job.result) == {'echoed': {'n': 1}} and json.loads(job.progress) == {'done': 1}
+    assert calls['echo'] == [{'n': 1}]
+
+def test_concurrency_holds_when_another_runner_claims_in_between(app, calls):
+    first = enqueue('test_echo', {'n': 1}).id
+    enqueue('test_echo', {'n': 2})
+    runner = make_runner(app, 'mine')
+    raced = []
+
+    def claim_elsewhere(conn, cursor, statement, parameters, context, executemany):
+        # Another runner claims the first job after this one has listed the due jobs
+        if statement.startswith('SELECT job.id') and not raced:
+            raced.append(True)
+            conn.execute(Job.__table__.update().where(Job.__table__.c.id == first)
+                         .values(status=RUNNING, locked_by='other', attempts=1))
+
+    event.listen(db.engine, 'after_cursor_execute', claim_elsewhere)
+    try:
+        runner._dispatch()
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', claim_elsewhere)
+    assert raced
+    assert not runner._executor.submitted
+    assert Job.query.filter_by(status=RUNNING).count() == 1
+
+def test_a_failed_job_is_retried_after_a_backoff_then_fails_for_good(app, calls):
+    calls['fail_times'] = 2
+    job_id = enqueue('test_flaky', {}).id
+    runner = make_runner(app, 'mine')
+    runner._dispatch()
+    runner._executor.run_all()
+    db.session.expire_all()
+    job = Job.query.get(job_id)
+    assert job.status == QUEUED and job.error == 'upstream down' and job.attempts == 1
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=runner.retry_backoff - 1)
+
+    # Not due yet
+    runner._dispatch()
+    assert not runner._executor.submitted
+    job.run_after = datetime.utcnow()
+    db.session.commit()
+    runner._dispatch()
+    runner._executor.run_all()
+    db.session.expire_all()
+    job = Job.query.get(job_id)
+    assert job.status == FAILED and job.attempts == 2 and job.finished_at is not None
+    assert len(calls['flaky']) == 2
+
+def test_the_heartbeat_saves_progress_and_stale_jobs_are_taken_back(app, calls):
+    old = datetime.utcnow() - timedelta(hours=1)
+    db.session.add_all([
+        Job(id='alive', type='test_flaky', status=RUNNING, attempts=1, max_attempts=2, locked_by='mine', heartbeat_at=old),
+        Job(id='retry', type='test_flaky', status=RUNNING, attempts=1, max_attempts=2, locked_by='gone', heartbeat_at=old),
+        Job(id='spent', type='test_flaky', status=RUNNING, attempts=2, max_attempts=2, locked_by='gone', heartbeat_at=old),
+    ])
+    db.session.commit()
+    runner = make_runner(app, 'mine')
+    runner.running = {'alive': {'pages': 3}}
+
+    runner._heartbeat()
+    runner._requeue_stale()
+    db.session.expire_all()
+    jobs = {job.id: job for job in Job.query}
+    assert jobs['alive'].status == RUNNING and json.loads(jobs['alive'].progress) == {'pages': 3}
+    assert jobs['alive'].heartbeat_at > old
+    assert jobs['retry'].status == QUEUED and jobs['retry'].locked_by is None
+    assert jobs['spent'].status == FAILED and jobs['spent'].error == 'Runner stopped responding'
+
+def test_job_listing_clamps_the_limit(client, calls):
+    for n in range(3):
+        enqueue('test_echo', {'n': n})
+    assert len(client.get('/api/jobs?limit=-5').get_json()) == 1
+    assert len(client.get('/api/jobs?limit=2').get_json()) == 2
+    assert client.post('/api/jobs', json={'type': 'nope'}).status_code == 400
@@ -0,0 +1,29 @@
+from sqlalchemy import event
+from app import db
+from app.models import LedgerEntry, Member
+from app.utils.ledger import charge_fees, reconcile, to_paise
+
+def test_reconcile_fix_keeps_fees_charged_after_the_check(app):
+    db.session.add_all([Member(name='A', email='a@example.com'), Member(name='B', email='b@example.com')])
+    db.session.commit()
+    charge_fees([(1, None, 10), (2, None, 5)])
+    Member.query.update({Member.debt_paise: 0})
+    db.session.commit()
+    charged = []
+
+    def charge_meanwhile(conn, cursor, statement, parameters, context, executemany):
+        # A return charges a fee between the ledger read and the fix
+        if statement.startswith('SELECT ledger_entry.member_id') and not charged:
+            charged.append(True)
+            conn.execute(LedgerEntry.__table__.insert(), {'member_id': 1, 'kind': 'fee', 'amount_paise': 300})
+            conn.execute(Member.__table__.update().where(Member.id == 1)
+                         .values(debt_paise=Member.debt_paise + 300))
+
+    event.listen(db.engine, 'after_cursor_execute', charge_meanwhile)
+    try:
+        checked, mismatches = reconcile(fix=True)
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', charge_meanwhile)
+    assert charged and checked == 2 and [member_id for member_id, _, _ in mismatches] == [1, 2]
+    assert dict(db.session.query(Member.id, Member.debt_paise)) == {1: to_paise(13), 2: to_paise(5)}
+    assert reconcile() == (2, [])
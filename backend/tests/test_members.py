@@ -0,0 +1,19 @@
+from datetime import datetime
+from app import db
+from app.models import Member, Transaction
+from test_transactions import add_loans
+
+def test_member_with_loan_history_is_not_deleted(client):
+    add_loans(2)
+    Transaction.query.update({Transaction.return_date: datetime.utcnow()})
+    db.session.commit()
+    response = client.delete('/api/members/1')
+    assert response.status_code == 400 and 'loan history' in response.get_json()['error']
+    assert Member.query.get(1) is not None and Transaction.query.filter_by(member_id=1).count() == 1
+
+def test_member_without_loans_is_deleted(client):
+    db.session.add(Member(name='New', email='new@example.com', outstanding_debt=0))
+    db.session.commit()
+    assert client.delete('/api/members/1').status_code == 200
+    db.session.remove()
+    assert Member.query.count() == 0
@@ -0,0 +1,11 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+from app import db
+
+def test_failed_statements_do_not_leak_start_times(app):
+    connection = db.session.connection()
+    for _ in range(3):
+        with pytest.raises(OperationalError):
+            connection.exec_driver_sql('SELECT * FROM no_such_table')
+    connection.exec_driver_sql('SELECT 1')
+    assert connection.info['query_start'] == []
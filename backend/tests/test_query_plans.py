@@ -0,0 +1,16 @@
+import pytest
+from app import db
+from benchmarks.datagen import generate
+from benchmarks.explain import explain, hot_queries
+
+@pytest.fixture
+def seeded(app):
+    # Enough rows, and fresh statistics, for the planner to prefer the indexes
+    generate(books=500, members=100, loans=5000, echo=lambda *a, **k: None)
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+def test_hot_queries_use_their_indexes(seeded):
+    missed = {name: explain(query) for name, query, index in hot_queries()
+              if not any(index in line for line in explain(query))}
+    assert not missed
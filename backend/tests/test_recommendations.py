@@ -0,0 +1,91 @@
+from datetime import datetime
+import pytest
+from app import db
+from app.models import Book, Member, Transaction
+from app.utils.recommendations import CoBorrowMatrix, build
+from conftest import make_app
+
+@pytest.fixture
+def rec_app(tmp_path):
+    app = make_app(tmp_path, RECOMMENDATIONS_DIR=str(tmp_path / 'matrix'), RECOMMENDATIONS_RELOAD_SECONDS=0,
+                   RECOMMENDATIONS_MIN_SUPPORT=1)
+    with app.app_context():
+        db.session.add_all([Book(title=f'Book {i}', author='Author', isbn=f'{i:013d}', stock=5) for i in range(1, 7)])
+        db.session.add_all([Member(name=f'Member {i}', email=f'member{i}@example.com') for i in range(1, 5)])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+def lend(*loans, ids=None):
+    """Add (member_id, book_id) loans, with explicit ids when given"""
+    for n, (member_id, book_id) in enumerate(loans):
+        db.session.add(Transaction(id=ids[n] if ids else None, member_id=member_id, book_id=book_id,
+                                   issue_date=datetime.utcnow()))
+    db.session.commit()
+
+def pairs(directory):
+    """{(book, other): members who borrowed both} and {book: borrowers} of the saved matrix"""
+    matrix = CoBorrowMatrix.load(directory)
+    together = {}
+    for book_id in range(matrix.n_books):
+        start, end = matrix.indptr[book_id], matrix.indptr[book_id + 1]
+        together.update({(book_id, int(other)): int(count)
+                         for other, count in zip(matrix.indices[start:end], matrix.counts[start:end])})
+    return together, {book_id: int(n) for book_id, n in enumerate(matrix.popularity) if n}
+
+def test_incremental_builds_match_a_full_build(rec_app, tmp_path):
+    directory = rec_app.config['RECOMMENDATIONS_DIR']
+    lend((1, 1), (1, 2), (2, 1), (2, 3))
+    build(directory)
+    lend((1, 3), (2, 2), (3, 1), (3, 2), (1, 1))
+    progress = build(directory)
+    assert progress['members'] == 3
+    lend((4, 4), (4, 1))
+    build(directory)
+
+    full = str(tmp_path / 'full')
+    build(full, full=True)
+    assert pairs(directory) == pairs(full)
+    together, borrowers = pairs(directory)
+    assert together[(1, 2)] == together[(2, 1)] == 3 and borrowers[1] == 4
+
+def test_a_build_with_no_new_loans_publishes_nothing(rec_app):
+    directory = rec_app.config['RECOMMENDATIONS_DIR']
+    lend((1, 1), (1, 2))
+    assert 'version' in build(directory)
+    assert 'version' not in build(directory)
+
+def test_a_loan_that_commits_after_a_later_id_is_not_lost(rec_app, tmp_path):
+    directory = rec_app.config['RECOMMENDATIONS_DIR']
+    lend((1, 1), (1, 2), ids=[1, 2])
+    # Loan 3 is still committing when loan 4 has been read
+    lend((2, 1), ids=[4])
+    build(directory)
+    lend((2, 2), ids=[3])
+    assert build(directory)['members'] == 1
+
+    full = str(tmp_path / 'full')
+    build(full, full=True)
+    assert pairs(directory) == pairs(full)
+    assert pairs(directory)[0][(1, 2)] == 2
+
+def test_endpoints_serve_the_saved_matrix(rec_app):
+    client = rec_app.test_client()
+    assert client.get('/api/recommendations').get_json() == {'error': 'Recommendations have not been built yet'}
+    assert client.get('/api/recommendations/books/1').get_json()['items'] == []
+
+    lend((1, 1), (1, 2), (2, 1), (2, 2), (2, 3), (3, 1), (3, 4))
+    build(rec_app.config['RECOMMENDATIONS_DIR'])
+    status = client.get('/api/recommendations').get_json()
+    assert status['last_transaction_id'] == 7 and status['pairs'] == 8
+
+    items = client.get('/api/recommendations/books/1').get_json()['items']
+    assert [item['id'] for item in items] == [2, 3, 4]
+    assert items[0]['borrowed_together'] == 2 and items[0]['title'] == 'Book 2'
+    assert len(client.get('/api/recommendations/books/1?limit=1').get_json()['items']) == 1
+
+    # Member 3 borrowed books 1 and 4; suggestions leave those out
+    items = client.get('/api/recommendations/members/3').get_json()['items']
+    assert [item['id'] for item in items] == [2, 3]
+    assert client.get('/api/recommendations/members/99').status_code == 404
+    assert client.get('/api/recommendations/books/99').status_code == 404
@@ -0,0 +1,119 @@
+import threading
+import time
+import pytest
+from app import db
+from app.models import Book, ChangeEvent
+from app.utils import search_index as search_module
+from app.utils.events import publish
+from app.utils.search_index import search_index
+from app.utils.serialization import book_to_dict
+from conftest import make_app
+
+@pytest.fixture
+def search_app(tmp_path):
+    # Catch up with other processes' writes on every search
+    app = make_app(tmp_path, SEARCH_SYNC_SECONDS=0)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+def add_book(client, title, author, isbn, publisher=None):
+    response = client.post('/api/books', json={'title': title, 'author': author, 'isbn': isbn, 'publisher': publisher})
+    assert response.status_code == 201
+
+def write_elsewhere(kind, data):
+    """A book change committed by another process: in the table and the change feed, not in this index"""
+    publish(kind, data)
+    db.session.commit()
+
+def titles(client, query, **args):
+    body = client.get('/api/books/search', query_string={'q': query, **args}).get_json()
+    return [item['title'] for item in body['items']]
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting for the search index'
+        time.sleep(0.01)
+
+def test_search_ranks_prefix_matches_across_fields(search_app):
+    client = search_app.test_client()
+    add_book(client, 'The Silent River', 'Meera Nair', '9780000000001')
+    add_book(client, 'Garden Songs', 'Silas River', '9780000000002', publisher='River Press')
+    add_book(client, 'Silver Linings', 'Arjun Rao', '9780000000003')
+
+    # A title match outweighs author and publisher matches
+    assert titles(client, 'river') == ['The Silent River', 'Garden Songs']
+    # Typeahead: a prefix matches every word it starts, and every query word must match
+    assert titles(client, 'sil') == ['The Silent River', 'Silver Linings', 'Garden Songs']
+    assert titles(client, 'sil riv') == ['The Silent River', 'Garden Songs']
+    assert titles(client, 'nothing') == [] and titles(client, '') == []
+
+    page = client.get('/api/books/search?q=sil&limit=1&offset=1').get_json()
+    assert page['total'] == 3 and [item['title'] for item in page['items']] == ['Silver Linings']
+    assert page['truncated'] is False
+
+def test_search_follows_writes_made_in_other_processes(search_app):
+    client = search_app.test_client()
+    add_book(client, 'Winter Song', 'Kabir Das', '9780000000001')
+    assert titles(client, 'winter') == ['Winter Song']
+
+    other = Book(title='Winter Kingdom', author='Priya Iyer', isbn='9780000000002')
+    db.session.add(other)
+    db.session.flush()
+    write_elsewhere('book.created', book_to_dict(other))
+    assert titles(client, 'winter') == ['Winter Song', 'Winter Kingdom']
+
+    other.title = 'Summer Kingdom'
+    write_elsewhere('book.updated', book_to_dict(other))
+    assert titles(client, 'winter') == ['Winter Song']
+    assert titles(client, 'summer') == ['Summer Kingdom']
+
+    other_id = other.id
+    db.session.delete(other)
+    write_elsewhere('book.deleted', {'id': other_id})
+    assert titles(client, 'kingdom') == []
+
+def test_catch_up_waits_at_a_gap_then_moves_past_it(search_app, monkeypatch):
+    client = search_app.test_client()
+    add_book(client, 'Glass Island', 'Rohan Joshi', '9780000000001')
+    assert titles(client, 'glass') == ['Glass Island']
+
+    # Event ids skip one, as when a transaction that took an id has not committed yet
+    late = Book(title='Glass Queen', author='Neha Singh', isbn='9780000000002')
+    db.session.add(late)
+    db.session.flush()
+    skipped = db.session.query(db.func.max(ChangeEvent.id)).scalar() + 1
+    db.session.add(ChangeEvent(id=skipped + 1, type='book.created', data=f'{{"id": {late.id}, '
+                                                                       f'"title": "Glass Queen", "author": "Neha Singh"}}'))
+    db.session.commit()
+    assert titles(client, 'glass') == ['Glass Island']
+    assert search_index.event_id == skipped - 1
+
+    # Once the grace period is over, the gap is taken to be a rollback
+    monkeypatch.setattr(search_module, 'GAP_GRACE_SECONDS', 0)
+    assert titles(client, 'glass') == ['Glass Island', 'Glass Queen']
+    assert search_index.event_id == skipped + 1
+
+def test_a_bulk_import_elsewhere_rebuilds_the_index_off_the_request_path(search_app, monkeypatch):
+    client = search_app.test_client()
+    add_book(client, 'Paper Star', 'Diya Mehta', '9780000000001')
+    assert titles(client, 'paper') == ['Paper Star']
+
+    db.session.add_all(Book(title=f'Paper Moon {i}', author='Vikram Bose', isbn=f'97800000001{i:02d}') for i in range(3))
+    publish('books.imported', {'inserted': 3, 'updated': 0})
+    db.session.commit()
+
+    release = threading.Event()
+    load = search_module._load
+    def slow_load(index):
+        release.wait(5)
+        load(index)
+    monkeypatch.setattr(search_module, '_load', slow_load)
+
+    # Answered from the current index while the rebuild waits
+    assert titles(client, 'paper') == ['Paper Star']
+    assert search_index.rebuilding
+    release.set()
+    wait_for(lambda: not search_index.rebuilding)
+    assert titles(client, 'paper') == ['Paper Star'] + [f'Paper Moon {i}' for i in range(3)]
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app import db
+from app.models import Book, Member, Transaction
+
+def add_loans(count):
+    books = [Book(title=f'Book {i}', author='Author', isbn=f'{i:013d}', stock=1) for i in range(count)]
+    members = [Member(name=f'Member {i}', email=f'member{i}@example.com') for i in range(count)]
+    db.session.add_all(books + members)
+    db.session.flush()
+    db.session.add_all(Transaction(book_id=book.id, member_id=member.id,
+                                   issue_date=datetime.utcnow() - timedelta(days=i))
+                       for i, (book, member) in enumerate(zip(books, members)))
+    db.session.commit()
+
+def test_active_transactions_is_one_query_regardless_of_loan_count(client, count_queries):
+    add_loans(3)
+    with count_queries() as few:
+        assert len(client.get('/api/transactions/active').get_json()) == 3
+    more = [Book(title=f'More {i}', author='Author', isbn=f'9{i:012d}', stock=1) for i in range(40)]
+    db.session.add_all(more)
+    db.session.flush()
+    member = Member.query.first()
+    db.session.add_all(Transaction(book_id=book.id, member_id=member.id, issue_date=datetime.utcnow()) for book in more)
+    db.session.commit()
+
+    with count_queries() as many:
+        loans = client.get('/api/transactions/active').get_json()
+    assert len(loans) == 43
+    assert len(many) == len(few) == 1
+    assert {'id', 'book', 'member', 'issue_date'} <= set(loans[0])
+
+def test_active_transactions_page_is_one_query(client, count_queries):
+    add_loans(5)
+    with count_queries() as queries:
+        page = client.get('/api/transactions/active?limit=2').get_json()
+    assert len(page['items']) == 2 and page['next_after'] == page['items'][-1]['id']
+    assert len(queries) == 1
+
+def test_batch_issue_reports_each_item_and_takes_stock_for_the_issued_ones(app, client):
+    books = [Book(title='Two Copies', author='Author', isbn='9780000000001', stock=2),
+             Book(title='One Copy', author='Author', isbn='9780000000002', stock=1)]
+    members = [Member(name='Reader', email='reader@example.com'),
+               Member(name='Debtor', email='debtor@example.com', outstanding_debt=600)]
+    db.session.add_all(books + members)
+    db.session.commit()
+    two, one = (book.id for book in books)
+    reader, debtor = (member.id for member in members)
+
+    response = client.post('/api/transactions/issue/batch', json={'items': [
+        {'book_id': two, 'member_id': reader},
+        {'book_id': one, 'member_id': reader},
+        {'book_id': one, 'member_id': reader},
+        {'book_id': 999, 'member_id': reader},
+        {'book_id': two, 'member_id': 999},
+        {'book_id': two, 'member_id': debtor},
+    ]})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body['issued'] == 2
+    assert [(result['status'], result.get('error')) for result in body['results']] == [
+        ('issued', None), ('issued', None), ('error', 'Book not available'), ('error', 'Book not found'),
+        ('error', 'Member not found'), ('error', 'Member has outstanding debt over Rs. 500')]
+
+    db.session.expire_all()
+    assert (Book.query.get(two).stock, Book.query.get(one).stock) == (1, 0)
+    assert Transaction.query.filter_by(member_id=reader, return_date=None).count() == 2
+
+def test_batch_issue_takes_nothing_when_stock_changes_underneath(app, client):
+    book = Book(title='Last Copy', author='Author', isbn='9780000000001', stock=1)
+    member = Member(name='Reader', email='reader@example.com')
+    db.session.add_all([book, member])
+    db.session.commit()
+    book_id, member_id = book.id, member.id
+    raced = []
+
+    def take_last_copy(conn, cursor, statement, parameters, context, executemany):
+        # Another request takes the copy after this one has read the stock (no row locks on SQLite)
+        if statement.startswith('SELECT book.id') and not raced:
+            raced.append(True)
+            conn.execute(Book.__table__.update().where(Book.__table__.c.id == book_id).values(stock=0))
+
+    event.listen(db.engine, 'after_cursor_execute', take_last_copy)
+    try:
+        response = client.post('/api/transactions/issue/batch',
+                               json={'items': [{'book_id': book_id, 'member_id': member_id}]})
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', take_last_copy)
+    assert raced and response.status_code == 409
+    assert Transaction.query.count() == 0
+
+def test_batch_return_closes_loans_and_restocks(client):
+    add_loans(2)
+    loans = [loan.id for loan in Transaction.query.order_by(Transaction.id)]
+    response = client.put('/api/transactions/return/batch', json={'transaction_ids': loans + [loans[0], 999]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['returned'] == 2
+    assert [(result['status'], result.get('error')) for result in body['results']] == [
+        ('returned', None), ('returned', None), ('error', 'Book already returned'), ('error', 'Transaction not found')]
+    # The second loan was issued a day ago
+    assert body['results'][1]['rent_fee'] == body['results'][1]['total_debt'] == 10
+
+    db.session.expire_all()
+    assert Transaction.query.filter_by(return_date=None).count() == 0
+    assert [book.stock for book in Book.query.order_by(Book.id)] == [2, 2]
+    # Returning again changes nothing
+    again = client.put('/api/transactions/return/batch', json={'transaction_ids': loans}).get_json()
+    assert again['returned'] == 0 and {result['error'] for result in again['results']} == {'Book already returned'}
+
+def test_batches_over_the_size_cap_are_refused(app, client):
+    app.config['MAX_BATCH_SIZE'] = 2
+    add_loans(3)
+    items = [{'book_id': book.id, 'member_id': book.id} for book in Book.query]
+    response = client.post('/api/transactions/issue/batch', json={'items': items})
+    assert response.status_code == 400 and response.get_json()['error'] == 'At most 2 items per batch'
+    loans = [loan.id for loan in Transaction.query]
+    assert client.put('/api/transactions/return/batch', json={'transaction_ids': loans}).status_code == 400
+    assert Transaction.query.filter_by(return_date=None).count() == 3
@@ -0,0 +1,8 @@
+"""Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+The schema is managed with `flask db upgrade`, never created at boot.
+"""
+from app import create_app
+from app.config import ProductionConfig
+
+app = create_app(ProductionConfig)
@@ -5,7 +5,6 @@ import api from '../services/api';
 
 const BookList = () => {
   const [books, setBooks] = useState([]);
-  const [filteredBooks, setFilteredBooks] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
@@ -13,29 +12,39 @@ const BookList = () => {
 
   useEffect(() => {
     loadBooks();
+
+    // Apply changes made at other desks instead of re-downloading the catalog
+    const update = (apply) => (event) => setBooks((list) => apply(list, JSON.parse(event.data)));
+    return api.subscribeChanges({
+      'book.created': update((list, book) => [...list.filter((b) => b.id !== book.id), book]),
+      'book.updated': update((list, book) => list.map((b) => (b.id === book.id ? book : b))),
+      'book.deleted': update((list, { id }) => list.filter((b) => b.id !== id)),
+      'book.stock': update((list, { id, stock }) => list.map((b) => (b.id === id ? { ...b, stock } : b))),
+      // Bulk imports and missed events: reload the whole list
+      'books.imported': loadBooks,
+      reset: loadBooks
+    });
   }, []);
 
   const loadBooks = async () => {
     try {
       const response = await api.getBooks();
       setBooks(response.data);
-      setFilteredBooks(response.data);
     } catch (error) {
       console.error('Error loading books:', error);
     }
   };
 
   const handleSearch = (event) => {
-    const term = event.target.value.toLowerCase();
-    setSearchTerm(term);
-    const filtered = books.filter(
-      (book) =>
-        book.title.toLowerCase().includes(term) ||
-        book.author.toLowerCase().includes(term)
-    );
-    setFilteredBooks(filtered);
+    setSearchTerm(event.target.value.toLowerCase());
   };
 
+  const filteredBooks = books.filter(
+    (book) =>
+      book.title.toLowerCase().includes(searchTerm) ||
+      book.author.toLowerCase().includes(searchTerm)
+  );
+
   const handleEdit = async (book) => {
     setEditingBook(book);
   };
@@ -45,7 +54,7 @@ const BookList = () => {
       setLoading(true);
       await api.updateBook(book.id, book);
       setEditingBook(null);
-      loadBooks();
+      setBooks((list) => list.map((b) => (b.id === book.id ? book : b)));
     } catch (error) {
       setError(error.response?.data?.error || 'Failed to update book');
     } finally {
@@ -59,7 +68,7 @@ const BookList = () => {
     try {
       setLoading(true);
       await api.deleteBook(bookId);
-      loadBooks();
+      setBooks((list) => list.filter((b) => b.id !== bookId));
     } catch (error) {
       setError(error.response?.data?.error || 'Failed to delete book');
     } finally {
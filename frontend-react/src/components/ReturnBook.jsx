@@ -10,6 +10,19 @@ const ReturnBook = () => {
 
   useEffect(() => {
     loadActiveTransactions();
+
+    // Keep the list current as loans are issued and returned at other desks
+    return api.subscribeChanges({
+      'loan.issued': (event) => {
+        const loan = JSON.parse(event.data);
+        setTransactions((list) => [...list.filter((t) => t.id !== loan.id), loan]);
+      },
+      'loan.returned': (event) => {
+        const { id } = JSON.parse(event.data);
+        setTransactions((list) => list.filter((t) => t.id !== id));
+      },
+      reset: loadActiveTransactions
+    });
   }, []);
 
   const loadActiveTransactions = async () => {
@@ -29,7 +42,7 @@ const ReturnBook = () => {
     try {
       const response = await api.returnBook(transactionId);
       setSuccess(response.data.message);
-      loadActiveTransactions(); // Refresh the list
+      setTransactions((list) => list.filter((t) => t.id !== transactionId));
     } catch (error) {
       setError(error.response?.data?.error || "Failed to return book");
     } finally {
@@ -4,6 +4,8 @@ const API_URL = "http://localhost:5000/api";
 
 const axiosInstance = axios.create({
   baseURL: API_URL,
+  // Sends back the cookie that keeps reads on the primary right after a write
+  withCredentials: true,
   headers: {
     'Content-Type': 'application/json'
   }
@@ -16,6 +18,69 @@ axiosInstance.interceptors.request.use((config) => {
   return config;
 });
 
+// One change-feed stream per tab, shared by every subscribed component.
+// EventSource reconnects by itself when a stream ends, but gives up for good
+// when the server answers with an error (503 when it is serving too many
+// streams); then a new one is opened after a growing, jittered delay, resuming
+// from the last event seen.
+const changeHandlers = new Map();
+let changeSource = null;
+let lastEventId = null;
+let retryDelay = 1000;
+let retryTimer = null;
+
+const dispatchChange = (event) => {
+  if (event.lastEventId) lastEventId = event.lastEventId;
+  changeHandlers.get(event.type)?.forEach((handler) => handler(event));
+};
+
+const openChangeSource = () => {
+  const query = lastEventId ? `?last_event_id=${lastEventId}` : '';
+  const source = new EventSource(`${API_URL}/events${query}`, { withCredentials: true });
+  changeHandlers.forEach((handlers, type) => source.addEventListener(type, dispatchChange));
+  source.onopen = () => {
+    retryDelay = 1000;
+  };
+  source.onerror = () => {
+    if (source.readyState !== EventSource.CLOSED) return;
+    changeSource = null;
+    retryTimer = setTimeout(() => {
+      retryTimer = null;
+      if (changeHandlers.size) changeSource = openChangeSource();
+    }, retryDelay * (0.5 + Math.random()));
+    retryDelay = Math.min(retryDelay * 2, 60000);
+  };
+  return source;
+};
+
+// Calls handlers[type](event) for each change event of that type; returns the unsubscribe function
+const subscribeChanges = (handlers) => {
+  Object.entries(handlers).forEach(([type, handler]) => {
+    if (!changeHandlers.has(type)) {
+      changeHandlers.set(type, new Set());
+      changeSource?.addEventListener(type, dispatchChange);
+    }
+    changeHandlers.get(type).add(handler);
+  });
+  if (!changeSource && !retryTimer) changeSource = openChangeSource();
+
+  return () => {
+    Object.entries(handlers).forEach(([type, handler]) => {
+      changeHandlers.get(type)?.delete(handler);
+      if (changeHandlers.get(type)?.size === 0) {
+        changeHandlers.delete(type);
+        changeSource?.removeEventListener(type, dispatchChange);
+      }
+    });
+    if (!changeHandlers.size) {
+      changeSource?.close();
+      changeSource = null;
+      clearTimeout(retryTimer);
+      retryTimer = null;
+    }
+  };
+};
+
 export const api = {
   // Books
   getBooks: () => axiosInstance.get('/books'),
@@ -23,6 +88,7 @@ export const api = {
   updateBook: (id, book) => axiosInstance.put(`/books/${id}`, book),
   deleteBook: (id) => axiosInstance.delete(`/books/${id}`),
   importBooks: (params) => axiosInstance.post('/books/import', params),
+  searchFrappe: (params) => axiosInstance.get('/frappe/search', { params }),
 
   // Members
   getMembers: () => axiosInstance.get('/members'),
@@ -33,7 +99,10 @@ export const api = {
   // Transactions
   getActiveTransactions: () => axiosInstance.get('/transactions/active'),
   createTransaction: (transaction) => axiosInstance.post('/transactions/issue', transaction),
-  returnBook: (transactionId) => axiosInstance.put(`/transactions/return/${transactionId}`)
+  returnBook: (transactionId) => axiosInstance.put(`/transactions/return/${transactionId}`),
+
+  // Server-Sent Events for book, stock and loan changes
+  subscribeChanges
 };
 
 export default api;
@@ -1,10 +1,9 @@
-import axios from 'axios';
-
-const FRAPPE_API_URL = 'https://frappe.io/api/method/frappe-library';
+import api from './api';
 
+// Searches go through the backend proxy, which owns the Frappe URL, caching and rate limiting
 export const searchBooks = async (params) => {
   try {
-    const response = await axios.get(FRAPPE_API_URL, { params });
+    const response = await api.searchFrappe(params);
     return response.data.message;
   } catch (error) {
     console.error('Error fetching books from Frappe API:', error);